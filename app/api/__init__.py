@@ -4,6 +4,7 @@ API包初始化
 from fastapi import APIRouter
 from app.api.routes import router as rag_router
 from app.api.scheduler import router as scheduler_router
+from app.api.metrics import router as metrics_router
 
 # 创建主路由
 api_router = APIRouter()
@@ -11,3 +12,5 @@ api_router = APIRouter()
 # 包含子路由
 api_router.include_router(rag_router, prefix="/api", tags=["rag"])
 api_router.include_router(scheduler_router, prefix="/api", tags=["scheduler"])
+# Prometheus 默认抓取 /metrics，不加 /api 前缀
+api_router.include_router(metrics_router)
@@ -0,0 +1,79 @@
+"""
+API依赖
+每个worker进程在第一次需要时才构建RAG实例，避免导入时连接Milvus、创建LLM客户端
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from fastapi import HTTPException
+
+from app.rag.rag import RAG
+
+logger = logging.getLogger(__name__)
+
+_rag: Optional[RAG] = None
+_rag_lock: Optional[asyncio.Lock] = None
+_last_error: Optional[str] = None
+_last_attempt: float = 0.0
+# 后台初始化任务，保留引用避免任务在执行中被回收
+_init_task: Optional[asyncio.Task] = None
+
+# 初始化失败后，至少间隔这么多秒才会再次尝试
+RAG_INIT_RETRY_INTERVAL = 5.0
+
+
+async def init_rag() -> Optional[RAG]:
+    """构建（或返回已构建的）RAG实例，失败时返回None"""
+    global _rag, _rag_lock, _last_error, _last_attempt
+    if _rag is not None:
+        return _rag
+    if _rag_lock is None:
+        _rag_lock = asyncio.Lock()
+    async with _rag_lock:
+        if _rag is not None:
+            return _rag
+        if _last_error and time.monotonic() - _last_attempt < RAG_INIT_RETRY_INTERVAL:
+            return None
+        _last_attempt = time.monotonic()
+        try:
+            # RAG初始化包含阻塞的网络调用，放到执行器中运行
+            loop = asyncio.get_running_loop()
+            _rag = await loop.run_in_executor(None, RAG)
+            _last_error = None
+            logger.info("RAG实例初始化完成")
+        except Exception as e:
+            _last_error = str(e)
+            logger.error(f"RAG实例初始化失败: {_last_error}")
+    return _rag
+
+
+def start_init() -> Optional[asyncio.Task]:
+    """在后台开始初始化RAG实例，不等待结果；已就绪、正在初始化或距上次失败不足重试间隔时不做任何事"""
+    global _init_task
+    if _rag is not None or (_init_task is not None and not _init_task.done()):
+        return _init_task
+    if _last_error and time.monotonic() - _last_attempt < RAG_INIT_RETRY_INTERVAL:
+        return None
+    if _last_error:
+        logger.info(f"RAG实例上次初始化失败（{_last_error}），在后台重新初始化")
+    _init_task = asyncio.get_running_loop().create_task(init_rag())
+    return _init_task
+
+
+async def get_rag() -> RAG:
+    """FastAPI依赖：获取当前进程的RAG实例，未就绪时返回503"""
+    rag = await init_rag()
+    if rag is None:
+        raise HTTPException(status_code=503, detail=f"服务尚未就绪: {_last_error}", headers={"Retry-After": "5"})
+    return rag
+
+
+def readiness() -> dict:
+    """就绪状态，不等待正在进行的初始化"""
+    return {
+        "ready": _rag is not None,
+        "initializing": _rag is None and _rag_lock is not None and _rag_lock.locked(),
+        "error": _last_error,
+    }
@@ -0,0 +1,12 @@
+from fastapi import APIRouter
+from fastapi.responses import Response
+from app.metrics import render_metrics
+
+# 创建路由器
+router = APIRouter(tags=["metrics"])
+
+@router.get("/metrics", include_in_schema=False)
+def metrics():
+    """Prometheus抓取端点"""
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
@@ -1,11 +1,20 @@
 """
 API路由定义
 """
-from fastapi import APIRouter, HTTPException
-from typing import List, Optional
-from pydantic import BaseModel
+from fastapi import APIRouter, HTTPException, Depends
+from fastapi.responses import JSONResponse
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+from typing import Dict, List, Optional, Literal
+from pydantic import BaseModel, Field, field_validator
+import json
 import logging
-from app.rag.rag import RAG, Document
+import os
+from app.rag.rag import RAG, Document, SearchOptions
+from app.rag.admission import admission, Overloaded, GENERATION, request_deadline
+from app.retriever.index_config import validate_search_params
+from app.net import pool_stats
+from app.api.deps import get_rag, start_init, readiness
 
 # 配置日志
 logger = logging.getLogger(__name__)
@@ -13,13 +22,46 @@ logger = logging.getLogger(__name__)
 # 创建路由
 router = APIRouter()
 
-# 创建RAG实例
-rag = RAG()
+# 单次批量查询允许的最大条数
+BATCH_MAX_QUERIES = int(os.getenv("BATCH_MAX_QUERIES", "32"))
 
 # 定义API模型
-class QueryRequest(BaseModel):
+class SearchRequest(BaseModel):
+    """查询请求共用的检索选项"""
+    # 检索模式，不传时使用服务端默认配置
+    mode: Optional[Literal["vector", "lexical", "hybrid"]] = None
+    # 向量检索参数，如 {"nprobe": 32}（IVF）或 {"ef": 128}（HNSW），不传时使用索引配置
+    search_params: Optional[Dict[str, int]] = None
+    # 多样性重排（MMR），以下选项不传时使用服务端默认配置
+    diversity: Optional[bool] = None
+    # 相关度权重，越小结果越分散
+    mmr_lambda: Optional[float] = Field(None, ge=0.0, le=1.0)
+    # 参与重排的候选数为 top_k 的倍数
+    fetch_multiplier: Optional[int] = Field(None, ge=1, le=50)
+    # 同一作者/朝代最多保留的篇数
+    max_per_author: Optional[int] = Field(None, ge=1)
+    max_per_dynasty: Optional[int] = Field(None, ge=1)
+    # 过滤条件：只在该朝代（如 唐代）、该作者（如 李白）的诗中检索
+    dynasty: Optional[str] = None
+    author: Optional[str] = None
+    # 入库时间范围（Unix时间戳，秒），包含 created_after，不包含 created_before
+    created_after: Optional[int] = Field(None, ge=0)
+    created_before: Optional[int] = Field(None, ge=0)
+    
+    @field_validator("search_params")
+    @classmethod
+    def _check_search_params(cls, value):
+        return validate_search_params(value)
+    
+    def search_options(self) -> SearchOptions:
+        """转换为RAG检索选项"""
+        return SearchOptions(**self.model_dump(include=set(SearchRequest.model_fields), exclude_none=True))
+
+class QueryRequest(SearchRequest):
     query: str
     top_k: Optional[int] = 3
+    # 为True时跳过语义答案缓存，强制重新检索和生成
+    bypass_cache: bool = False
 
 class DocumentResponse(BaseModel):
     title: str
@@ -31,6 +73,41 @@ class QueryResponse(BaseModel):
     query: str
     documents: List[DocumentResponse]
     answer: str
+    cached: bool = False
+    # 本次生成使用的上下文估算token数，命中缓存时为空
+    context_tokens: Optional[int] = None
+
+class BatchQueryRequest(SearchRequest):
+    queries: List[str] = Field(..., min_length=1, max_length=BATCH_MAX_QUERIES)
+    top_k: Optional[int] = 3
+    bypass_cache: bool = False
+    # 为False时只返回检索结果，不调用大模型
+    generate: bool = True
+    # 同时进行的生成调用数，不传时使用服务端默认配置
+    concurrency: Optional[int] = Field(None, ge=1)
+
+class BatchItemResponse(BaseModel):
+    query: str
+    documents: List[DocumentResponse]
+    answer: Optional[str] = None
+    cached: bool = False
+    error: Optional[str] = None
+    context_tokens: Optional[int] = None
+
+class BatchQueryResponse(BaseModel):
+    results: List[BatchItemResponse]
+
+def _overloaded(e: Overloaded) -> HTTPException:
+    """过载拒绝转换为 429/503 响应，带上建议的重试时间"""
+    return HTTPException(status_code=e.status_code, detail=str(e), headers={"Retry-After": str(e.retry_after)})
+
+def _document_response(doc: Document) -> DocumentResponse:
+    return DocumentResponse(
+        title=doc.title,
+        author=doc.author,
+        content=doc.content,
+        similarity=doc.similarity
+    )
 
 @router.get("/")
 def root():
@@ -39,33 +116,166 @@ def root():
     """
     return {"message": "test"}
 
+@router.get("/health/live")
+def liveness():
+    """
+    存活探针，进程能响应即返回200
+    """
+    return {"status": "ok"}
+
+@router.get("/health/ready")
+async def ready():
+    """
+    就绪探针，RAG实例初始化完成后返回200，否则立即返回503并在后台开始初始化，
+    不会等到Milvus、DashScope连接超时
+    """
+    start_init()
+    status = readiness()
+    return JSONResponse(status_code=200 if status["ready"] else 503, content=status)
+
+@router.get("/stats")
+def stats(rag: RAG = Depends(get_rag)):
+    """
+    返回缓存命中、HTTP连接池等运行时统计信息
+    """
+    return dict(rag.stats(), http=pool_stats())
+
 @router.post("/query", response_model=QueryResponse)
-def query(request: QueryRequest):
+async def query(request: QueryRequest, rag: RAG = Depends(get_rag)):
     """
     根据查询文本，返回相关文档和生成的答案
     """
     try:
         logger.info(f"收到查询请求: {request.query}")
         
-        # 调用RAG进行查询
-        result = rag.query(query=request.query, top_k=request.top_k)
+        # 调用RAG进行查询，各阶段排队共用一个截止时间
+        with request_deadline():
+            result = await rag.aquery(
+                query=request.query,
+                top_k=request.top_k,
+                use_cache=not request.bypass_cache,
+                options=request.search_options()
+            )
         
         
         response = QueryResponse(
             query=result["query"],
-            documents=[
-                DocumentResponse(
-                    title=doc.title,
-                    author=doc.author,
-                    content=doc.content,
-                    similarity=doc.similarity
-                ) for doc in result["documents"]
-            ],
-            answer=result["answer"]
+            documents=[_document_response(doc) for doc in result["documents"]],
+            answer=result["answer"],
+            cached=result["cached"],
+            context_tokens=result.get("context_tokens")
         )
         
         return response
         
+    except Overloaded as e:
+        raise _overloaded(e)
     except Exception as e:
         logger.error(f"处理查询时出错: {str(e)}")
         raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+@router.post("/query/batch", response_model=BatchQueryResponse)
+async def query_batch(request: BatchQueryRequest, rag: RAG = Depends(get_rag)):
+    """
+    批量查询：共享一次向量化和一次向量检索，结果按请求顺序返回，单条失败记录在 error 字段
+    """
+    try:
+        logger.info(f"收到批量查询请求: {len(request.queries)} 条")
+        
+        with request_deadline():
+            results = await rag.abatch_query(
+                queries=request.queries,
+                top_k=request.top_k,
+                generate=request.generate,
+                use_cache=not request.bypass_cache,
+                options=request.search_options(),
+                concurrency=request.concurrency
+            )
+        
+        return BatchQueryResponse(results=[
+            BatchItemResponse(
+                query=result["query"],
+                documents=[_document_response(doc) for doc in result["documents"]],
+                answer=result["answer"],
+                cached=result["cached"],
+                error=result["error"],
+                context_tokens=result["context_tokens"]
+            ) for result in results
+        ])
+        
+    except Overloaded as e:
+        raise _overloaded(e)
+    except Exception as e:
+        logger.error(f"处理批量查询时出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+def _sse_event(event: str, data) -> str:
+    """格式化一条Server-Sent Events消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+@router.post("/query/stream")
+async def query_stream(request: QueryRequest, rag: RAG = Depends(get_rag)):
+    """
+    流式查询：先推送检索到的文档，再以SSE逐段推送生成的内容；过载时在开始推送前返回429/503
+    """
+    logger.info(f"收到流式查询请求: {request.query}")
+    
+    # 生成名额跨越整个响应，由这里而不是生成器持有，响应结束、客户端断开或出错时都确定地释放
+    generation_slot = admission.hold(GENERATION)
+    events = rag.astream_query(
+        query=request.query,
+        top_k=request.top_k,
+        use_cache=not request.bypass_cache,
+        options=request.search_options(),
+        generation_slot=generation_slot
+    )
+
+    async def close():
+        try:
+            await events.aclose()
+        finally:
+            generation_slot.release()
+
+    # 第一个事件产出前已经过了所有阶段的准入，在发出响应头之前取得
+    try:
+        with request_deadline():
+            first = await events.__anext__()
+    except StopAsyncIteration:
+        first = None
+    except Overloaded as e:
+        await close()
+        raise _overloaded(e)
+    except Exception as e:
+        await close()
+        logger.error(f"处理流式查询时出错: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"服务器内部错误: {str(e)}")
+
+    async def prefetched():
+        if first is not None:
+            yield first
+            async for item in events:
+                yield item
+
+    async def event_stream():
+        try:
+            async for event, payload in prefetched():
+                if event == "documents":
+                    payload = [_document_response(doc).model_dump() for doc in payload]
+                yield _sse_event(event, payload)
+            yield _sse_event("done", {})
+        except Exception as e:
+            logger.error(f"处理流式查询时出错: {str(e)}")
+            yield _sse_event("error", f"服务器内部错误: {str(e)}")
+        finally:
+            await close()
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # 响应体一次都没有被迭代（如发送响应头时连接已断开）时也释放名额
+        background=BackgroundTask(close),
+        headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # 关闭反向代理缓冲，保证首字节尽快到达
+        },
+    )
@@ -16,7 +16,7 @@ router = APIRouter(
 async def get_tasks():
     """获取所有定时任务的信息"""
     tasks = scheduler_manager.get_task_info()
-    return {"tasks": tasks}
+    return {"tasks": tasks, "is_leader": scheduler_manager.leader_lock.is_leader}
 
 @router.post("/run-crawler-now")
 async def run_crawler_now(background_tasks: BackgroundTasks):
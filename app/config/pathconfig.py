@@ -1,3 +1,6 @@
 import os
 
 BASE_DIR = os.path.dirname(os.path.dirname(__file__))  # 项目根目录
+
+# 本地持久化数据目录（缓存、索引等）
+DATA_DIR = os.getenv("DATA_DIR", os.path.join(BASE_DIR, 'data'))
@@ -0,0 +1,211 @@
+"""
+CSV存档批量入库
+按文件名顺序流式读取 app/poems 下爬虫每天保存的CSV，分块经 去重 -> 批量向量化 -> upsert 写入检索后端，
+每完成一块把进度写入检查点，中断后重新运行会从上次完成的位置继续；全部完成后统一落盘一次
+
+    python -m app.crawler.bulk_load                    # 增量回填，已入库且未变化的诗会被跳过
+    python -m app.crawler.bulk_load --full             # 检索后端被重置后全量恢复
+    python -m app.crawler.bulk_load --restart          # 忽略检查点从头开始
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import logging
+import argparse
+from itertools import islice
+from typing import Dict, Any, Iterator, List, Optional
+
+from app.config.pathconfig import BASE_DIR, DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+POEMS_DIR = os.path.join(BASE_DIR, "poems")
+BULK_LOAD_CHUNK_SIZE = int(os.getenv("BULK_LOAD_CHUNK_SIZE", "500"))
+BULK_LOAD_CHECKPOINT_PATH = os.getenv("BULK_LOAD_CHECKPOINT_PATH",
+                                      os.path.join(DATA_DIR, "bulk_load_checkpoint.json"))
+
+POEM_FIELDS = ("title", "author", "content", "created_at")
+
+
+class Checkpoint:
+    """批量入库进度：每个文件已处理的行数及文件大小/修改时间，文件被改写后从头处理该文件"""
+
+    def __init__(self, path: str = BULK_LOAD_CHECKPOINT_PATH):
+        self.path = path
+        self.state: Dict[str, Any] = {"files": {}, "counts": {}, "full": False}
+
+    @property
+    def resumed(self) -> bool:
+        return bool(self.state["files"])
+
+    def load(self) -> "Checkpoint":
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    self.state = json.load(f)
+            except Exception as e:
+                logger.error(f"检查点文件无效，从头开始: {self.path}: {str(e)}")
+        return self
+
+    def save(self):
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.state, f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def rows_done(self, path: str) -> int:
+        """文件已处理的行数，文件在上次运行后有变化则返回0"""
+        entry = self.state["files"].get(os.path.basename(path))
+        stat = os.stat(path)
+        if not entry or entry["size"] != stat.st_size or entry["mtime"] != stat.st_mtime:
+            return 0
+        return entry["rows_done"]
+
+    def advance(self, path: str, rows_done: int, done: bool = False):
+        stat = os.stat(path)
+        self.state["files"][os.path.basename(path)] = {
+            "rows_done": rows_done, "size": stat.st_size, "mtime": stat.st_mtime, "done": done,
+        }
+
+    def add_counts(self, counts: Dict[str, int]):
+        totals = self.state["counts"]
+        for key, value in counts.items():
+            totals[key] = totals.get(key, 0) + value
+
+
+def read_poems(path: str, skip: int = 0) -> Iterator[Dict[str, Any]]:
+    """流式读取CSV中的诗歌，跳过前 skip 行；缺少标题、作者或内容的行原样产出为None以保持行号"""
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        for row in islice(csv.DictReader(f), skip, None):
+            if not all((row.get(field) or "").strip() for field in ("title", "author", "content")):
+                yield None
+                continue
+            yield {field: row.get(field) or "" for field in POEM_FIELDS}
+
+
+def _chunks(rows: Iterator[Optional[Dict[str, Any]]], size: int) -> Iterator[List[Optional[Dict[str, Any]]]]:
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def bulk_load(poems_dir: str = POEMS_DIR, chunk_size: int = BULK_LOAD_CHUNK_SIZE,
+              checkpoint_path: str = BULK_LOAD_CHECKPOINT_PATH, collection_name: str = None,
+              full: bool = False, restart: bool = False, retriever=None, embedding_model=None,
+              seen_store=None) -> Dict[str, Any]:
+    """把CSV存档批量写入检索后端
+
+    Args:
+        poems_dir: CSV所在目录
+        chunk_size: 每块诗歌数，决定内存占用上限和检查点粒度
+        checkpoint_path: 检查点文件路径
+        collection_name: 集合名称，默认 default_collection_name()
+        full: 清空已入库记录后全量写入（检索后端被重置时使用）；集合为空时自动启用
+        restart: 忽略已有检查点从头开始
+        retriever / embedding_model / seen_store: 默认按配置创建
+
+    Returns:
+        {"status", "message", "data"}，data 为各类诗歌数量和处理的文件数
+    """
+    from app.crawler.dedup import SeenStore
+    from app.crawler.ingest import ingest_poems, finish_ingest
+    from app.retriever import create_retriever, default_collection_name
+    from app.retriever.lexical import rebuild_lexical_index
+
+    files = sorted(glob.glob(os.path.join(poems_dir, "*.csv")))
+    if not files:
+        return {"status": "warning", "message": f"{poems_dir} 下没有CSV文件", "data": None}
+
+    checkpoint = Checkpoint(checkpoint_path)
+    if not restart:
+        checkpoint.load()
+    try:
+        retriever = retriever or create_retriever(
+            collection_name=collection_name or default_collection_name(), create_if_missing=True)
+        if embedding_model is None:
+            from app.rag.rag import DashScopeEmbedding
+            embedding_model = DashScopeEmbedding()
+        seen_store = seen_store or SeenStore.for_retriever(retriever)
+
+        resumed = checkpoint.resumed
+        if resumed:
+            logger.info(f"从检查点继续: {checkpoint.path}")
+        else:
+            if not full and retriever.count() == 0:
+                logger.info("检索后端为空，按全量恢复处理")
+                full = True
+            if full:
+                # 已入库记录与被重置的检索后端不一致，清空后所有诗都会重新向量化写入
+                seen_store.clear()
+            checkpoint.state["full"] = full
+            checkpoint.save()
+
+        for path in files:
+            skip = checkpoint.rows_done(path)
+            entry = checkpoint.state["files"].get(os.path.basename(path))
+            if skip and entry and entry.get("done"):
+                continue
+            rows_done = skip
+            for chunk in _chunks(read_poems(path, skip), chunk_size):
+                poems = [poem for poem in chunk if poem]
+                if poems:
+                    counts = ingest_poems(poems, retriever, embedding_model, seen_store=seen_store, flush=False)
+                    checkpoint.add_counts(counts)
+                checkpoint.add_counts({"skipped": len(chunk) - len(poems)})
+                rows_done += len(chunk)
+                checkpoint.advance(path, rows_done)
+                checkpoint.save()
+            checkpoint.advance(path, rows_done, done=True)
+            checkpoint.save()
+            logger.info(f"{os.path.basename(path)} 处理完成，共{rows_done}行，累计 {checkpoint.state['counts']}")
+
+        finish_ingest(retriever)
+        if resumed:
+            # 之前中断的运行写入的诗只在当时进程的词法索引里，从检索后端重建以保证完整
+            rebuild_lexical_index(retriever)
+        checkpoint.remove()
+    except Exception as e:
+        logger.error(f"批量入库出错，重新运行将从检查点继续: {str(e)}")
+        return {"status": "error", "message": f"批量入库出错: {str(e)}", "data": checkpoint.state["counts"]}
+
+    counts = dict({"new": 0, "updated": 0, "unchanged": 0, "failed": 0, "skipped": 0},
+                  **checkpoint.state["counts"])
+    return {
+        "status": "success",
+        "message": f"处理{len(files)}个文件，新增{counts['new']}首，更新{counts['updated']}首，"
+                   f"未变化{counts['unchanged']}首，失败{counts['failed']}首",
+        "data": dict(counts, files=len(files), count=retriever.count()),
+    }
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="把 app/poems 下的CSV存档批量写入检索后端")
+    parser.add_argument("--dir", default=POEMS_DIR, help="CSV所在目录")
+    parser.add_argument("--chunk-size", type=int, default=BULK_LOAD_CHUNK_SIZE, help="每块诗歌数")
+    parser.add_argument("--checkpoint", default=BULK_LOAD_CHECKPOINT_PATH, help="检查点文件路径")
+    parser.add_argument("--collection", default=None, help="集合名称，默认 MILVUS_COLLECTION_NAME / COLLECTION_NAME")
+    parser.add_argument("--full", action="store_true", help="清空已入库记录后全量写入")
+    parser.add_argument("--restart", action="store_true", help="忽略检查点从头开始")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    result = bulk_load(args.dir, args.chunk_size, args.checkpoint, args.collection,
+                       full=args.full, restart=args.restart)
+    logger.info(f"{result['message']} {result['data']}")
+    return 0 if result["status"] == "success" else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
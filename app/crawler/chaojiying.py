@@ -1,7 +1,7 @@
 
 
-import requests
 from hashlib import md5
+from app.net import get_session
 
 class Chaojiying_Client(object):
 
@@ -19,6 +19,8 @@ class Chaojiying_Client(object):
             'Connection': 'Keep-Alive',
             'User-Agent': 'Mozilla/4.0 (compatible; MSIE 8.0; Windows NT 5.1; Trident/4.0)',
         }
+        # 共享连接池；识别按次计费，POST不自动重试
+        self.session = get_session('chaojiying', retry_post=False)
 
     def PostPic(self, im, codetype):
         """
@@ -30,7 +32,7 @@ class Chaojiying_Client(object):
         }
         params.update(self.base_params)
         files = {'userfile': ('ccc.jpg', im)}
-        r = requests.post('http://upload.chaojiying.net/Upload/Processing.php', data=params, files=files, headers=self.headers)
+        r = self.session.post('http://upload.chaojiying.net/Upload/Processing.php', data=params, files=files, headers=self.headers)
         return r.json()
 
     def PostPic_base64(self, base64_str, codetype):
@@ -43,7 +45,7 @@ class Chaojiying_Client(object):
             'file_base64':base64_str
         }
         params.update(self.base_params)
-        r = requests.post('http://upload.chaojiying.net/Upload/Processing.php', data=params, headers=self.headers)
+        r = self.session.post('http://upload.chaojiying.net/Upload/Processing.php', data=params, headers=self.headers)
         return r.json()
 
     def ReportError(self, im_id):
@@ -54,7 +56,7 @@ class Chaojiying_Client(object):
             'id': im_id,
         }
         params.update(self.base_params)
-        r = requests.post('http://upload.chaojiying.net/Upload/ReportError.php', data=params, headers=self.headers)
+        r = self.session.post('http://upload.chaojiying.net/Upload/ReportError.php', data=params, headers=self.headers)
         return r.json()
 
 
@@ -0,0 +1,124 @@
+"""
+入库去重
+用内容哈希识别每天重复爬到的诗歌，在向量化之前就过滤掉未变化的诗
+"""
+import os
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import List, Dict, Any, Tuple
+
+from app.config.pathconfig import DATA_DIR
+from app.rag.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# 已入库诗歌哈希记录的文件路径
+SEEN_STORE_PATH = os.getenv("SEEN_STORE_PATH", os.path.join(DATA_DIR, "seen_poems.sqlite3"))
+
+
+def _sha1(*parts: str) -> bytes:
+    return hashlib.sha1("\x00".join(normalize_text(part or "") for part in parts).encode("utf-8")).digest()
+
+
+def poem_id(title: str, author: str) -> int:
+    """由标题和作者确定的诗歌主键（63位正整数），同一首诗每次计算结果相同"""
+    return int.from_bytes(_sha1(title, author)[:8], "big") & 0x7FFFFFFFFFFFFFFF
+
+
+def content_hash(title: str, author: str, content: str) -> str:
+    """诗歌内容哈希，内容有变化时哈希随之变化"""
+    return _sha1(title, author, content).hex()
+
+
+def with_hashes(poems: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """为诗歌补充 id 与 content_hash，并去掉同一批次内的重复"""
+    unique = {}
+    for poem in poems:
+        doc_id = poem_id(poem["title"], poem["author"])
+        unique[doc_id] = dict(
+            poem,
+            id=doc_id,
+            content_hash=content_hash(poem["title"], poem["author"], poem["content"])
+        )
+    return list(unique.values())
+
+
+class SeenStore:
+    """已入库诗歌的 主键 -> 内容哈希 记录
+
+    记录按检索后端与集合（retriever.scope）区分，切换后端或集合后新的集合不会因为
+    其他集合的记录而跳过入库。
+
+    Args:
+        scope: 检索器的 scope
+        path: 记录文件路径
+    """
+
+    def __init__(self, scope: str, path: str = SEEN_STORE_PATH):
+        self.scope = scope
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._migrate()
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS seen ("
+            "scope TEXT NOT NULL, id INTEGER NOT NULL, content_hash TEXT NOT NULL, updated_at INTEGER NOT NULL, "
+            "PRIMARY KEY (scope, id))"
+        )
+        self._db.commit()
+
+    def _migrate(self):
+        """早期版本的记录不区分后端与集合，无法判断属于哪个集合，丢弃后由各集合重新记录"""
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(seen)")}
+        if columns and "scope" not in columns:
+            self._db.execute("DROP TABLE seen")
+            logger.warning("已入库记录升级为按检索后端与集合区分，旧记录已丢弃，下次入库会重新向量化全部诗歌")
+
+    @classmethod
+    def for_retriever(cls, retriever, path: str = SEEN_STORE_PATH) -> "SeenStore":
+        return cls(retriever.scope, path)
+
+    def classify(self, poems: List[Dict[str, Any]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """把带哈希的诗歌分为 (新增, 未变化, 内容有更新) 三组"""
+        seen = {}
+        ids = [poem["id"] for poem in poems]
+        with self._lock:
+            # 分段查询，避免超过SQLite参数个数上限
+            for start in range(0, len(ids), 500):
+                chunk = ids[start:start + 500]
+                placeholders = ",".join("?" * len(chunk))
+                seen.update(self._db.execute(
+                    f"SELECT id, content_hash FROM seen WHERE scope = ? AND id IN ({placeholders})",
+                    [self.scope] + chunk
+                ))
+
+        new, unchanged, updated = [], [], []
+        for poem in poems:
+            previous = seen.get(poem["id"])
+            if previous is None:
+                new.append(poem)
+            elif previous == poem["content_hash"]:
+                unchanged.append(poem)
+            else:
+                updated.append(poem)
+        return new, unchanged, updated
+
+    def clear(self):
+        """清空记录，检索后端被重置后全量重新入库时使用"""
+        with self._lock:
+            self._db.execute("DELETE FROM seen WHERE scope = ?", (self.scope,))
+            self._db.commit()
+
+    def mark(self, poems: List[Dict[str, Any]]):
+        """记录已成功写入的诗歌"""
+        now = int(time.time())
+        with self._lock:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO seen (scope, id, content_hash, updated_at) VALUES (?, ?, ?, ?)",
+                [(self.scope, poem["id"], poem["content_hash"], now) for poem in poems]
+            )
+            self._db.commit()
@@ -0,0 +1,194 @@
+"""
+并发分页抓取
+按列表页（收藏夹、首页推荐、作者、标签）生成分页URL，在线程池中并发抓取，
+每个主机一个令牌桶限制请求速率，页面在内存中直接解析为诗歌
+"""
+import os
+import time
+import logging
+import threading
+from datetime import datetime
+from urllib.parse import urlsplit, quote
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Dict, Any, Iterator, Tuple, Optional
+
+from bs4 import BeautifulSoup
+
+from app.metrics import record_upstream
+
+logger = logging.getLogger(__name__)
+
+# 并发与限速配置
+CRAWL_CONCURRENCY = int(os.getenv("CRAWL_CONCURRENCY", "8"))                 # 同时抓取的页面数
+CRAWL_RATE_PER_HOST = float(os.getenv("CRAWL_RATE_PER_HOST", "4"))           # 每个主机每秒请求数
+CRAWL_BURST_PER_HOST = int(os.getenv("CRAWL_BURST_PER_HOST", "4"))           # 每个主机允许的突发请求数
+# 分页配置：每个列表最多抓取的页数，某页没有诗歌时该列表后续页不再抓取
+CRAWL_MAX_PAGES = int(os.getenv("CRAWL_MAX_PAGES", "10"))
+# 逗号分隔的作者和标签列表，如 CRAWL_AUTHORS=李白,杜甫 CRAWL_TAGS=春天,思乡
+CRAWL_AUTHORS = [name.strip() for name in os.getenv("CRAWL_AUTHORS", "").split(",") if name.strip()]
+CRAWL_TAGS = [tag.strip() for tag in os.getenv("CRAWL_TAGS", "").split(",") if tag.strip()]
+
+GUSHIWEN_HOST = "https://www.gushiwen.cn"
+SEARCH_HOST = "https://so.gushiwen.cn"
+COLLECT_URL = GUSHIWEN_HOST + "/user/collect.aspx?type=s&page={page}"
+HOME_URL = GUSHIWEN_HOST + "/default_{page}.aspx"
+AUTHOR_URL = SEARCH_HOST + "/shiwens/default.aspx?astr={name}&page={page}"
+TAG_URL = SEARCH_HOST + "/shiwens/default.aspx?tstr={name}&page={page}"
+
+
+class TokenBucket:
+    """令牌桶：以 rate 个/秒的速度补充令牌，最多积累 capacity 个，acquire 在没有令牌时阻塞等待"""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = max(1, capacity)
+        self._tokens = float(self.capacity)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """取一个令牌，返回等待的秒数"""
+        if self.rate <= 0:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            # 先预订令牌再在锁外等待，后来者按预订顺序排在后面
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+        if wait:
+            time.sleep(wait)
+        return wait
+
+
+class HostRateLimiter:
+    """按主机分配令牌桶"""
+
+    def __init__(self, rate: float = CRAWL_RATE_PER_HOST, burst: int = CRAWL_BURST_PER_HOST):
+        self.rate = rate
+        self.burst = burst
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, url: str) -> float:
+        host = urlsplit(url).netloc
+        with self._lock:
+            bucket = self._buckets.get(host)
+            if bucket is None:
+                bucket = self._buckets[host] = TokenBucket(self.rate, self.burst)
+        return bucket.acquire()
+
+
+def listing_urls(max_pages: int = CRAWL_MAX_PAGES, authors: List[str] = None, tags: List[str] = None,
+                 collect: bool = True) -> Dict[str, List[str]]:
+    """各列表的分页URL，{列表名: [第1页, 第2页, ...]}"""
+    authors = CRAWL_AUTHORS if authors is None else authors
+    tags = CRAWL_TAGS if tags is None else tags
+    # 首页即推荐列表的第1页
+    listings = {"home": [GUSHIWEN_HOST] + [HOME_URL.format(page=page) for page in range(2, max_pages + 1)]}
+    if collect:
+        listings["collect"] = [COLLECT_URL.format(page=page) for page in range(1, max_pages + 1)]
+    for name in authors:
+        listings[f"author:{name}"] = [AUTHOR_URL.format(name=quote(name), page=page)
+                                      for page in range(1, max_pages + 1)]
+    for name in tags:
+        listings[f"tag:{name}"] = [TAG_URL.format(name=quote(name), page=page)
+                                   for page in range(1, max_pages + 1)]
+    return listings
+
+
+def parse_poems(html: str) -> List[Dict[str, Any]]:
+    """从页面中解析诗歌，每首诗在一个 <div class="sons"> 里"""
+    soup = BeautifulSoup(html, 'html.parser')
+    created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    poems = []
+    for sons_div in soup.find_all('div', class_='sons'):
+        title_tag = sons_div.find('p')
+        author_tag = sons_div.find('p', class_='source')
+        content_tag = sons_div.find('div', class_='contson')
+
+        if title_tag and author_tag and content_tag:
+            title = title_tag.get_text(strip=True)
+
+            author_links = author_tag.find_all('a')
+            if len(author_links) >= 2:
+                author = author_links[0].get_text(strip=True)
+                dynasty = author_links[1].get_text(strip=True)
+                author_full = f"{dynasty}·{author}"
+            else:
+                author_full = author_tag.get_text(strip=True)
+
+            content = content_tag.get_text(separator='\n', strip=True)
+
+            poems.append({
+                'title': title,
+                'author': author_full,
+                'content': content,
+                'created_at': created_at
+            })
+    return poems
+
+
+def fetch_listings(session, listings: Dict[str, List[str]], headers: Dict[str, str] = None,
+                   concurrency: int = CRAWL_CONCURRENCY,
+                   limiter: Optional[HostRateLimiter] = None) -> Tuple[List[Dict[str, Any]], Dict[str, int]]:
+    """并发抓取并解析所有列表页
+
+    Args:
+        session: 已登录的 requests Session
+        listings: listing_urls 的返回值
+        headers: 请求头
+        concurrency: 线程池大小
+        limiter: 按主机的限速器，默认使用 CRAWL_RATE_PER_HOST / CRAWL_BURST_PER_HOST
+
+    Returns:
+        (按标题和作者去重后的诗歌, {"pages", "failed", "skipped"} 页数统计)
+    """
+    limiter = limiter or HostRateLimiter()
+    # 每个列表已知为空的最小页号，之后的页不再请求
+    exhausted: Dict[str, int] = {}
+    lock = threading.Lock()
+    stats = {"pages": 0, "failed": 0, "skipped": 0}
+
+    def fetch(name: str, page: int, url: str) -> Optional[List[Dict[str, Any]]]:
+        with lock:
+            if page > exhausted.get(name, page):
+                stats["skipped"] += 1
+                return None
+        limiter.acquire(url)
+        start = time.perf_counter()
+        try:
+            resp = session.get(url, headers=headers)
+            resp.raise_for_status()
+        except Exception as e:
+            logger.warning(f"抓取{url}失败: {str(e)}")
+            with lock:
+                stats["failed"] += 1
+            return None
+        finally:
+            record_upstream("gushiwen", "page", time.perf_counter() - start)
+        # 以页面实际解码结果解析，避免服务端未声明编码时乱码
+        resp.encoding = resp.encoding or resp.apparent_encoding
+        poems = parse_poems(resp.text)
+        with lock:
+            stats["pages"] += 1
+            if not poems:
+                exhausted[name] = min(page, exhausted.get(name, page))
+        return poems
+
+    # 按页号交错提交，各列表的前几页先抓取，空页能尽早截断后续页
+    tasks: Iterator[Tuple[str, int, str]] = (
+        (name, page, urls[page - 1])
+        for page in range(1, max(map(len, listings.values()), default=0) + 1)
+        for name, urls in listings.items() if page <= len(urls)
+    )
+    unique: Dict[Tuple[str, str], Dict[str, Any]] = {}
+    with ThreadPoolExecutor(max_workers=max(1, concurrency)) as pool:
+        futures = [pool.submit(fetch, *task) for task in tasks]
+        for future in as_completed(futures):
+            for poem in future.result() or []:
+                unique.setdefault((poem["title"], poem["author"]), poem)
+    logger.info(f"抓取完成: {stats['pages']}页，失败{stats['failed']}页，跳过{stats['skipped']}页，"
+                f"共{len(unique)}首诗")
+    return list(unique.values()), stats
@@ -0,0 +1,161 @@
+"""
+入库流水线
+去重 -> 按批并发向量化（失败按批重试） -> 按主键upsert -> 更新词法索引
+"""
+import os
+import time
+import random
+import logging
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import List, Optional, Dict, Any
+
+from app.crawler.dedup import SeenStore, with_hashes
+from app.rag.answer_cache import answer_cache
+from app.retriever.lexical import lexical_index_for
+from app.metrics import stage_timer
+
+logger = logging.getLogger(__name__)
+
+# 入库embedding配置
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", "10"))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", "4"))
+INGEST_EMBED_RETRIES = int(os.getenv("INGEST_EMBED_RETRIES", "3"))
+
+
+def _embed_batch_with_retry(embedding_model, texts: List[str], retries: int) -> Optional[List[List[float]]]:
+    """请求一批向量，失败时指数退避重试，重试耗尽返回None
+
+    这是批量向量化唯一的重试层：request_embeddings 使用不重试POST的会话
+    """
+    for attempt in range(retries + 1):
+        try:
+            return embedding_model.request_embeddings(texts)
+        except Exception as e:
+            if attempt == retries:
+                logger.error(f"批量向量化失败，已重试{retries}次，放弃该批{len(texts)}条: {str(e)}")
+                return None
+            delay = 0.5 * (2 ** attempt) + random.uniform(0, 0.5)
+            logger.warning(f"批量向量化失败（第{attempt + 1}次），{delay:.2f}秒后重试: {str(e)}")
+            time.sleep(delay)
+
+
+def embed_texts(embedding_model, texts: List[str],
+                batch_size: int = INGEST_EMBED_BATCH_SIZE,
+                concurrency: int = INGEST_EMBED_CONCURRENCY,
+                retries: int = INGEST_EMBED_RETRIES) -> List[Optional[List[float]]]:
+    """批量并发向量化
+
+    Args:
+        embedding_model: 提供 request_embeddings 与 max_batch_size 的embedding模型
+        texts: 待向量化的文本
+        batch_size: 每批文本数，不超过模型允许的上限
+        concurrency: 同时进行的请求数
+        retries: 每批失败后的重试次数
+
+    Returns:
+        与 texts 一一对应的向量列表，所在批次最终失败的位置为None
+    """
+    batch_size = max(1, min(batch_size, getattr(embedding_model, "max_batch_size", batch_size)))
+    results: List[Optional[List[float]]] = [None] * len(texts)
+    starts = list(range(0, len(texts), batch_size))
+    if not starts:
+        return results
+
+    with ThreadPoolExecutor(max_workers=max(1, min(concurrency, len(starts)))) as pool:
+        futures = {
+            pool.submit(_embed_batch_with_retry, embedding_model, texts[start:start + batch_size], retries): start
+            for start in starts
+        }
+        for future in as_completed(futures):
+            start = futures[future]
+            vectors = future.result()
+            if vectors is not None:
+                results[start:start + len(vectors)] = vectors
+
+    failed = sum(1 for vector in results if vector is None)
+    logger.info(f"向量化完成: 共{len(texts)}条，{len(starts)}批，失败{failed}条")
+    return results
+
+
+def _to_timestamp(created_at) -> int:
+    """把 created_at 字符串转成时间戳（秒）"""
+    if isinstance(created_at, (int, float)):
+        return int(created_at)
+    return int(datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").timestamp())
+
+
+def ingest_poems(poems: List[Dict[str, Any]], retriever, embedding_model,
+                 seen_store: Optional[SeenStore] = None, flush: bool = True) -> Dict[str, int]:
+    """把一批诗歌增量写入检索后端
+
+    先用内容哈希与已入库记录比对，只有新增或内容变化的诗才会向量化并upsert。
+
+    Args:
+        poems: 含 title/author/content/created_at 的诗歌列表
+        retriever: 检索后端
+        embedding_model: embedding模型
+        seen_store: 已入库记录，须与 retriever 的 scope 一致，默认使用 SEEN_STORE_PATH
+        flush: 是否在写入后立即落盘；为False时由调用方最后调用 finish_ingest
+
+    Returns:
+        {"new", "unchanged", "updated", "failed"} 各类诗歌数量
+    """
+    seen_store = seen_store or SeenStore.for_retriever(retriever)
+    if seen_store.scope != retriever.scope:
+        raise ValueError(f"已入库记录属于{seen_store.scope}，与检索后端{retriever.scope}不一致")
+    with stage_timer("ingest_dedup"):
+        new, unchanged, updated = seen_store.classify(with_hashes(poems))
+    counts = {"new": len(new), "unchanged": len(unchanged), "updated": len(updated), "failed": 0}
+    logger.info(f"去重结果: 新增{len(new)}首，未变化{len(unchanged)}首，有更新{len(updated)}首")
+
+    pending = new + updated
+    if not pending:
+        return counts
+
+    with stage_timer("ingest_embed"):
+        embeddings = embed_texts(embedding_model, [poem["content"] for poem in pending])
+    entities = []
+    for poem, embedding in zip(pending, embeddings):
+        if embedding is None:
+            logger.error(f"处理{poem['title']}向量化时出错: 所在批次重试后仍失败")
+            counts["failed"] += 1
+            continue
+        # 创建一条完整的实体记录
+        entities.append({
+            "id": poem["id"],
+            "title": poem["title"],
+            "author": poem["author"],
+            "content": poem["content"],
+            "content_hash": poem["content_hash"],
+            "embedding": embedding,
+            "created_at": _to_timestamp(poem["created_at"])
+        })
+    if not entities:
+        return counts
+
+    with stage_timer("ingest_upsert"):
+        ids = retriever.upsert(entities, flush=flush)
+    seen_store.mark(entities)
+    logger.info(f"共写入{len(entities)}条数据")
+
+    # 同步更新词法索引
+    with stage_timer("ingest_lexical"):
+        lexical_index = lexical_index_for(retriever)
+        lexical_index.add_many(
+            (doc_id, entity["title"], entity["author"], entity["content"])
+            for doc_id, entity in zip(ids, entities)
+        )
+        if flush:
+            lexical_index.save()
+            # 入库了新诗歌，之前缓存的答案可能已过时
+            answer_cache.invalidate()
+    return counts
+
+
+def finish_ingest(retriever):
+    """以 flush=False 分多次调用 ingest_poems 后统一落盘：检索后端、词法索引，并清空答案缓存"""
+    with stage_timer("ingest_flush"):
+        retriever.flush()
+        lexical_index_for(retriever).save()
+        answer_cache.invalidate()
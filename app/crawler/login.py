@@ -0,0 +1,140 @@
+"""
+爬虫登录态
+登录后的cookie保存到 CRAWL_COOKIE_PATH，下次爬取先加载并验证是否仍然有效，
+只有cookie缺失或失效时才下载验证码、提交打码平台识别并重新登录
+"""
+import os
+import json
+import time
+import logging
+from typing import Dict, Optional
+
+from bs4 import BeautifulSoup
+from dotenv import load_dotenv
+from requests.cookies import create_cookie
+
+from app.config.pathconfig import DATA_DIR
+from app.crawler.chaojiying import Chaojiying_Client
+from app.metrics import record_login, record_captcha_solve
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+CHAOJIYING_USERNAME = os.getenv("CHAOJIYING_USERNAME")
+CHAOJIYING_PASSWORD = os.getenv("CHAOJIYING_PASSWORD")
+CHAOJIYING_SOFT_ID = os.getenv("CHAOJIYING_SOFT_ID")
+ACCOUNT_EMAIL = os.getenv("ACCOUNT_EMAIL")
+ACCOUNT_PASSWORD = os.getenv("ACCOUNT_PASSWORD")
+
+# 登录cookie的保存路径
+CRAWL_COOKIE_PATH = os.getenv("CRAWL_COOKIE_PATH", os.path.join(DATA_DIR, "gushiwen_cookies.json"))
+# 验证码识别错误时最多尝试登录的次数
+CRAWL_LOGIN_ATTEMPTS = int(os.getenv("CRAWL_LOGIN_ATTEMPTS", "3"))
+
+# 直接请求https地址，避免http→https的跳转被误判为已登录
+COLLECT_URL = 'https://www.gushiwen.cn/user/collect.aspx'
+LOGIN_URL = 'https://www.gushiwen.cn/user/login.aspx?from=' + COLLECT_URL
+# 超级鹰验证码类型：1~4位英文数字
+CAPTCHA_CODE_TYPE = 1902
+
+
+def save_cookies(session, path: str = CRAWL_COOKIE_PATH):
+    """把会话中的cookie写入文件（仅当前用户可读）"""
+    cookies = [
+        {"name": c.name, "value": c.value, "domain": c.domain, "path": c.path,
+         "expires": c.expires, "secure": c.secure}
+        for c in session.cookies
+    ]
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w", encoding="utf-8") as f:
+        json.dump(cookies, f, ensure_ascii=False)
+    os.replace(tmp_path, path)
+
+
+def load_cookies(session, path: str = CRAWL_COOKIE_PATH) -> int:
+    """把保存的cookie加载到会话，跳过已过期的，返回加载的个数"""
+    if not os.path.exists(path):
+        return 0
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            cookies = json.load(f)
+    except Exception as e:
+        logger.warning(f"cookie文件无效，忽略: {path}: {str(e)}")
+        return 0
+    now = time.time()
+    loaded = 0
+    for cookie in cookies:
+        if cookie.get("expires") and cookie["expires"] <= now:
+            continue
+        session.cookies.set_cookie(create_cookie(**cookie))
+        loaded += 1
+    return loaded
+
+
+def is_logged_in(session, headers: Dict[str, str] = None) -> bool:
+    """访问收藏夹页面，未登录时会被重定向到登录页；跟随跳转后以最终页面判断，
+    只有最终停在收藏夹页面（200且不是登录页）才算已登录"""
+    try:
+        resp = session.get(COLLECT_URL, headers=headers, allow_redirects=True)
+    except Exception as e:
+        logger.warning(f"检查登录态失败: {str(e)}")
+        return False
+    if resp.status_code != 200:
+        return False
+    return "login.aspx" not in resp.url.lower()
+
+
+def captcha_login(session, headers: Dict[str, str] = None) -> bool:
+    """下载验证码交给打码平台识别后提交登录，识别错误时向平台报错并重试"""
+    client = Chaojiying_Client(CHAOJIYING_USERNAME, CHAOJIYING_PASSWORD, CHAOJIYING_SOFT_ID)
+    for attempt in range(1, CRAWL_LOGIN_ATTEMPTS + 1):
+        # 获取登录页面中的 __VIEWSTATE、__VIEWSTATEGENERATOR 和验证码图片地址
+        soup = BeautifulSoup(session.get(LOGIN_URL, headers=headers).text, 'lxml')
+        viewstate = soup.select('#__VIEWSTATE')[0].attrs.get('value')
+        viewstate_generator = soup.select('#__VIEWSTATEGENERATOR')[0].attrs.get('value')
+        img_url = 'https://www.gushiwen.cn' + soup.select('#imgCode')[0].attrs.get('src')
+
+        # 验证码图片直接以字节提交识别
+        result = client.PostPic(session.get(img_url, headers=headers).content, CAPTCHA_CODE_TYPE)
+        record_captcha_solve()
+        code = result.get('pic_str')
+        logger.info(f"验证码: {code}")
+
+        session.post(LOGIN_URL, headers=headers, data={
+            '__VIEWSTATE': viewstate,
+            '__VIEWSTATEGENERATOR': viewstate_generator,
+            'from': COLLECT_URL,
+            'email': ACCOUNT_EMAIL,
+            'pwd': ACCOUNT_PASSWORD,
+            'code': code,
+            'denglu': '登录'
+        })
+        if is_logged_in(session, headers):
+            return True
+        logger.warning(f"第{attempt}次登录失败，验证码可能识别错误")
+        # 识别错误的题目报错后打码平台会返还题分
+        if result.get('pic_id'):
+            try:
+                client.ReportError(result['pic_id'])
+            except Exception as e:
+                logger.warning(f"验证码报错失败: {str(e)}")
+    return False
+
+
+def ensure_login(session, headers: Dict[str, str] = None, path: Optional[str] = CRAWL_COOKIE_PATH) -> bool:
+    """确保会话处于登录态：优先复用保存的cookie，失效时才识别验证码重新登录并保存新cookie"""
+    if load_cookies(session, path) and is_logged_in(session, headers):
+        logger.info("复用已保存的登录cookie")
+        record_login("cookie")
+        return True
+    if path and os.path.exists(path):
+        logger.info("保存的登录cookie已失效，重新登录")
+    session.cookies.clear()
+    if not captcha_login(session, headers):
+        return False
+    record_login("captcha")
+    if path:
+        save_cookies(session, path)
+    return True
@@ -1 +1,2 @@
 from .llm import *
+from .router import *
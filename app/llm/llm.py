@@ -1,18 +1,26 @@
 from abc import ABC, abstractmethod
-from openai import OpenAI
+from openai import OpenAI, AsyncOpenAI
 import os
+import time
 from dotenv import load_dotenv
 import logging
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import BaseMessage, HumanMessage, AIMessage
 from langchain_core.outputs import ChatResult, ChatGeneration
-from typing import List, Any, Optional, Dict
+from typing import List, Any, Optional, Dict, AsyncIterator
 from pydantic import BaseModel, Field
+from app.metrics import upstream_timer, record_upstream, record_tokens
 
 logger = logging.getLogger(__name__)
 
 load_dotenv()
 
+# OpenAI兼容接口地址，可指向本地的兼容服务（如 benchmarks 中的假服务）
+DEEPSEEK_BASE_URL = os.getenv("DEEPSEEK_BASE_URL", "https://api.deepseek.com/v1")
+DASHSCOPE_BASE_URL = os.getenv("DASHSCOPE_BASE_URL", "https://dashscope.aliyuncs.com/compatible-mode/v1")
+# 默认的模型提供商，router 表示在各提供商之间按延迟路由
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "deepseek")
+
 class BaseLLMClient(ABC):
     """LLM客户端基类"""
     
@@ -21,57 +29,158 @@ class BaseLLMClient(ABC):
         """获取模型回复"""
         pass
 
+    @abstractmethod
+    async def aget_completion(self, messages):
+        """异步获取模型回复"""
+        pass
+
+    @abstractmethod
+    def astream_completion(self, messages) -> AsyncIterator[str]:
+        """以流式方式异步获取模型回复，逐段产出文本"""
+        pass
+
+    # 指标中的服务名
+    provider = "llm"
+
+    async def _iter_stream(self, stream, start: float) -> AsyncIterator[str]:
+        """逐段产出流式响应的文本，记录首个token耗时、总耗时和token用量
+
+        Args:
+            stream: 开启 stream_options.include_usage 的流式响应
+            start: 发起请求时的 time.perf_counter()
+        """
+        first_token = True
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    record_tokens(self.provider, chunk.usage)
+                if chunk.choices and chunk.choices[0].delta.content:
+                    if first_token:
+                        record_upstream(self.provider, "chat_first_token", time.perf_counter() - start)
+                        first_token = False
+                    yield chunk.choices[0].delta.content
+        finally:
+            record_upstream(self.provider, "chat_stream", time.perf_counter() - start)
+
 
 
 class DeepSeekClient(BaseLLMClient):
     """DeepSeek API客户端"""
+    provider = "deepseek"
     client: Any = Field(default=None)
     def __init__(self):
         self.client = OpenAI(
             api_key=os.getenv("DEEPSEEK_API_KEY"),
-            base_url="https://api.deepseek.com/v1"
+            base_url=DEEPSEEK_BASE_URL
+        )
+        # 异步客户端，供 async 接口使用，不占用线程池
+        self.async_client = AsyncOpenAI(
+            api_key=os.getenv("DEEPSEEK_API_KEY"),
+            base_url=DEEPSEEK_BASE_URL
         )
         
     def get_completion(self, messages):
-        response = self.client.chat.completions.create(
+        with upstream_timer(self.provider, "chat"):
+            response = self.client.chat.completions.create(
+                model="deepseek-chat",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1000
+            )
+        record_tokens(self.provider, response.usage)
+        # 打印响应
+        logger.info(f"\nOpenAI响应:\n{response.choices[0].message.content}\n")
+        return response.choices[0].message.content
+
+    async def aget_completion(self, messages):
+        with upstream_timer(self.provider, "chat"):
+            response = await self.async_client.chat.completions.create(
+                model="deepseek-chat",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1000
+            )
+        record_tokens(self.provider, response.usage)
+        logger.info(f"\nOpenAI响应:\n{response.choices[0].message.content}\n")
+        return response.choices[0].message.content
+
+    async def astream_completion(self, messages) -> AsyncIterator[str]:
+        start = time.perf_counter()
+        stream = await self.async_client.chat.completions.create(
             model="deepseek-chat",
             messages=messages,
             temperature=0.7,
-            max_tokens=1000
+            max_tokens=1000,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        # 打印响应
-        logger.info(f"\nOpenAI响应:\n{response.choices[0].message.content}\n")
-        return response.choices[0].message.content
+        async for token in self._iter_stream(stream, start):
+            yield token
     
 
-class DashScopeClient(BaseLLMClient, BaseModel):
+class DashScopeClient(BaseLLMClient):
     """DashScope API客户端"""
+    provider = "dashscope"
     
     def __init__(self):
         self.client = OpenAI(
             api_key=os.getenv("DASHSCOPE_API_KEY"),
-            base_url="https://dashscope.aliyuncs.com/compatible-mode/v1"
+            base_url=DASHSCOPE_BASE_URL
+        )
+        self.async_client = AsyncOpenAI(
+            api_key=os.getenv("DASHSCOPE_API_KEY"),
+            base_url=DASHSCOPE_BASE_URL
         )
 
     def get_completion(self, messages):
-        response = self.client.chat.completions.create(
+        with upstream_timer(self.provider, "chat"):
+            response = self.client.chat.completions.create(
+                model="dashscope/dashscope-1-dev",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1000
+            )
+        record_tokens(self.provider, response.usage)
+        # 打印响应
+        logger.info(f"\nDashScope响应:\n{response.choices[0].message.content}\n")
+        return response.choices[0].message.content
+
+    async def aget_completion(self, messages):
+        with upstream_timer(self.provider, "chat"):
+            response = await self.async_client.chat.completions.create(
+                model="dashscope/dashscope-1-dev",
+                messages=messages,
+                temperature=0.7,
+                max_tokens=1000
+            )
+        record_tokens(self.provider, response.usage)
+        logger.info(f"\nDashScope响应:\n{response.choices[0].message.content}\n")
+        return response.choices[0].message.content
+
+    async def astream_completion(self, messages) -> AsyncIterator[str]:
+        start = time.perf_counter()
+        stream = await self.async_client.chat.completions.create(
             model="dashscope/dashscope-1-dev",
             messages=messages,
             temperature=0.7,
-            max_tokens=1000
+            max_tokens=1000,
+            stream=True,
+            stream_options={"include_usage": True}
         )
-        # 打印响应
-        logger.info(f"\nDashScope响应:\n{response.choices[0].message.content}\n")
-        return response.choices[0].message.content
+        async for token in self._iter_stream(stream, start):
+            yield token
 
-def create_llm_client(provider="deepseek")->BaseLLMClient:
-    """LLM客户端工厂函数"""
+def create_llm_client(provider=None)->BaseLLMClient:
+    """LLM客户端工厂函数，provider 默认取 LLM_PROVIDER"""
     try:
+        provider = provider or LLM_PROVIDER
         logger.info(f"选择的模型提供商: {provider}")
         
+        from app.llm.router import RouterClient
         clients = {
             "deepseek": DeepSeekClient,
-            "dashscope": DashScopeClient
+            "dashscope": DashScopeClient,
+            "router": RouterClient
         }
         
         client_class = clients.get(provider.lower())
@@ -85,4 +194,4 @@ def create_llm_client(provider="deepseek")->BaseLLMClient:
         
     except Exception as e:
         logger.error(f"创建LLM客户端失败: {str(e)}")
-        raise 
\ No newline at end of file
+        raise 
@@ -0,0 +1,288 @@
+"""
+LLM提供商路由
+按各提供商最近一段时间的延迟和错误率选择更快的健康提供商，失败时切换到其他提供商；
+异步请求超过当前提供商的 p95 延迟仍未返回时，向另一个提供商发出对冲请求，取先返回者
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import threading
+from collections import deque
+from typing import List, Dict, Any, AsyncIterator, Optional, Tuple
+
+from app.llm.llm import BaseLLMClient, DeepSeekClient, DashScopeClient
+from app.metrics import record_router_event
+
+logger = logging.getLogger(__name__)
+
+# 参与路由的提供商，按优先级排列，统计数据不足时按该顺序选择
+LLM_ROUTER_PROVIDERS = [p.strip() for p in os.getenv("LLM_ROUTER_PROVIDERS", "deepseek,dashscope").split(",")
+                        if p.strip()]
+# 每个提供商保留的最近请求数
+LLM_ROUTER_WINDOW = int(os.getenv("LLM_ROUTER_WINDOW", "100"))
+# 错误率超过该值的提供商暂停使用 LLM_ROUTER_COOLDOWN_S 秒
+LLM_ROUTER_MAX_ERROR_RATE = float(os.getenv("LLM_ROUTER_MAX_ERROR_RATE", "0.5"))
+LLM_ROUTER_COOLDOWN_S = float(os.getenv("LLM_ROUTER_COOLDOWN_S", "30"))
+# 以小概率把请求发给非最快的提供商，保持其延迟统计不过时
+LLM_ROUTER_EXPLORE_RATE = float(os.getenv("LLM_ROUTER_EXPLORE_RATE", "0.05"))
+# 对冲请求：样本数达到 LLM_ROUTER_HEDGE_MIN_SAMPLES 后，超过 p95 延迟未返回即向下一个提供商再发一次
+LLM_ROUTER_HEDGE = os.getenv("LLM_ROUTER_HEDGE", "true").lower() == "true"
+LLM_ROUTER_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_ROUTER_HEDGE_MIN_SAMPLES", "20"))
+
+# 统计的请求类型：完整回复的总耗时、流式回复的首个token耗时
+CHAT = "chat"
+FIRST_TOKEN = "first_token"
+
+_MIN_SAMPLES = 5
+
+
+class ProviderStats:
+    """单个提供商的滚动延迟与错误统计"""
+
+    def __init__(self, window: int = LLM_ROUTER_WINDOW):
+        self._latencies = {CHAT: deque(maxlen=window), FIRST_TOKEN: deque(maxlen=window)}
+        self._outcomes = deque(maxlen=window)
+        self._lock = threading.Lock()
+        self.unhealthy_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+    def record_success(self, kind: str, seconds: float):
+        with self._lock:
+            self._latencies[kind].append(seconds)
+            self._outcomes.append(True)
+            self.requests += 1
+
+    def record_latency(self, kind: str, seconds: float):
+        """对冲落败被取消的请求只知道耗时下限，也计入延迟分布，避免 p95 被低估"""
+        with self._lock:
+            self._latencies[kind].append(seconds)
+
+    def record_error(self):
+        with self._lock:
+            self._outcomes.append(False)
+            self.requests += 1
+            self.errors += 1
+            if len(self._outcomes) >= _MIN_SAMPLES and self._error_rate() > LLM_ROUTER_MAX_ERROR_RATE:
+                self.unhealthy_until = time.monotonic() + LLM_ROUTER_COOLDOWN_S
+                # 冷却结束后按新样本重新评估
+                self._outcomes.clear()
+
+    def _error_rate(self) -> float:
+        return self._outcomes.count(False) / len(self._outcomes) if self._outcomes else 0.0
+
+    def error_rate(self) -> float:
+        with self._lock:
+            return self._error_rate()
+
+    def healthy(self) -> bool:
+        return time.monotonic() >= self.unhealthy_until
+
+    def percentile(self, kind: str, q: float) -> Optional[float]:
+        with self._lock:
+            samples = sorted(self._latencies[kind])
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+    def samples(self, kind: str) -> int:
+        return len(self._latencies[kind])
+
+    def snapshot(self) -> Dict[str, Any]:
+        error_rate = self.error_rate()
+        return {
+            "healthy": self.healthy(),
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(error_rate, 4),
+            **{
+                f"{kind}_{name}_ms": round(value * 1000, 1) if value is not None else None
+                for kind in (CHAT, FIRST_TOKEN)
+                for name, value in (("p50", self.percentile(kind, 0.5)), ("p95", self.percentile(kind, 0.95)))
+            },
+        }
+
+
+class RouterClient(BaseLLMClient):
+    """在多个LLM提供商之间按延迟与健康状况路由的客户端"""
+    provider = "router"
+
+    def __init__(self, providers: List[str] = None, clients: Dict[str, BaseLLMClient] = None):
+        if clients is None:
+            available = {"deepseek": DeepSeekClient, "dashscope": DashScopeClient}
+            clients = {name: available[name]() for name in (providers or LLM_ROUTER_PROVIDERS)}
+        if not clients:
+            raise ValueError("路由客户端至少需要一个提供商")
+        self.clients = clients
+        self.stats_by_provider = {name: ProviderStats() for name in clients}
+
+    def _ranked(self, kind: str) -> List[str]:
+        """按健康状况和按错误率折算后的 p50 延迟排序的提供商，统计不足的排在前面以便尽早获得样本"""
+        order = list(self.clients)
+
+        def key(name: str) -> Tuple:
+            stats = self.stats_by_provider[name]
+            p50 = stats.percentile(kind, 0.5) if stats.samples(kind) >= _MIN_SAMPLES else None
+            # 失败的请求还要再等一次切换，错误率越高预期耗时越长
+            expected = p50 / max(0.05, 1 - stats.error_rate()) if p50 is not None else 0.0
+            return (not stats.healthy(), p50 is not None, expected, order.index(name))
+
+        ranked = sorted(order, key=key)
+        healthy = [name for name in ranked if self.stats_by_provider[name].healthy()]
+        if len(healthy) > 1 and random.random() < LLM_ROUTER_EXPLORE_RATE:
+            explored = random.choice(healthy[1:])
+            ranked.remove(explored)
+            ranked.insert(0, explored)
+        return ranked
+
+    def _hedge_delay(self, name: str, kind: str) -> Optional[float]:
+        stats = self.stats_by_provider[name]
+        if not LLM_ROUTER_HEDGE or len(self.clients) < 2 or stats.samples(kind) < LLM_ROUTER_HEDGE_MIN_SAMPLES:
+            return None
+        return stats.percentile(kind, 0.95)
+
+    def _failed(self, name: str, error: Exception):
+        logger.warning(f"LLM提供商{name}请求失败: {str(error)}")
+        self.stats_by_provider[name].record_error()
+        record_router_event(name, "error")
+
+    def get_completion(self, messages):
+        last_error = None
+        for name in self._ranked(CHAT):
+            record_router_event(name, "selected")
+            start = time.perf_counter()
+            try:
+                answer = self.clients[name].get_completion(messages)
+            except Exception as e:
+                self._failed(name, e)
+                last_error = e
+                continue
+            self.stats_by_provider[name].record_success(CHAT, time.perf_counter() - start)
+            return answer
+        raise last_error
+
+    async def _timed_completion(self, name: str, messages) -> str:
+        start = time.perf_counter()
+        try:
+            answer = await self.clients[name].aget_completion(messages)
+        except asyncio.CancelledError:
+            self.stats_by_provider[name].record_latency(CHAT, time.perf_counter() - start)
+            raise
+        except Exception as e:
+            self._failed(name, e)
+            raise
+        self.stats_by_provider[name].record_success(CHAT, time.perf_counter() - start)
+        return answer
+
+    async def aget_completion(self, messages):
+        ranked = self._ranked(CHAT)
+        pending: Dict[asyncio.Task, str] = {}
+        last_error = None
+
+        def launch(name: str):
+            record_router_event(name, "selected")
+            pending[asyncio.ensure_future(self._timed_completion(name, messages))] = name
+
+        launch(ranked.pop(0))
+        try:
+            while pending:
+                # 只有一个请求在途且还有备选时，等到对冲时间为止
+                timeout = None
+                if len(pending) == 1 and ranked:
+                    timeout = self._hedge_delay(next(iter(pending.values())), CHAT)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    record_router_event(ranked[0], "hedged")
+                    launch(ranked.pop(0))
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None:
+                        if pending:
+                            record_router_event(name, "hedge_won")
+                        return task.result()
+                    last_error = task.exception()
+                # 失败后没有在途请求时切换到下一个提供商
+                if not pending and ranked:
+                    launch(ranked.pop(0))
+            raise last_error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _open_stream(self, name: str, messages) -> Tuple[AsyncIterator[str], str]:
+        """发起流式请求并等到首个token，返回 (流, 首个token)"""
+        start = time.perf_counter()
+        stream = self.clients[name].astream_completion(messages)
+        try:
+            first = await stream.__anext__()
+        except asyncio.CancelledError:
+            self.stats_by_provider[name].record_latency(FIRST_TOKEN, time.perf_counter() - start)
+            await stream.aclose()
+            raise
+        except StopAsyncIteration:
+            first = ""
+        except Exception as e:
+            await stream.aclose()
+            self._failed(name, e)
+            raise
+        self.stats_by_provider[name].record_success(FIRST_TOKEN, time.perf_counter() - start)
+        return stream, first
+
+    async def astream_completion(self, messages) -> AsyncIterator[str]:
+        """按首个token延迟路由与对冲；开始输出后不再切换提供商"""
+        ranked = self._ranked(FIRST_TOKEN)
+        pending: Dict[asyncio.Task, str] = {}
+        last_error = None
+        winner = None
+
+        def launch(name: str):
+            record_router_event(name, "selected")
+            pending[asyncio.ensure_future(self._open_stream(name, messages))] = name
+
+        launch(ranked.pop(0))
+        try:
+            while pending and winner is None:
+                timeout = None
+                if len(pending) == 1 and ranked:
+                    timeout = self._hedge_delay(next(iter(pending.values())), FIRST_TOKEN)
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    record_router_event(ranked[0], "hedged")
+                    launch(ranked.pop(0))
+                    continue
+                for task in done:
+                    name = pending.pop(task)
+                    if task.exception() is None and winner is None:
+                        if pending:
+                            record_router_event(name, "hedge_won")
+                        winner = task.result()
+                    elif task.exception() is None:
+                        # 同时完成的另一路流不再使用
+                        await task.result()[0].aclose()
+                    else:
+                        last_error = task.exception()
+                if winner is None and not pending and ranked:
+                    launch(ranked.pop(0))
+        finally:
+            for task in pending:
+                if task.done() and not task.cancelled() and task.exception() is None:
+                    await task.result()[0].aclose()
+                task.cancel()
+        if winner is None:
+            raise last_error
+
+        stream, first = winner
+        try:
+            if first:
+                yield first
+            async for token in stream:
+                yield token
+        finally:
+            await stream.aclose()
+
+    def stats(self) -> Dict[str, Any]:
+        """各提供商的滚动统计"""
+        return {name: stats.snapshot() for name, stats in self.stats_by_provider.items()}
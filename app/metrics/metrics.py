@@ -0,0 +1,188 @@
+"""
+运行时指标
+各处理阶段耗时、上游调用耗时、token用量、上下文token数、零向量兜底次数、缓存命中、相同请求合并、在途请求数、准入排队与拒绝、爬虫登录/打码次数，
+以Prometheus格式在 /metrics 暴露；同一HTTP请求内记录的阶段耗时写入 Server-Timing 响应头
+
+多进程部署时设置 PROMETHEUS_MULTIPROC_DIR（每次启动前清空），/metrics 会汇总所有工作进程的指标。
+"""
+import os
+import time
+import contextvars
+from contextlib import contextmanager
+from typing import Dict, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+)
+
+PROMETHEUS_MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# 覆盖从本地索引检索（毫秒级）到LLM生成（数十秒）的范围
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+STAGE_LATENCY = Histogram(
+    "rag_stage_duration_seconds", "各处理阶段耗时", ["stage"], buckets=LATENCY_BUCKETS
+)
+UPSTREAM_LATENCY = Histogram(
+    "rag_upstream_request_duration_seconds", "调用外部服务的耗时", ["service", "operation"],
+    buckets=LATENCY_BUCKETS
+)
+HTTP_LATENCY = Histogram(
+    "rag_http_request_duration_seconds", "HTTP请求耗时", ["method", "route", "status"],
+    buckets=LATENCY_BUCKETS
+)
+HTTP_IN_FLIGHT = Gauge(
+    "rag_http_requests_in_flight", "正在处理的HTTP请求数", multiprocess_mode="livesum"
+)
+LLM_TOKENS = Counter(
+    "rag_llm_tokens_total", "LLM token用量", ["provider", "kind"]
+)
+EMBEDDING_FALLBACKS = Counter(
+    "rag_embedding_fallbacks_total", "向量化失败后以零向量代替的文本数"
+)
+CACHE_REQUESTS = Counter(
+    "rag_cache_requests_total", "缓存查找次数", ["cache", "result"]
+)
+SINGLEFLIGHT_CALLS = Counter(
+    "rag_singleflight_calls_total", "相同请求合并：executed 为实际执行，collapsed 为等待已有执行的结果", ["name", "result"]
+)
+LLM_ROUTER_EVENTS = Counter(
+    "rag_llm_router_events_total", "LLM路由事件（selected/error/hedged/hedge_won）", ["provider", "event"]
+)
+CONTEXT_TOKENS = Histogram(
+    "rag_context_tokens", "提示上下文的估算token数", buckets=(64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+)
+ADMISSION_ACTIVE = Gauge(
+    "rag_admission_active", "各阶段正在进行的调用数", ["stage"], multiprocess_mode="livesum"
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "rag_admission_queue_depth", "各阶段排队等待的请求数", ["stage"], multiprocess_mode="livesum"
+)
+ADMISSION_WAIT = Histogram(
+    "rag_admission_wait_seconds", "各阶段排队等待时间", ["stage"], buckets=LATENCY_BUCKETS
+)
+ADMISSION_REJECTIONS = Counter(
+    "rag_admission_rejections_total", "因过载被拒绝的请求数（queue_full/deadline/timeout）", ["stage", "reason"]
+)
+CRAWLER_LOGINS = Counter(
+    "rag_crawler_logins_total", "爬虫获得登录态的方式", ["method"]
+)
+CAPTCHA_SOLVES = Counter(
+    "rag_captcha_solves_total", "提交打码平台识别验证码的次数"
+)
+
+# 当前HTTP请求的 阶段 -> 累计耗时，由 MetricsMiddleware 设置；请求之外（如定时任务）为None
+_request_timings: contextvars.ContextVar[Optional[Dict[str, float]]] = contextvars.ContextVar(
+    "request_timings", default=None
+)
+
+
+def record_stage(stage: str, seconds: float):
+    """记录一次阶段耗时，并计入当前请求的 Server-Timing"""
+    STAGE_LATENCY.labels(stage).observe(seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0.0) + seconds
+
+
+@contextmanager
+def stage_timer(stage: str):
+    """统计代码块耗时的上下文管理器，异常退出同样计时"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def record_upstream(service: str, operation: str, seconds: float):
+    """记录一次外部调用耗时；不计入 Server-Timing，避免合并/并发请求被算到无关的请求上"""
+    UPSTREAM_LATENCY.labels(service, operation).observe(seconds)
+
+
+@contextmanager
+def upstream_timer(service: str, operation: str):
+    """统计外部调用耗时的上下文管理器"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_upstream(service, operation, time.perf_counter() - start)
+
+
+def record_tokens(provider: str, usage):
+    """记录OpenAI兼容响应中的token用量，usage为空时忽略"""
+    if usage is None:
+        return
+    LLM_TOKENS.labels(provider, "prompt").inc(getattr(usage, "prompt_tokens", 0) or 0)
+    LLM_TOKENS.labels(provider, "completion").inc(getattr(usage, "completion_tokens", 0) or 0)
+
+
+def record_embedding_fallback(count: int = 1):
+    EMBEDDING_FALLBACKS.inc(count)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_REQUESTS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_singleflight(name: str, collapsed: bool):
+    SINGLEFLIGHT_CALLS.labels(name, "collapsed" if collapsed else "executed").inc()
+
+
+def record_router_event(provider: str, event: str):
+    LLM_ROUTER_EVENTS.labels(provider, event).inc()
+
+
+def record_context_tokens(tokens: int):
+    CONTEXT_TOKENS.observe(tokens)
+
+
+def record_admission_wait(stage: str, seconds: float):
+    ADMISSION_WAIT.labels(stage).observe(seconds)
+
+
+def record_admission_rejection(stage: str, reason: str):
+    ADMISSION_REJECTIONS.labels(stage, reason).inc()
+
+
+def set_admission_state(stage: str, active: int, queued: int):
+    ADMISSION_ACTIVE.labels(stage).set(active)
+    ADMISSION_QUEUE_DEPTH.labels(stage).set(queued)
+
+
+def record_login(method: str):
+    """method 为 cookie（复用保存的登录态）或 captcha（识别验证码重新登录）"""
+    CRAWLER_LOGINS.labels(method).inc()
+
+
+def record_captcha_solve():
+    CAPTCHA_SOLVES.inc()
+
+
+def start_request_timings() -> Tuple[Dict[str, float], contextvars.Token]:
+    """为当前请求开始收集阶段耗时，返回耗时字典和用于恢复的token"""
+    timings: Dict[str, float] = {}
+    return timings, _request_timings.set(timings)
+
+
+def end_request_timings(token: contextvars.Token):
+    _request_timings.reset(token)
+
+
+def server_timing_header(timings: Dict[str, float], total: float = None) -> str:
+    """格式化 Server-Timing 头，耗时单位为毫秒"""
+    entries = [f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items()]
+    if total is not None:
+        entries.append(f"total;dur={total * 1000:.1f}")
+    return ", ".join(entries)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """生成Prometheus文本格式的指标，返回 (内容, Content-Type)"""
+    if PROMETHEUS_MULTIPROC_DIR:
+        from prometheus_client import multiprocess
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(REGISTRY), CONTENT_TYPE_LATEST
@@ -0,0 +1,62 @@
+"""
+HTTP指标中间件
+统计请求耗时与在途请求数，并在响应头中加入 Server-Timing
+"""
+import time
+
+from starlette.datastructures import MutableHeaders
+
+from app.metrics.metrics import (
+    HTTP_IN_FLIGHT, HTTP_LATENCY, end_request_timings, server_timing_header, start_request_timings
+)
+
+# 不统计的路径（指标抓取本身）
+EXCLUDED_PATHS = {"/metrics"}
+
+
+class MetricsMiddleware:
+    """纯ASGI中间件，不缓冲响应体，对流式响应同样适用
+
+    Server-Timing 在响应头发出时生成，只包含此前已完成的阶段；
+    流式响应的生成阶段在响应头之后，只计入 /metrics 的直方图。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["path"] in EXCLUDED_PATHS:
+            await self.app(scope, receive, send)
+            return
+
+        start = time.perf_counter()
+        timings, token = start_request_timings()
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = MutableHeaders(scope=message)
+                headers.append("Server-Timing", server_timing_header(timings, time.perf_counter() - start))
+            await send(message)
+
+        HTTP_IN_FLIGHT.inc()
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            HTTP_IN_FLIGHT.dec()
+            end_request_timings(token)
+            HTTP_LATENCY.labels(scope["method"], _route_label(scope), str(status)).observe(time.perf_counter() - start)
+
+
+def _route_label(scope) -> str:
+    """用路由模板而不是原始路径作为标签，避免路径参数导致标签基数膨胀
+
+    子路由中的 route.path 不含 include_router 的前缀，前缀从实际路径中按段数补回。
+    """
+    route = getattr(scope.get("route"), "path", None)
+    if not route:
+        return "unmatched"
+    prefix = "/".join(scope["path"].split("/")[:-route.count("/")])
+    return prefix + route
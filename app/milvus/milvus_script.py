@@ -8,6 +8,8 @@ import os
 import logging
 from typing import List
 
+from app.retriever.index_config import load_index_config
+
 load_dotenv()
 
 MILVUS_HOST = os.getenv("MILVUS_HOST")
@@ -33,7 +35,7 @@ class MilvusInstance:
             schema = CollectionSchema(fields, description="Poems collection")
             collection = Collection(name=self.collection_name, schema=schema)
             # 建索引加速搜索
-            index_params = {"metric_type": "IP", "index_type": "IVF_FLAT", "params": {"nlist": 128}}
+            index_params = load_index_config().index_params()
             collection.create_index(field_name="embedding", index_params=index_params)
             logging.info(f"Collection '{self.collection_name}' 创建成功")
         else:
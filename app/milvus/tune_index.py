@@ -0,0 +1,217 @@
+'''
+向量索引调优
+把集合中的向量复制到临时集合，对候选索引类型和参数网格逐一建索引，
+用暴力检索的精确结果计算 recall@k 并测量单次查询延迟，
+选出达到目标召回率且 p95 延迟最低的配置写入 MILVUS_INDEX_CONFIG_PATH
+
+    python -m app.milvus.tune_index --collection poems --target-recall 0.95
+    python -m app.milvus.tune_index --index-types HNSW IVF_FLAT --apply   # 同时按结果重建线上集合的索引
+'''
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+from typing import List, Dict, Any, Iterator, Tuple
+
+import numpy as np
+from pymilvus import Collection, CollectionSchema, FieldSchema, DataType, utility
+
+from app.config.pathconfig import DATA_DIR
+from app.retriever.retriever import MilvusRetriever, default_collection_name, _VECTOR_DATA_TYPES
+from app.retriever.index_config import IndexConfig, MILVUS_INDEX_CONFIG_PATH
+
+logger = logging.getLogger(__name__)
+
+TUNING_REPORT_PATH = os.path.join(DATA_DIR, "milvus_index_tuning.json")
+
+
+def load_vectors(collection: Collection, batch_size: int = 1000) -> Tuple[np.ndarray, np.ndarray]:
+    """读取集合中全部 (主键, 向量)"""
+    ids, vectors = [], []
+    iterator = collection.query_iterator(batch_size=batch_size, output_fields=["embedding"])
+    try:
+        while True:
+            batch = iterator.next()
+            if not batch:
+                break
+            for row in batch:
+                vector = row["embedding"]
+                # float16 向量字段以字节返回
+                if isinstance(vector, (bytes, bytearray)):
+                    vector = np.frombuffer(vector, dtype=np.float16)
+                ids.append(row["id"])
+                vectors.append(np.asarray(vector, dtype=np.float32))
+    finally:
+        iterator.close()
+    return np.asarray(ids, dtype=np.int64), np.vstack(vectors) if vectors else np.empty((0, 0), np.float32)
+
+
+def make_queries(vectors: np.ndarray, count: int, noise: float, seed: int = 0) -> np.ndarray:
+    """从库中抽样向量并加噪声作为查询，避免查询与某条向量完全相同"""
+    rng = np.random.default_rng(seed)
+    sample = vectors[rng.choice(len(vectors), size=min(count, len(vectors)), replace=False)]
+    queries = sample + noise * rng.standard_normal(sample.shape).astype(np.float32) / np.sqrt(sample.shape[1])
+    return queries / np.linalg.norm(queries, axis=1, keepdims=True)
+
+
+def exact_top_k(vectors: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    """暴力检索的精确 top_k 行号"""
+    scores = vectors @ queries.T
+    return np.argpartition(-scores, top_k - 1, axis=0)[:top_k].T
+
+
+def parameter_grid(index_types: List[str], rows: int, top_k: int, args) -> Iterator[Tuple[IndexConfig, List[Dict]]]:
+    """产出 (建索引配置, 检索参数列表)"""
+    for index_type in index_types:
+        if index_type == "FLAT":
+            yield IndexConfig.for_type("FLAT"), [{}]
+        elif index_type in ("IVF_FLAT", "IVF_SQ8"):
+            for nlist in args.nlist:
+                if nlist > rows:
+                    continue
+                yield (IndexConfig.for_type(index_type, {"nlist": nlist}),
+                       [{"nprobe": nprobe} for nprobe in args.nprobe if nprobe <= nlist])
+        elif index_type == "HNSW":
+            for m in args.hnsw_m:
+                yield (IndexConfig.for_type(index_type, {"M": m, "efConstruction": args.ef_construction}),
+                       [{"ef": ef} for ef in args.ef if ef >= top_k])
+        else:
+            raise ValueError(f"不支持的索引类型: {index_type}")
+
+
+def create_tuning_collection(name: str, dim: int, vector_type: str, ids: np.ndarray, vectors: np.ndarray,
+                             batch_size: int = 1000) -> Collection:
+    """创建只含主键和向量的临时集合并写入数据"""
+    if utility.has_collection(name):
+        utility.drop_collection(name)
+    collection = Collection(name=name, schema=CollectionSchema([
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="embedding", dtype=_VECTOR_DATA_TYPES[vector_type], dim=dim),
+    ]))
+    for start in range(0, len(ids), batch_size):
+        chunk = vectors[start:start + batch_size]
+        if vector_type == "float16":
+            chunk = list(chunk.astype(np.float16))
+        collection.insert([ids[start:start + batch_size].tolist(), chunk])
+    collection.flush()
+    return collection
+
+
+def evaluate(collection: Collection, config: IndexConfig, search_params: Dict, queries: np.ndarray,
+             truth_ids: List[set], top_k: int, vector_type: str) -> Dict[str, Any]:
+    """逐条查询，计算 recall@k 和延迟"""
+    latencies, recalls = [], []
+    for query, truth in zip(queries, truth_ids):
+        data = [query.astype(np.float16)] if vector_type == "float16" else [query.tolist()]
+        start = time.perf_counter()
+        hits = collection.search(data=data, anns_field="embedding", param=config.search_param(search_params),
+                                 limit=top_k)[0]
+        latencies.append(time.perf_counter() - start)
+        recalls.append(len({hit.id for hit in hits} & truth) / top_k)
+    latencies_ms = np.array(latencies) * 1000
+    return {
+        "recall": round(float(np.mean(recalls)), 4),
+        "p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+    }
+
+
+def choose(results: List[Dict[str, Any]], target_recall: float) -> Dict[str, Any]:
+    """达到目标召回率的配置中取 p95 延迟最低者，都达不到时取召回率最高者"""
+    qualified = [result for result in results if result["recall"] >= target_recall]
+    if qualified:
+        return min(qualified, key=lambda result: (result["p95_ms"], -result["recall"]))
+    logger.warning(f"没有配置达到目标召回率{target_recall}，选择召回率最高的配置")
+    return max(results, key=lambda result: (result["recall"], -result["p95_ms"]))
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Milvus向量索引调优")
+    parser.add_argument("--collection", default=default_collection_name())
+    parser.add_argument("--index-types", nargs="+", default=["HNSW", "IVF_FLAT", "IVF_SQ8", "FLAT"],
+                        type=str.upper)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--queries", type=int, default=200, help="评估用的查询数")
+    parser.add_argument("--noise", type=float, default=0.5, help="查询向量相对库中向量的扰动幅度")
+    parser.add_argument("--target-recall", type=float, default=0.95)
+    parser.add_argument("--nlist", type=int, nargs="+", default=[64, 128, 256, 512, 1024])
+    parser.add_argument("--nprobe", type=int, nargs="+", default=[4, 8, 16, 32, 64, 128])
+    parser.add_argument("--hnsw-m", type=int, nargs="+", default=[8, 16, 32])
+    parser.add_argument("--ef-construction", type=int, default=200)
+    parser.add_argument("--ef", type=int, nargs="+", default=[16, 32, 64, 128, 256])
+    parser.add_argument("--output", default=MILVUS_INDEX_CONFIG_PATH, help="选中配置的写入路径")
+    parser.add_argument("--report", default=TUNING_REPORT_PATH, help="完整调优结果的写入路径")
+    parser.add_argument("--apply", action="store_true", help="按选中配置重建线上集合的索引")
+    parser.add_argument("--keep-temp", action="store_true", help="保留临时集合")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    retriever = MilvusRetriever(collection_name=args.collection)
+    ids, vectors = load_vectors(retriever.collection)
+    if len(ids) < args.top_k:
+        logger.error(f"集合'{args.collection}'只有{len(ids)}条向量，无法调优")
+        return 1
+    queries = make_queries(vectors, args.queries, args.noise)
+    truth_ids = [set(ids[rows].tolist()) for rows in exact_top_k(vectors, queries, args.top_k)]
+    logger.info(f"共{len(ids)}条向量，{len(queries)}条查询，recall@{args.top_k} 目标 {args.target_recall}")
+
+    temp_name = f"{args.collection}_tune"
+    collection = create_tuning_collection(temp_name, retriever.dim, retriever.vector_type, ids, vectors)
+    results = []
+    try:
+        for config, search_grid in parameter_grid(args.index_types, len(ids), args.top_k, args):
+            start = time.perf_counter()
+            collection.release()
+            if collection.has_index():
+                collection.drop_index()
+            collection.create_index(field_name="embedding", index_params=config.index_params())
+            collection.load()
+            build_seconds = round(time.perf_counter() - start, 3)
+            for search_params in search_grid:
+                result = dict(
+                    index_type=config.index_type,
+                    build_params=config.build_params,
+                    search_params=config.search_param(search_params)["params"],
+                    build_s=build_seconds,
+                    **evaluate(collection, config, search_params, queries, truth_ids, args.top_k,
+                               retriever.vector_type),
+                )
+                logger.info(json.dumps(result, ensure_ascii=False))
+                results.append(result)
+    finally:
+        if not args.keep_temp:
+            utility.drop_collection(temp_name)
+
+    if not results:
+        logger.error("参数网格为空，没有可评估的配置")
+        return 1
+    best = choose(results, args.target_recall)
+    chosen = IndexConfig.for_type(best["index_type"], best["build_params"], best["search_params"])
+    chosen.save(args.output)
+    logger.info(f"选中配置已写入{args.output}: {chosen.model_dump()} (recall={best['recall']}, p95={best['p95_ms']}ms)")
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.report)), exist_ok=True)
+    with open(args.report, "w", encoding="utf-8") as f:
+        json.dump({
+            "collection": args.collection,
+            "vectors": len(ids),
+            "top_k": args.top_k,
+            "target_recall": args.target_recall,
+            "chosen": best,
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    logger.info(f"完整调优结果已写入{args.report}")
+
+    if args.apply:
+        retriever.rebuild_index(chosen)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,229 @@
+"""
+共享HTTP客户端
+为embedding、爬虫、打码平台等外部调用提供连接池、keep-alive、超时与带抖动的退避重试
+"""
+import os
+import random
+import asyncio
+import logging
+import threading
+import weakref
+from collections import Counter
+from typing import Dict, Any, Iterable
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from dotenv import load_dotenv
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 连接池配置
+HTTP_POOL_CONNECTIONS = int(os.getenv("HTTP_POOL_CONNECTIONS", "10"))   # 缓存的主机连接池个数
+HTTP_POOL_MAXSIZE = int(os.getenv("HTTP_POOL_MAXSIZE", "20"))           # 每个主机保持的最大连接数
+HTTP_POOL_BLOCK = os.getenv("HTTP_POOL_BLOCK", "false").lower() == "true"  # 连接用尽时等待而不是新建
+# 超时配置（秒）
+HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "5"))
+HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "30"))
+# 重试配置
+HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+HTTP_BACKOFF_JITTER = float(os.getenv("HTTP_BACKOFF_JITTER", "0.3"))
+
+# 需要重试的状态码
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+
+class JitterRetry(Retry):
+    """在指数退避时间上叠加随机抖动，避免大量客户端同时重试"""
+
+    jitter = HTTP_BACKOFF_JITTER
+
+    def get_backoff_time(self) -> float:
+        backoff = super().get_backoff_time()
+        return backoff + random.uniform(0, self.jitter) if backoff > 0 else 0
+
+
+class TimeoutSession(requests.Session):
+    """未显式指定 timeout 时使用默认超时的 Session"""
+
+    def __init__(self, timeout=(HTTP_CONNECT_TIMEOUT, HTTP_READ_TIMEOUT), retry_post: bool = True):
+        super().__init__()
+        self.default_timeout = timeout
+        self.retry_post = retry_post
+
+    def request(self, method, url, **kwargs):
+        kwargs.setdefault("timeout", self.default_timeout)
+        return super().request(method, url, **kwargs)
+
+
+_sessions: Dict[str, TimeoutSession] = {}
+# httpx.AsyncClient 的连接绑定在创建它的事件循环上，按事件循环分别缓存，事件循环被回收后随之释放
+_async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Dict[str, httpx.AsyncClient]]" = \
+    weakref.WeakKeyDictionary()
+_counters: Dict[str, Counter] = {}
+_lock = threading.Lock()
+
+
+def _retry_methods(retry_post: bool) -> Iterable[str]:
+    methods = set(Retry.DEFAULT_ALLOWED_METHODS)
+    if retry_post:
+        methods.add("POST")
+    return frozenset(methods)
+
+
+def create_session(name: str = "default", retry_post: bool = True) -> TimeoutSession:
+    """创建带连接池与重试的 Session
+
+    Args:
+        name: 统计信息中使用的名称
+        retry_post: 是否重试POST；有副作用的接口（如按次计费的打码）应设为False
+    """
+    session = TimeoutSession(retry_post=retry_post)
+    retry = JitterRetry(
+        total=HTTP_MAX_RETRIES,
+        backoff_factor=HTTP_BACKOFF_FACTOR,
+        status_forcelist=RETRY_STATUS_CODES,
+        allowed_methods=_retry_methods(retry_post),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=HTTP_POOL_CONNECTIONS,
+        pool_maxsize=HTTP_POOL_MAXSIZE,
+        pool_block=HTTP_POOL_BLOCK,
+        max_retries=retry,
+    )
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    counter = _counters.setdefault(name, Counter())
+
+    def count_response(response, *args, **kwargs):
+        counter["requests"] += 1
+        history = getattr(getattr(response.raw, "retries", None), "history", None)
+        if history:
+            counter["retries"] += len(history)
+
+    session.hooks["response"].append(count_response)
+    return session
+
+
+def get_session(name: str, retry_post: bool = True) -> TimeoutSession:
+    """获取进程内共享的命名 Session，首次调用时创建
+
+    同名 Session 只有一个，以不同的 retry_post 再次获取会抛出 ValueError，需要不同重试策略时应换一个名称
+    """
+    with _lock:
+        session = _sessions.get(name)
+        if session is None:
+            session = _sessions[name] = create_session(name, retry_post=retry_post)
+        elif session.retry_post != retry_post:
+            raise ValueError(f"共享Session'{name}'已按 retry_post={session.retry_post} 创建，"
+                             f"不能以 retry_post={retry_post} 复用")
+        return session
+
+
+def get_async_client(name: str) -> httpx.AsyncClient:
+    """获取当前事件循环内共享的命名异步客户端，首次调用时创建，须在事件循环中调用"""
+    loop = asyncio.get_running_loop()
+    with _lock:
+        clients = _async_clients.setdefault(loop, {})
+        client = clients.get(name)
+        if client is not None:
+            return client
+        counter = _counters.setdefault(f"{name}:async", Counter())
+
+        async def count_request(request):
+            counter["requests"] += 1
+
+        client = clients[name] = httpx.AsyncClient(
+            timeout=httpx.Timeout(HTTP_READ_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT),
+            limits=httpx.Limits(
+                max_connections=HTTP_POOL_MAXSIZE,
+                max_keepalive_connections=HTTP_POOL_MAXSIZE,
+            ),
+            # 连接建立失败时由传输层重试
+            transport=httpx.AsyncHTTPTransport(retries=HTTP_MAX_RETRIES),
+            event_hooks={"request": [count_request]},
+        )
+    return client
+
+
+def _async_client_name(client: httpx.AsyncClient) -> str:
+    for clients in list(_async_clients.values()):
+        for name, candidate in clients.items():
+            if candidate is client:
+                return name
+    return "unnamed"
+
+
+async def arequest_with_retry(client: httpx.AsyncClient, method: str, url: str, **kwargs) -> httpx.Response:
+    """发送异步请求，遇到可重试状态码或网络错误时按带抖动的指数退避重试"""
+    for attempt in range(HTTP_MAX_RETRIES + 1):
+        try:
+            response = await client.request(method, url, **kwargs)
+            if response.status_code not in RETRY_STATUS_CODES or attempt == HTTP_MAX_RETRIES:
+                return response
+            reason = f"HTTP {response.status_code}"
+        except httpx.TransportError as e:
+            if attempt == HTTP_MAX_RETRIES:
+                raise
+            reason = str(e) or e.__class__.__name__
+        delay = HTTP_BACKOFF_FACTOR * (2 ** attempt) + random.uniform(0, HTTP_BACKOFF_JITTER)
+        _counters.setdefault(f"{_async_client_name(client)}:async", Counter())["retries"] += 1
+        logger.warning(f"请求 {url} 失败（{reason}），{delay:.2f}秒后重试")
+        await asyncio.sleep(delay)
+
+
+def _session_pool_stats(session: TimeoutSession) -> Dict[str, Any]:
+    # 连接数、请求数是 urllib3 连接池的公开属性，空闲连接数读取其内部队列，取不到时不影响其余统计
+    pools = {}
+    for prefix, adapter in session.adapters.items():
+        manager = getattr(adapter, "poolmanager", None)
+        container = getattr(manager, "pools", None)
+        if container is None:
+            continue
+        for key in container.keys():
+            pool = container.get(key)
+            if pool is None:
+                continue
+            stats = {
+                "connections_created": getattr(pool, "num_connections", None),
+                "requests": getattr(pool, "num_requests", None),
+                "maxsize": HTTP_POOL_MAXSIZE,
+            }
+            try:
+                # 队列中的None是尚未建立连接的空位
+                stats["idle"] = sum(1 for conn in pool.pool.queue if conn is not None) if pool.pool is not None else 0
+            except Exception:
+                pass
+            pools[f"{pool.scheme}://{pool.host}:{pool.port}"] = stats
+    return pools
+
+
+def _async_pool_stats(client: httpx.AsyncClient) -> Dict[str, Any]:
+    stats = {"max_connections": HTTP_POOL_MAXSIZE}
+    # httpx 未公开连接池状态，这里读取底层连接池（httpcore）的连接列表；httpx 版本变化取不到时只返回配置
+    try:
+        pool = client._transport._pool
+        connections = list(pool.connections)
+        stats.update(connections=len(connections), idle=sum(1 for conn in connections if conn.is_idle()))
+    except Exception:
+        pass
+    return stats
+
+
+def pool_stats() -> Dict[str, Any]:
+    """所有共享客户端的连接池与请求统计，异步客户端按名称汇总各事件循环的连接"""
+    stats = {name: {"pools": _session_pool_stats(session)} for name, session in list(_sessions.items())}
+    for clients in list(_async_clients.values()):
+        for name, client in list(clients.items()):
+            pool = stats.setdefault(f"{name}:async", {}).setdefault("pool", {})
+            for key, value in _async_pool_stats(client).items():
+                pool[key] = value if key == "max_connections" else pool.get(key, 0) + value
+    for name, counter in list(_counters.items()):
+        stats.setdefault(name, {}).update(counter)
+    return stats
@@ -0,0 +1,258 @@
+"""
+准入控制
+向量化、检索、生成三个阶段各自限制同时进行的调用数，超出的请求进入有界等待队列；
+队列已满时立即拒绝（429），按当前排队长度估计等不到截止时间或等待超时时拒绝（503），
+拒绝时给出 Retry-After 建议，过载时延迟保持可预期而不是让所有请求一起超时
+
+只作用于异步查询接口，限制按工作进程计算。
+"""
+import os
+import math
+import time
+import asyncio
+import logging
+import contextvars
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import Dict, Any, Optional
+
+from app.metrics import record_admission_wait, record_admission_rejection, set_admission_state
+
+logger = logging.getLogger(__name__)
+
+# 各阶段同时进行的调用数上限，0表示不限制
+ADMISSION_EMBEDDING_CONCURRENCY = int(os.getenv("ADMISSION_EMBEDDING_CONCURRENCY", "32"))
+ADMISSION_SEARCH_CONCURRENCY = int(os.getenv("ADMISSION_SEARCH_CONCURRENCY", "16"))
+ADMISSION_GENERATION_CONCURRENCY = int(os.getenv("ADMISSION_GENERATION_CONCURRENCY", "16"))
+# 每个阶段等待队列的长度上限，队列满时直接拒绝
+ADMISSION_QUEUE_SIZE = int(os.getenv("ADMISSION_QUEUE_SIZE", "64"))
+# 单个阶段最长排队时间（秒）
+ADMISSION_QUEUE_TIMEOUT_S = float(os.getenv("ADMISSION_QUEUE_TIMEOUT_S", "10"))
+# 一次请求在各阶段排队的截止时间（秒），从请求进入接口开始计算
+ADMISSION_REQUEST_DEADLINE_S = float(os.getenv("ADMISSION_REQUEST_DEADLINE_S", "30"))
+
+EMBEDDING = "embedding"
+SEARCH = "search"
+GENERATION = "generation"
+
+# 估计排队时间用的阶段占用时长滑动平均系数
+_HOLD_EWMA_ALPHA = 0.2
+
+# 当前请求的排队截止时间（time.monotonic），请求之外为None
+_deadline: contextvars.ContextVar[Optional[float]] = contextvars.ContextVar("admission_deadline", default=None)
+
+
+class Overloaded(Exception):
+    """请求因过载被拒绝
+
+    Args:
+        stage: 拒绝请求的阶段
+        reason: queue_full（队列已满）、deadline（预计等不到截止时间）或 timeout（排队超时）
+        retry_after: 建议的重试等待秒数
+    """
+
+    def __init__(self, stage: str, reason: str, retry_after: int):
+        self.stage = stage
+        self.reason = reason
+        self.retry_after = retry_after
+        super().__init__(f"服务繁忙（{stage}: {reason}），请{retry_after}秒后重试")
+
+    @property
+    def status_code(self) -> int:
+        # 队列满是瞬时的流量过大，排队等不到则是服务处理能力不足
+        return 429 if self.reason == "queue_full" else 503
+
+
+@contextmanager
+def request_deadline(seconds: float = ADMISSION_REQUEST_DEADLINE_S):
+    """为代码块内的排队设置截止时间，已有更早的截止时间时保持不变"""
+    deadline = time.monotonic() + seconds if seconds > 0 else None
+    current = _deadline.get()
+    if current is not None and (deadline is None or current < deadline):
+        deadline = current
+    token = _deadline.set(deadline)
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+class StageLimiter:
+    """单个阶段的并发上限与先进先出的有界等待队列
+
+    Args:
+        stage: 阶段名
+        concurrency: 同时进行的调用数，0表示不限制
+        queue_size: 等待队列长度上限
+        queue_timeout: 最长排队秒数
+    """
+
+    def __init__(self, stage: str, concurrency: int, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_S):
+        self.stage = stage
+        self.concurrency = concurrency
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self.active = 0
+        self._waiters: deque = deque()
+        # 每次占用时长的滑动平均，还没有样本时为None
+        self._hold: Optional[float] = None
+        # 统计信息
+        self.admitted = 0
+        self.rejected = 0
+
+    def _expected_wait(self, position: int) -> float:
+        """排在第 position 位时预计的等待秒数"""
+        if self._hold is None or self.concurrency <= 0:
+            return 0.0
+        return self._hold * position / self.concurrency
+
+    def _reject(self, reason: str) -> Overloaded:
+        self.rejected += 1
+        record_admission_rejection(self.stage, reason)
+        retry_after = max(1, math.ceil(self._expected_wait(len(self._waiters) + 1)))
+        logger.warning(f"{self.stage}阶段过载，拒绝请求: {reason}，在途{self.active}，排队{len(self._waiters)}")
+        return Overloaded(self.stage, reason, retry_after)
+
+    def _publish(self):
+        set_admission_state(self.stage, self.active, len(self._waiters))
+
+    async def acquire(self):
+        if self.concurrency <= 0:
+            return
+        if self.active < self.concurrency and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            record_admission_wait(self.stage, 0.0)
+            self._publish()
+            return
+        if len(self._waiters) >= self.queue_size:
+            raise self._reject("queue_full")
+
+        timeout = self.queue_timeout
+        deadline = _deadline.get()
+        if deadline is not None:
+            timeout = min(timeout, deadline - time.monotonic())
+        # 按前面排队的请求数估计，等不到截止时间的请求直接拒绝，不占队列位置
+        if timeout <= 0 or self._expected_wait(len(self._waiters) + 1) > timeout:
+            raise self._reject("deadline")
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        self._publish()
+        start = time.perf_counter()
+        try:
+            await asyncio.wait_for(waiter, timeout)
+        except asyncio.TimeoutError:
+            # 超时与转交同时发生时名额已经归这个请求，拒绝前要交还
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise self._reject("timeout")
+        except asyncio.CancelledError:
+            # 名额已经转交过来但调用方被取消时，转交给下一个等待者
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._discard(waiter)
+            raise
+        self.admitted += 1
+        record_admission_wait(self.stage, time.perf_counter() - start)
+
+    def _discard(self, waiter: asyncio.Future):
+        try:
+            self._waiters.remove(waiter)
+        except ValueError:
+            pass
+        self._publish()
+
+    def release(self, held: float = None):
+        """释放名额，有等待者时直接转交给队首"""
+        if self.concurrency <= 0:
+            return
+        if held is not None:
+            self._hold = held if self._hold is None else (
+                _HOLD_EWMA_ALPHA * held + (1 - _HOLD_EWMA_ALPHA) * self._hold
+            )
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._publish()
+                return
+        self.active -= 1
+        self._publish()
+
+    @asynccontextmanager
+    async def slot(self):
+        """占用一个名额执行代码块"""
+        await self.acquire()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.release(time.perf_counter() - start)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "concurrency": self.concurrency,
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+            "avg_hold_ms": round(self._hold * 1000, 1) if self._hold is not None else None,
+        }
+
+
+class Hold:
+    """由调用方决定释放时机的名额，用于占用时间跨越响应生命周期的流式生成
+
+    acquire 之前或重复调用 release 都不做任何事，可以放在多个清理路径中
+    """
+
+    def __init__(self, limiter: StageLimiter):
+        self.limiter = limiter
+        self._start: Optional[float] = None
+
+    @property
+    def held(self) -> bool:
+        return self._start is not None
+
+    async def acquire(self):
+        await self.limiter.acquire()
+        self._start = time.perf_counter()
+
+    def release(self):
+        if self._start is None:
+            return
+        held, self._start = time.perf_counter() - self._start, None
+        self.limiter.release(held)
+
+
+class AdmissionController:
+    """各阶段的准入限制"""
+
+    def __init__(self, limits: Dict[str, int] = None, queue_size: int = ADMISSION_QUEUE_SIZE,
+                 queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_S):
+        limits = limits or {
+            EMBEDDING: ADMISSION_EMBEDDING_CONCURRENCY,
+            SEARCH: ADMISSION_SEARCH_CONCURRENCY,
+            GENERATION: ADMISSION_GENERATION_CONCURRENCY,
+        }
+        self.limiters = {stage: StageLimiter(stage, concurrency, queue_size, queue_timeout)
+                         for stage, concurrency in limits.items()}
+
+    def slot(self, stage: str):
+        """占用指定阶段的一个名额，如 async with admission.slot(GENERATION): ..."""
+        return self.limiters[stage].slot()
+
+    def hold(self, stage: str) -> Hold:
+        """指定阶段的一个待取得的名额，由调用方 acquire 并负责 release"""
+        return Hold(self.limiters[stage])
+
+    def stats(self) -> Dict[str, Any]:
+        return {stage: limiter.stats() for stage, limiter in self.limiters.items()}
+
+
+admission = AdmissionController()
@@ -0,0 +1,210 @@
+"""
+语义答案缓存
+按查询向量的余弦相似度复用已生成的答案，跳过检索与LLM调用
+"""
+import os
+import time
+import logging
+import threading
+from typing import List, Dict, Any, Optional, Hashable
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl
+    fcntl = None
+
+from app.config.pathconfig import DATA_DIR
+from app.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+# 语义答案缓存配置，ANSWER_CACHE_CAPACITY=0 时关闭
+ANSWER_CACHE_CAPACITY = int(os.getenv("ANSWER_CACHE_CAPACITY", "1000"))
+ANSWER_CACHE_THRESHOLD = float(os.getenv("ANSWER_CACHE_THRESHOLD", "0.95"))
+# 语料版本标记文件，保存单调递增的版本号，入库后加一，其他worker据此清空各自的缓存
+CORPUS_GENERATION_PATH = os.getenv("CORPUS_GENERATION_PATH", os.path.join(DATA_DIR, "corpus_generation"))
+# 检查语料版本标记的最小间隔（毫秒），间隔内的查找不读取文件
+ANSWER_CACHE_GENERATION_CHECK_MS = int(os.getenv("ANSWER_CACHE_GENERATION_CHECK_MS", "500"))
+
+
+class SemanticAnswerCache:
+    """基于查询向量相似度的答案缓存
+
+    所有缓存向量保存在一个归一化后的 float32 矩阵中，查找时一次矩阵乘法
+    得到与全部条目的余弦相似度；容量满时淘汰最久未访问的条目。
+    options 为影响检索结果的请求参数（top_k、检索模式等），只有参数相同的条目才会命中。
+    """
+
+    def __init__(self, capacity: int = 1000, threshold: float = 0.95, generation_path: Optional[str] = None,
+                 generation_check_ms: int = ANSWER_CACHE_GENERATION_CHECK_MS):
+        self.capacity = capacity
+        self.threshold = threshold
+        self.generation_path = generation_path
+        self.generation_check_interval = generation_check_ms / 1000
+        self._generation = self._read_generation()
+        self._next_generation_check = time.monotonic() + self.generation_check_interval
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self._lock = threading.Lock()
+        # 向量维度在第一次写入时确定
+        self._vectors: Optional[np.ndarray] = None
+        self._used = np.zeros(capacity, dtype=bool)
+        self._options = np.zeros(capacity, dtype=np.int64)
+        self._last_access = np.zeros(capacity, dtype=np.float64)
+        self._entries: List[Optional[Dict[str, Any]]] = [None] * capacity
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> Optional[np.ndarray]:
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        # 全零默认向量（embedding失败）不参与缓存
+        if norm == 0:
+            return None
+        return vector / norm
+
+    @staticmethod
+    def _options_hash(options: Hashable) -> int:
+        return hash(options)
+
+    def lookup(self, embedding: List[float], options: Hashable) -> Optional[Dict[str, Any]]:
+        """查找相似查询的缓存答案
+
+        Returns:
+            命中时返回 {"documents", "doc_ids", "answer", "similarity"}，否则返回None
+        """
+        if not self.enabled:
+            return None
+        self._check_generation()
+        query = self._normalize(embedding)
+        with self._lock:
+            if query is None or self._vectors is None or query.shape[0] != self._vectors.shape[1]:
+                self.misses += 1
+                record_cache("answer", False)
+                return None
+            scores = self._vectors @ query
+            # 只比较已占用且请求参数相同的条目
+            scores[~(self._used & (self._options == self._options_hash(options)))] = -np.inf
+            slot = int(np.argmax(scores))
+            if scores[slot] < self.threshold:
+                self.misses += 1
+                record_cache("answer", False)
+                return None
+            self.hits += 1
+            record_cache("answer", True)
+            self._last_access[slot] = time.monotonic()
+            return dict(self._entries[slot], similarity=float(scores[slot]))
+
+    def store(self, embedding: List[float], options: Hashable, documents: List[Any], answer: str):
+        """写入一条缓存"""
+        if not self.enabled:
+            return
+        vector = self._normalize(embedding)
+        if vector is None:
+            return
+        with self._lock:
+            if self._vectors is None or self._vectors.shape[1] != vector.shape[0]:
+                self._vectors = np.zeros((self.capacity, vector.shape[0]), dtype=np.float32)
+                self._used[:] = False
+            free = np.flatnonzero(~self._used)
+            if free.size:
+                slot = int(free[0])
+            else:
+                slot = int(np.argmin(self._last_access))
+                self.evictions += 1
+            self._vectors[slot] = vector
+            self._used[slot] = True
+            self._options[slot] = self._options_hash(options)
+            self._last_access[slot] = time.monotonic()
+            self._entries[slot] = {
+                "documents": list(documents),
+                "doc_ids": [getattr(doc, "id", None) for doc in documents],
+                "answer": answer,
+            }
+
+    def invalidate(self, broadcast: bool = True):
+        """清空全部缓存，入库新数据后调用
+
+        Args:
+            broadcast: 是否更新语料版本标记，通知其他worker进程
+        """
+        with self._lock:
+            self._used[:] = False
+            self._entries = [None] * self.capacity
+            self.invalidations += 1
+            if broadcast and self.generation_path:
+                self._generation = self._bump_generation()
+        logger.info("语义答案缓存已清空")
+
+    @staticmethod
+    def _parse_generation(text: str) -> int:
+        try:
+            return int(text.strip() or 0)
+        except ValueError:
+            return 0
+
+    def _read_generation(self) -> Optional[int]:
+        if not self.generation_path:
+            return None
+        try:
+            with open(self.generation_path, "r") as f:
+                return self._parse_generation(f.read())
+        except OSError:
+            return None
+
+    def _bump_generation(self) -> int:
+        """版本号加一并写回标记文件
+
+        文件锁保证多个进程同时入库时版本号不会重复；版本号只增不减，原地覆盖不会留下旧内容，
+        读取方不会看到截断后的空文件。
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(self.generation_path)), exist_ok=True)
+        fd = os.open(self.generation_path, os.O_RDWR | os.O_CREAT, 0o644)
+        with os.fdopen(fd, "r+") as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            generation = self._parse_generation(f.read()) + 1
+            f.seek(0)
+            f.write(str(generation))
+            f.truncate()
+            f.flush()
+        return generation
+
+    def _check_generation(self):
+        """语料版本号被其他进程更新时清空本进程缓存，每个检查间隔内最多读取一次标记文件"""
+        now = time.monotonic()
+        if now < self._next_generation_check:
+            return
+        self._next_generation_check = now + self.generation_check_interval
+        generation = self._read_generation()
+        if generation != self._generation:
+            self._generation = generation
+            self.invalidate(broadcast=False)
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "size": int(self._used.sum()),
+            "capacity": self.capacity,
+            "threshold": self.threshold,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "evictions": self.evictions,
+            "invalidations": self.invalidations,
+        }
+
+
+# 进程内共享的语义答案缓存实例
+answer_cache = SemanticAnswerCache(
+    capacity=ANSWER_CACHE_CAPACITY,
+    threshold=ANSWER_CACHE_THRESHOLD,
+    generation_path=CORPUS_GENERATION_PATH
+)
@@ -0,0 +1,97 @@
+"""
+查询向量请求合并
+把短时间窗口内并发到达的 aembed_query 请求合并成一次 aembed_documents 调用
+"""
+import asyncio
+import logging
+from collections import Counter
+from typing import List, Dict, Any, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class EmbeddingCoalescer:
+    """embedding请求合并器，接口与被包装的模型一致
+
+    第一个请求到达后最多等待 window_ms 毫秒，或攒满 max_batch 条后立即发送，
+    一次请求的结果按位置分发给各个等待中的调用方。
+    """
+
+    def __init__(self, embedding, window_ms: float = 5.0, max_batch: int = 10):
+        self.embedding = embedding
+        self.model = embedding.model
+        self.dimension = embedding.dimension
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, min(max_batch, getattr(embedding, "max_batch_size", max_batch)))
+        self._pending: List[Tuple[str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        # 事件循环只持有任务的弱引用，发送中的批次在这里保留强引用，防止被回收
+        self._tasks: Set[asyncio.Task] = set()
+        # 统计信息
+        self.batches = 0
+        self.texts = 0
+        self.full_flushes = 0
+        self.fill_histogram: Counter = Counter()
+
+    async def aembed_query(self, text: str) -> List[float]:
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((text, future))
+        if len(self._pending) >= self.max_batch:
+            self.full_flushes += 1
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+        return await future
+
+    def _flush(self):
+        """取出当前积攒的请求并发送"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_running_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[str, asyncio.Future]]):
+        # 同一批内相同文本只请求一次
+        texts = list(dict.fromkeys(text for text, _ in batch))
+        self.batches += 1
+        self.texts += len(batch)
+        self.fill_histogram[len(batch)] += 1
+        try:
+            vectors = await self.embedding.aembed_documents(texts)
+            by_text = dict(zip(texts, vectors))
+            for text, future in batch:
+                # 调用方可能已取消等待
+                if not future.done():
+                    future.set_result(by_text[text])
+        except Exception as e:
+            logger.error(f"合并请求向量化失败: {str(e)}")
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embedding.embed_query(text)
+
+    def embed_documents(self, documents: List[str]) -> List[List[float]]:
+        return self.embedding.embed_documents(documents)
+
+    async def aembed_documents(self, documents: List[str]) -> List[List[float]]:
+        return await self.embedding.aembed_documents(documents)
+
+    def stats(self) -> Dict[str, Any]:
+        """合并效果统计"""
+        return {
+            "window_ms": self.window * 1000,
+            "max_batch": self.max_batch,
+            "batches": self.batches,
+            "texts": self.texts,
+            "full_flushes": self.full_flushes,
+            "avg_batch_size": self.texts / self.batches if self.batches else 0.0,
+            "avg_fill_ratio": self.texts / (self.batches * self.max_batch) if self.batches else 0.0,
+            "batch_size_histogram": {str(size): count for size, count in sorted(self.fill_histogram.items())},
+        }
@@ -0,0 +1,168 @@
+"""
+提示上下文构建
+去掉近似重复的文档，按检索排名在token预算内分配各文档的篇幅，超出部分按行截断
+
+文档顺序即检索结果的顺序（向量、词法、RRF融合或MMR重排），不再按 similarity 重新排序：
+融合和词法检索的分数与向量相似度不在同一量纲
+"""
+import os
+import math
+import logging
+from typing import List, Optional, Set
+
+from pydantic import BaseModel
+
+from app.retriever import Document
+from app.rag.embedding_cache import normalize_text
+
+logger = logging.getLogger(__name__)
+
+# 上下文token预算，0表示不限制
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2000"))
+# 两篇文档内容的字符二元组Jaccard相似度达到该值即视为重复，只保留排在前面的一篇
+CONTEXT_DEDUP_THRESHOLD = float(os.getenv("CONTEXT_DEDUP_THRESHOLD", "0.8"))
+# 单篇文档正文至少分到的token数，分不到时舍弃排名最后的文档
+CONTEXT_MIN_DOC_TOKENS = int(os.getenv("CONTEXT_MIN_DOC_TOKENS", "48"))
+
+DOCUMENT_SEPARATOR = "\n\n"
+TRUNCATION_MARK = "……"
+
+
+def estimate_tokens(text: str) -> int:
+    """估算token数：中日韩字符及全角标点按每字1个，其余按每4个字符1个"""
+    wide = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return wide + math.ceil((len(text) - wide) / 4)
+
+
+def _shingles(text: str) -> Set[str]:
+    text = "".join(normalize_text(text).split())
+    return {text[i:i + 2] for i in range(len(text) - 1)} or {text}
+
+
+def _jaccard(a: Set[str], b: Set[str]) -> float:
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def _header(doc: Document) -> str:
+    return f"标题: {doc.title}\n作者: {doc.author}\n内容: "
+
+
+def truncate_lines(text: str, max_tokens: int) -> str:
+    """按行截断到不超过 max_tokens，第一行就放不下时按字截断"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    budget = max_tokens - estimate_tokens(TRUNCATION_MARK)
+    kept, used = [], 0
+    for line in text.split("\n"):
+        cost = estimate_tokens(line) + (1 if kept else 0)
+        if used + cost > budget:
+            break
+        kept.append(line)
+        used += cost
+    if not kept:
+        line, cut = text.split("\n", 1)[0], ""
+        for ch in line:
+            if estimate_tokens(cut + ch) > budget:
+                break
+            cut += ch
+        kept = [cut]
+    return "\n".join(kept) + TRUNCATION_MARK
+
+
+class Context(BaseModel):
+    """构建好的上下文"""
+    text: str
+    documents: List[Document]
+    tokens: int
+    duplicates: int = 0
+    dropped: int = 0
+    truncated: int = 0
+
+
+class ContextBuilder:
+    """在token预算内构建提示上下文
+
+    Args:
+        budget: 上下文token预算，0表示不限制
+        dedup_threshold: 近似重复判定阈值
+        min_doc_tokens: 单篇文档正文的最少token数
+    """
+
+    def __init__(self, budget: int = CONTEXT_TOKEN_BUDGET, dedup_threshold: float = CONTEXT_DEDUP_THRESHOLD,
+                 min_doc_tokens: int = CONTEXT_MIN_DOC_TOKENS):
+        self.budget = budget
+        self.dedup_threshold = dedup_threshold
+        self.min_doc_tokens = min_doc_tokens
+
+    def deduplicate(self, documents: List[Document]) -> List[Document]:
+        """按输入顺序保留文档，与排在前面的文档主键相同或内容近似重复的丢弃"""
+        kept, kept_ids, kept_shingles = [], set(), []
+        for doc in documents:
+            if doc.id is not None and doc.id in kept_ids:
+                continue
+            shingles = _shingles(doc.content)
+            if any(_jaccard(shingles, other) >= self.dedup_threshold for other in kept_shingles):
+                continue
+            kept.append(doc)
+            kept_ids.add(doc.id)
+            kept_shingles.append(shingles)
+        return kept
+
+    def allocate(self, documents: List[Document]) -> List[Optional[int]]:
+        """为每篇文档的正文分配token数，第 i 名的权重为 1/(i+1)；篇幅小于分配额的文档把余量让给其他文档
+
+        Returns:
+            与 documents 对应的正文token上限，None 表示舍弃该文档
+        """
+        needs = [estimate_tokens(doc.content) for doc in documents]
+        overhead = [estimate_tokens(_header(doc) + DOCUMENT_SEPARATOR) for doc in documents]
+        active = list(range(len(documents)))
+        while active:
+            remaining = self.budget - sum(overhead[i] for i in active)
+            weights = {i: 1.0 / (rank + 1) for rank, i in enumerate(active)}
+            limits = {}
+            pool = list(active)
+            while pool and remaining > 0:
+                total = sum(weights[i] for i in pool)
+                shares = {i: remaining * weights[i] / total for i in pool}
+                satisfied = [i for i in pool if needs[i] <= shares[i]]
+                if not satisfied:
+                    limits.update({i: int(shares[i]) for i in pool})
+                    pool = []
+                    break
+                for i in satisfied:
+                    limits[i] = needs[i]
+                    remaining -= needs[i]
+                    pool.remove(i)
+            limits.update({i: 0 for i in pool})
+            short = [i for i in active if limits[i] < min(needs[i], self.min_doc_tokens)]
+            if not short:
+                return [limits.get(i) for i in range(len(documents))]
+            # 舍弃排名最后的文档后重新分配
+            active.pop()
+        return [None] * len(documents)
+
+    def build(self, documents: List[Document]) -> Context:
+        unique = self.deduplicate(documents)
+        duplicates = len(documents) - len(unique)
+        limits = self.allocate(unique) if self.budget > 0 else [math.inf] * len(unique)
+
+        parts, kept, truncated = [], [], 0
+        for doc, limit in zip(unique, limits):
+            if limit is None:
+                continue
+            content = doc.content
+            if limit < estimate_tokens(content):
+                content = truncate_lines(content, limit)
+                truncated += 1
+            parts.append(_header(doc) + content)
+            kept.append(doc)
+        text = DOCUMENT_SEPARATOR.join(parts)
+        context = Context(text=text, documents=kept, tokens=estimate_tokens(text), duplicates=duplicates,
+                          dropped=len(unique) - len(kept), truncated=truncated)
+        logger.debug(f"上下文: {len(kept)}篇文档，约{context.tokens}个token，"
+                     f"去重{duplicates}篇，舍弃{context.dropped}篇，截断{truncated}篇")
+        return context
+
+
+context_builder = ContextBuilder()
@@ -0,0 +1,216 @@
+"""
+查询向量缓存
+按 (模型, 维度, 规范化文本) 缓存embedding，支持容量/过期淘汰与SQLite持久化
+"""
+import os
+import time
+import sqlite3
+import hashlib
+import logging
+import threading
+import unicodedata
+from array import array
+from collections import OrderedDict
+from typing import List, Optional, Dict, Any
+
+from app.metrics import record_cache
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全角转半角、合并空白"""
+    return " ".join(unicodedata.normalize("NFKC", text).split())
+
+
+def is_valid_embedding(embedding: List[float]) -> bool:
+    """判断是否为有效向量；请求失败时返回的全零默认向量无效"""
+    return bool(embedding) and any(embedding)
+
+
+class EmbeddingCache:
+    """带容量与TTL限制的LRU向量缓存
+
+    内存中使用 OrderedDict 做LRU；指定 path 时同时写入SQLite，
+    多个worker进程及重启后可以共享已缓存的向量。
+    """
+
+    # 每写入多少次清理一次持久化存储
+    _PRUNE_INTERVAL = 256
+
+    def __init__(self, max_size: int = 10000, ttl: float = 7 * 24 * 3600, path: Optional[str] = None):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._db: Optional[sqlite3.Connection] = None
+        if path:
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+            self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+            self._db.execute("PRAGMA journal_mode=WAL")
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "key TEXT PRIMARY KEY, vector BLOB NOT NULL, expires_at REAL NOT NULL)"
+            )
+
+    @staticmethod
+    def make_key(model: str, dimension: int, text: str) -> str:
+        """生成缓存键"""
+        raw = f"{model}\x00{dimension}\x00{normalize_text(text)}"
+        return hashlib.sha1(raw.encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[List[float]]:
+        """读取缓存，未命中或已过期返回None"""
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > now:
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    record_cache("embedding", True)
+                    return vector
+                del self._entries[key]
+
+            vector = self._load(key, now)
+            if vector is not None:
+                self._remember(key, vector, now + self.ttl)
+                self.hits += 1
+                record_cache("embedding", True)
+                return vector
+
+            self.misses += 1
+
+            record_cache("embedding", False)
+            return None
+
+    def set(self, key: str, vector: List[float]):
+        """写入缓存，无效向量直接忽略"""
+        if not is_valid_embedding(vector):
+            return
+        expires_at = time.time() + self.ttl
+        with self._lock:
+            self._remember(key, vector, expires_at)
+            self._store(key, vector, expires_at)
+
+    def clear(self):
+        """清空缓存"""
+        with self._lock:
+            self._entries.clear()
+            if self._db is not None:
+                self._db.execute("DELETE FROM embeddings")
+
+    def stats(self) -> Dict[str, Any]:
+        """命中统计"""
+        total = self.hits + self.misses
+        return {
+            "size": len(self._entries),
+            "max_size": self.max_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "persistent": self._db is not None,
+        }
+
+    def _remember(self, key: str, vector: List[float], expires_at: float):
+        self._entries[key] = (expires_at, vector)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def _load(self, key: str, now: float) -> Optional[List[float]]:
+        if self._db is None:
+            return None
+        try:
+            row = self._db.execute(
+                "SELECT vector, expires_at FROM embeddings WHERE key = ?", (key,)
+            ).fetchone()
+        except sqlite3.Error as e:
+            logger.error(f"读取向量缓存失败: {str(e)}")
+            return None
+        if row is None or row[1] <= now:
+            return None
+        return array("f", row[0]).tolist()
+
+    def _store(self, key: str, vector: List[float], expires_at: float):
+        if self._db is None:
+            return
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO embeddings (key, vector, expires_at) VALUES (?, ?, ?)",
+                (key, array("f", vector).tobytes(), expires_at)
+            )
+            self._writes += 1
+            if self._writes % self._PRUNE_INTERVAL == 0:
+                self._prune()
+        except sqlite3.Error as e:
+            logger.error(f"写入向量缓存失败: {str(e)}")
+
+    def _prune(self):
+        """删除过期条目，并把持久化存储限制在 max_size 条以内"""
+        self._db.execute("DELETE FROM embeddings WHERE expires_at <= ?", (time.time(),))
+        self._db.execute(
+            "DELETE FROM embeddings WHERE key IN ("
+            "SELECT key FROM embeddings ORDER BY expires_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_size,)
+        )
+
+
+class CachedEmbedding:
+    """给embedding模型加上缓存，接口与被包装的模型一致"""
+
+    def __init__(self, embedding, cache: EmbeddingCache):
+        self.embedding = embedding
+        self.cache = cache
+        self.model = embedding.model
+        self.dimension = embedding.dimension
+
+    def _key(self, text: str) -> str:
+        return self.cache.make_key(self.model, self.dimension, text)
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = self.embedding.embed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    async def aembed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        vector = self.cache.get(key)
+        if vector is None:
+            vector = await self.embedding.aembed_query(text)
+            self.cache.set(key, vector)
+        return vector
+
+    def _split(self, documents: List[str]):
+        """拆分出已缓存结果与需要请求的文本"""
+        keys = [self._key(text) for text in documents]
+        results = [self.cache.get(key) for key in keys]
+        missing = [i for i, vector in enumerate(results) if vector is None]
+        return keys, results, missing
+
+    def _fill(self, keys, results, missing, vectors) -> List[List[float]]:
+        for i, vector in zip(missing, vectors):
+            results[i] = vector
+            self.cache.set(keys[i], vector)
+        return results
+
+    def embed_documents(self, documents: List[str]) -> List[List[float]]:
+        keys, results, missing = self._split(documents)
+        vectors = self.embedding.embed_documents([documents[i] for i in missing]) if missing else []
+        return self._fill(keys, results, missing, vectors)
+
+    async def aembed_documents(self, documents: List[str]) -> List[List[float]]:
+        keys, results, missing = self._split(documents)
+        vectors = await self.embedding.aembed_documents([documents[i] for i in missing]) if missing else []
+        return self._fill(keys, results, missing, vectors)
+
+    def stats(self) -> Dict[str, Any]:
+        return self.cache.stats()
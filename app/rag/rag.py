@@ -2,10 +2,24 @@ from app.llm import create_llm_client
 import os
 from dotenv import load_dotenv
 import logging
-from typing import List, Dict, Any, Optional
-import requests
-from pymilvus import connections, Collection, utility, FieldSchema, CollectionSchema, DataType
-from pydantic import BaseModel
+import asyncio
+from typing import List, Dict, Any, Optional, AsyncIterator, Tuple, Literal
+import httpx
+import numpy as np
+from app.retriever import Document, SearchFilter, create_retriever, default_collection_name, EMBEDDING_DIMENSION
+from app.config.pathconfig import DATA_DIR
+from app.net import get_session, get_async_client, arequest_with_retry
+from app.rag.embedding_cache import EmbeddingCache, CachedEmbedding, is_valid_embedding, normalize_text
+from app.rag.coalescer import EmbeddingCoalescer
+from app.rag.answer_cache import answer_cache
+from app.metrics import stage_timer, upstream_timer, record_embedding_fallback, record_context_tokens
+from app.rag.context_builder import Context, context_builder
+from app.rag.admission import admission, Hold, Overloaded, EMBEDDING, SEARCH, GENERATION
+from app.rag.singleflight import SingleFlight
+from app.retriever.lexical import lexical_index_for, reciprocal_rank_fusion
+from app.retriever.index_config import validate_search_params
+from app.retriever.mmr import diversify, MMR_LAMBDA, MMR_FETCH_MULTIPLIER
+from pydantic import BaseModel, Field, field_validator
 
 # 加载环境变量
 load_dotenv()
@@ -13,21 +27,46 @@ load_dotenv()
 # 配置日志
 logger = logging.getLogger(__name__)
 
-# Milvus配置
-MILVUS_HOST = os.getenv("MILVUS_HOST")
-MILVUS_PORT = os.getenv("MILVUS_PORT")
-COLLECTION_NAME = os.getenv("MILVUS_COLLECTION_NAME")
+# Milvus集合名称
+COLLECTION_NAME = default_collection_name()
 
 # 阿里云DashScope配置
 DASHSCOPE_API_KEY = os.getenv("DASHSCOPE_API_KEY")
-DASHSCOPE_EMBEDDING_URL = "https://dashscope.aliyuncs.com/api/v1/services/embeddings/text-embedding/text-embedding"
+# 可指向本地的兼容服务（如 benchmarks 中的假服务）
+DASHSCOPE_EMBEDDING_URL = os.getenv(
+    "DASHSCOPE_EMBEDDING_URL",
+    "https://dashscope.aliyuncs.com/api/v1/services/embeddings/text-embedding/text-embedding"
+)
 
-class Document(BaseModel):
-    """文档模型"""
-    title: str
-    author: Optional[str] = None
-    content: str
-    similarity: float = 0.0
+# 查询向量缓存配置，EMBEDDING_CACHE_SIZE=0 时关闭缓存
+EMBEDDING_CACHE_SIZE = int(os.getenv("EMBEDDING_CACHE_SIZE", "10000"))
+EMBEDDING_CACHE_TTL = float(os.getenv("EMBEDDING_CACHE_TTL", str(7 * 24 * 3600)))
+# 持久化文件路径，设为空字符串时只缓存在内存中
+EMBEDDING_CACHE_PATH = os.getenv("EMBEDDING_CACHE_PATH", os.path.join(DATA_DIR, "embedding_cache.sqlite3"))
+
+# 并发查询向量请求合并配置，窗口设为0时关闭合并
+EMBEDDING_COALESCE_WINDOW_MS = float(os.getenv("EMBEDDING_COALESCE_WINDOW_MS", "5"))
+EMBEDDING_COALESCE_MAX_BATCH = int(os.getenv("EMBEDDING_COALESCE_MAX_BATCH", "10"))
+
+# 默认检索模式: vector | lexical | hybrid
+SEARCH_MODE = os.getenv("SEARCH_MODE", "vector")
+# 混合检索时每一路召回的候选数为 top_k 的倍数
+HYBRID_CANDIDATE_MULTIPLIER = int(os.getenv("HYBRID_CANDIDATE_MULTIPLIER", "4"))
+
+# 带过滤条件的词法检索多取的候选倍数，词法索引不含元数据，取出后再按条件筛选
+FILTERED_LEXICAL_MULTIPLIER = int(os.getenv("FILTERED_LEXICAL_MULTIPLIER", "10"))
+
+# 是否默认对检索结果做多样性重排（MMR），可按请求开启或关闭
+DIVERSITY_RERANK = os.getenv("DIVERSITY_RERANK", "false").lower() == "true"
+
+# 相同的并发查询（规范化文本、top_k、检索选项都相同）是否只执行一次并共享结果
+QUERY_SINGLEFLIGHT = os.getenv("QUERY_SINGLEFLIGHT", "true").lower() == "true"
+
+# 批量查询时同时进行的生成调用数
+BATCH_GENERATION_CONCURRENCY = int(os.getenv("BATCH_GENERATION_CONCURRENCY", "8"))
+
+# 生成回答失败时返回给用户的提示
+ANSWER_ERROR_MESSAGE = "抱歉，生成回答时遇到问题，请稍后再试。"
 
 class DashScopeEmbedding:
     """阿里云DashScope的Embedding模型封装"""
@@ -39,34 +78,70 @@ class DashScopeEmbedding:
         if not self.api_key:
             raise ValueError("DashScope API Key未设置")
         
+        self.model = "text-embedding-v3"
+        self.dimension = EMBEDDING_DIMENSION
+        # 单次请求最多包含的文本数（text-embedding-v3 限制为10条）
+        self.max_batch_size = 10
+        
         self.headers = {
             "Authorization": f"Bearer {self.api_key}",
             "Content-Type": "application/json"
         }
+        # 共享的连接池会话，复用TLS连接；查询路径的请求失败时由会话按退避策略重试
+        self.session = get_session("dashscope")
+        # request_embeddings 的调用方自行按批重试（见 app.crawler.ingest），这里的POST不再由会话重试，避免两层重试叠加
+        self.batch_session = get_session("dashscope-batch", retry_post=False)
     
-    def embed_query(self, text: str) -> List[float]:
-        """将查询文本转换为向量表示
-        """
-        try:
-            payload = {
-                "model": "text-embedding-v3",
-                "input": {
-                    "texts": [text]
-                },
-                "parameters": {
-                    "dimension": 1024
-                }
+    def _build_payload(self, texts: List[str]) -> Dict[str, Any]:
+        """构造DashScope请求体"""
+        return {
+            "model": self.model,
+            "input": {
+                "texts": texts
+            },
+            "parameters": {
+                "dimension": self.dimension
             }
-            
-            response = requests.post(
+        }
+    
+    def _zero_vectors(self, count: int) -> List[List[float]]:
+        """请求失败时代替的默认向量，同时计入兜底指标"""
+        record_embedding_fallback(count)
+        return [[0.0] * self.dimension for _ in range(count)]
+    
+    def _post(self, texts: List[str], session=None):
+        """同步发送embedding请求，默认使用带重试的共享会话"""
+        with upstream_timer("dashscope", "embedding"):
+            return (session or self.session).post(
                 DASHSCOPE_EMBEDDING_URL,
                 headers=self.headers,
-                json=payload
+                json=self._build_payload(texts)
             )
+    
+    def _get_async_client(self) -> httpx.AsyncClient:
+        """获取共享的异步HTTP客户端"""
+        return get_async_client("dashscope")
+    
+    async def _apost(self, texts: List[str]) -> httpx.Response:
+        """异步发送embedding请求，失败时按退避策略重试"""
+        with upstream_timer("dashscope", "embedding"):
+            return await arequest_with_retry(
+                self._get_async_client(),
+                "POST",
+                DASHSCOPE_EMBEDDING_URL,
+                headers=self.headers,
+                json=self._build_payload(texts)
+            )
+    
+    def embed_query(self, text: str) -> List[float]:
+        """将查询文本转换为向量表示
+        """
+        try:
+            response = self._post([text])
             
             if response.status_code != 200:
                 logger.error(f"获取嵌入向量失败: {response.text}")
-                return [0.0] * 1024  # 返回默认向量
+                return self._zero_vectors(1)[0]  # 返回默认向量
             
             result = response.json()
             embedding = result["output"]["embeddings"][0]["embedding"]
@@ -74,42 +149,138 @@ class DashScopeEmbedding:
         
         except Exception as e:
             logger.error(f"获取嵌入向量异常: {str(e)}")
-            return [0.0] * 1024  # 返回默认向量
+            return self._zero_vectors(1)[0]  # 返回默认向量
+    
+    @staticmethod
+    def _parse_embeddings(response, texts: List[str]) -> List[List[float]]:
+        """解析响应中的向量，失败时抛出异常"""
+        if response.status_code != 200:
+            raise RuntimeError(f"获取嵌入向量失败: {response.status_code} {response.text}")
+        
+        items = response.json()["output"]["embeddings"]
+        # 按 text_index 还原输入顺序
+        items = sorted(items, key=lambda item: item.get("text_index", 0))
+        if len(items) != len(texts):
+            raise RuntimeError(f"嵌入向量数量不匹配: 期望{len(texts)}，实际{len(items)}")
+        return [item["embedding"] for item in items]
+    
+    def request_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """请求一批文本的向量表示
+
+        与 embed_documents 不同，请求失败时直接抛出异常而不是返回默认向量，
+        且会话层不重试POST，供需要自行重试的批量调用方使用。
+        """
+        response = self._post(texts, self.batch_session)
+        return self._parse_embeddings(response, texts)
+    
+    async def arequest_embeddings(self, texts: List[str]) -> List[List[float]]:
+        """异步请求一批文本的向量表示，失败时抛出异常"""
+        response = await self._apost(texts)
+        return self._parse_embeddings(response, texts)
+    
+    def _batches(self, documents: List[str]) -> List[List[str]]:
+        """按单次请求上限切分文本"""
+        return [documents[i:i + self.max_batch_size] for i in range(0, len(documents), self.max_batch_size)]
     
     def embed_documents(self, documents: List[str]) -> List[List[float]]:
-        """将多个文档转换为向量表示
+        """将多个文档转换为向量表示，超过单次请求上限时分批请求
+        """
+        embeddings = []
+        for batch in self._batches(documents):
+            try:
+                embeddings.extend(self._parse_embeddings(self._post(batch), batch))
+            except Exception as e:
+                logger.error(f"获取嵌入向量异常: {str(e)}")
+                embeddings.extend(self._zero_vectors(len(batch)))  # 返回默认向量
+        return embeddings
+    
+    async def aembed_query(self, text: str) -> List[float]:
+        """异步将查询文本转换为向量表示
         """
-        if not documents:
-            return []
-        
         try:
-            payload = {
-                "model": "text-embedding-v3",
-                "input": {
-                    "texts": documents
-                },
-                "parameters": {
-                    "dimension": 1024
-                }
-            }
-            
-            response = requests.post(
-                DASHSCOPE_EMBEDDING_URL,
-                headers=self.headers,
-                json=payload
-            )
+            response = await self._apost([text])
             
             if response.status_code != 200:
                 logger.error(f"获取嵌入向量失败: {response.text}")
-                return [[0.0] * 1024 for _ in documents]  # 返回默认向量
+                return self._zero_vectors(1)[0]  # 返回默认向量
             
             result = response.json()
-            embeddings = [item["embedding"] for item in result["output"]["embeddings"]]
-            return embeddings
+            return result["output"]["embeddings"][0]["embedding"]
         
         except Exception as e:
             logger.error(f"获取嵌入向量异常: {str(e)}")
-            return [[0.0] * 1024 for _ in documents]  # 返回默认向量
+            return self._zero_vectors(1)[0]  # 返回默认向量
+    
+    async def _aembed_batch(self, batch: List[str]) -> List[List[float]]:
+        try:
+            return await self.arequest_embeddings(batch)
+        except Exception as e:
+            logger.error(f"获取嵌入向量异常: {str(e)}")
+            return self._zero_vectors(len(batch))  # 返回默认向量
+    
+    async def aembed_documents(self, documents: List[str]) -> List[List[float]]:
+        """异步将多个文档转换为向量表示，超过单次请求上限时分批并发请求
+        """
+        results = await asyncio.gather(*(self._aembed_batch(batch) for batch in self._batches(documents)))
+        return [embedding for batch in results for embedding in batch]
+
+class SearchOptions(BaseModel):
+    """检索选项"""
+    # 检索模式: vector 向量检索 / lexical 词法检索 / hybrid 两者RRF融合
+    mode: Literal["vector", "lexical", "hybrid"] = SEARCH_MODE
+    # 向量检索参数（如 nprobe/ef），覆盖索引配置中的默认值
+    search_params: Optional[Dict[str, int]] = None
+    # 多样性重排：多取 fetch_multiplier 倍候选后按MMR选出top_k，可限制同一作者/朝代的篇数
+    diversity: bool = DIVERSITY_RERANK
+    mmr_lambda: float = Field(MMR_LAMBDA, ge=0.0, le=1.0)
+    fetch_multiplier: int = Field(MMR_FETCH_MULTIPLIER, ge=1, le=50)
+    max_per_author: Optional[int] = Field(None, ge=1)
+    max_per_dynasty: Optional[int] = Field(None, ge=1)
+    # 过滤条件：朝代（如 唐代）、作者名（如 李白）、入库时间范围 [created_after, created_before)，Unix时间戳
+    dynasty: Optional[str] = None
+    author: Optional[str] = None
+    created_after: Optional[int] = None
+    created_before: Optional[int] = None
+    
+    @field_validator("search_params")
+    @classmethod
+    def _check_search_params(cls, value):
+        return validate_search_params(value)
+    
+    def cache_key(self) -> str:
+        """影响检索结果的选项，用于区分语义答案缓存条目"""
+        return self.model_dump_json()
+    
+    def search_filter(self) -> Optional[SearchFilter]:
+        """检索过滤条件，没有设置任何条件时为None"""
+        filters = SearchFilter(dynasty=self.dynasty, author=self.author,
+                               created_after=self.created_after, created_before=self.created_before)
+        return None if filters.is_empty() else filters
+
+def create_embedding_model():
+    """Embedding模型工厂函数，按配置加上请求合并与查询向量缓存
+
+    调用顺序为 缓存 -> 请求合并 -> DashScope，只有未命中缓存的查询才会进入合并窗口。
+    """
+    embedding = DashScopeEmbedding()
+    if EMBEDDING_COALESCE_WINDOW_MS > 0:
+        embedding = EmbeddingCoalescer(
+            embedding,
+            window_ms=EMBEDDING_COALESCE_WINDOW_MS,
+            max_batch=EMBEDDING_COALESCE_MAX_BATCH
+        )
+        logger.info(f"启用查询向量请求合并: window={EMBEDDING_COALESCE_WINDOW_MS}ms, max_batch={EMBEDDING_COALESCE_MAX_BATCH}")
+    
+    if EMBEDDING_CACHE_SIZE <= 0:
+        return embedding
+    
+    cache = EmbeddingCache(
+        max_size=EMBEDDING_CACHE_SIZE,
+        ttl=EMBEDDING_CACHE_TTL,
+        path=EMBEDDING_CACHE_PATH or None
+    )
+    logger.info(f"启用查询向量缓存: size={EMBEDDING_CACHE_SIZE}, ttl={EMBEDDING_CACHE_TTL}s, path={EMBEDDING_CACHE_PATH or '内存'}")
+    return CachedEmbedding(embedding, cache)
 
 class RAG:
     """检索增强生成系统"""
@@ -120,132 +291,413 @@ class RAG:
         self.llm_client = create_llm_client()
         logger.info(f"成功创建LLM客户端: {self.llm_client.__class__.__name__}")
         
-        # 创建嵌入模型 - 使用阿里云DashScope
-        self.embeddings = DashScopeEmbedding()
+        # 创建嵌入模型 - 使用阿里云DashScope（带查询向量缓存）
+        self.embeddings = create_embedding_model()
         
-        # 连接Milvus
-        try:
-            self._connect_milvus()
-            logger.info("Milvus连接成功")
-        except Exception as e:
-            logger.error(f"Milvus连接失败: {str(e)}")
-            raise ValueError("Milvus连接失败")
+        # 创建检索器，默认连接Milvus，可通过 RETRIEVER_BACKEND=local 使用本地索引
+        self.retriever = create_retriever(collection_name=COLLECTION_NAME)
+        logger.info(f"成功创建检索器: {self.retriever.__class__.__name__}")
+        # 与检索后端/集合对应的词法索引
+        self.lexical_index = lexical_index_for(self.retriever)
+        
+        # 合并相同的并发查询
+        self.query_flight = SingleFlight("query")
+    
+    def stats(self) -> Dict[str, Any]:
+        """运行时统计信息"""
+        stats = {}
+        # 沿包装链收集各层embedding组件的统计
+        model = self.embeddings
+        while model is not None:
+            if isinstance(model, CachedEmbedding):
+                stats["embedding_cache"] = model.stats()
+            elif isinstance(model, EmbeddingCoalescer):
+                stats["embedding_coalescer"] = model.stats()
+            model = getattr(model, "embedding", None)
+        stats["answer_cache"] = answer_cache.stats()
+        if hasattr(self.llm_client, "stats"):
+            stats["llm_router"] = self.llm_client.stats()
+        stats["admission"] = admission.stats()
+        stats["query_singleflight"] = self.query_flight.stats()
+        return stats
+    
+    def _retrieve_many(self, queries: List[str], query_embeddings: List[List[float]], top_k: int,
+                       options: SearchOptions) -> List[List[Document]]:
+        """按检索模式批量召回文档（阻塞调用），向量检索一次提交全部查询向量"""
+        with stage_timer("search"):
+            return self._search_many(queries, query_embeddings, top_k, options)
+    
+    def _lexical_search(self, query: str, top_k: int, filters: Optional[SearchFilter]) -> List[Document]:
+        """词法检索；有过滤条件时多取候选，再由检索后端按元数据筛选"""
+        if filters is None:
+            return self.lexical_index.search(query, top_k)
+        documents = self.lexical_index.search(query, top_k * FILTERED_LEXICAL_MULTIPLIER)
+        allowed = self.retriever.filter_ids([doc.id for doc in documents], filters)
+        return [doc for doc in documents if doc.id in allowed][:top_k]
+    
+    def _search_many(self, queries: List[str], query_embeddings: List[List[float]], top_k: int,
+                     options: SearchOptions) -> List[List[Document]]:
+        if options.diversity:
+            return self._diverse_search_many(queries, query_embeddings, top_k, options)
+        filters = options.search_filter()
+        if options.mode == "lexical":
+            return [self._lexical_search(query, top_k, filters) for query in queries]
+        if options.mode == "hybrid":
+            # 两路各多取一些候选，再用RRF融合
+            candidates = max(top_k * HYBRID_CANDIDATE_MULTIPLIER, top_k)
+            vector_results = self.retriever.search_many(query_embeddings, candidates, options.search_params, filters)
+            return [
+                reciprocal_rank_fusion([vector_docs, self._lexical_search(query, candidates, filters)], top_k=top_k)
+                for query, vector_docs in zip(queries, vector_results)
+            ]
+        return self.retriever.search_many(query_embeddings, top_k, options.search_params, filters)
+    
+    def _diverse_search_many(self, queries: List[str], query_embeddings: List[List[float]], top_k: int,
+                             options: SearchOptions) -> List[List[Document]]:
+        """多取候选（向量检索时连同文档向量），再做MMR与作者/朝代上限重排"""
+        fetch = top_k * options.fetch_multiplier
+        filters = options.search_filter()
+        if options.mode == "lexical":
+            candidates = [(self._lexical_search(query, fetch, filters), None, None) for query in queries]
+        else:
+            # 混合检索与不重排时一样，两路各多取一些再融合出 fetch 个候选
+            depth = max(fetch * HYBRID_CANDIDATE_MULTIPLIER, fetch) if options.mode == "hybrid" else fetch
+            vector_results = self.retriever.search_many_with_vectors(query_embeddings, depth, options.search_params,
+                                                                     filters)
+            candidates = []
+            for query, query_embedding, (docs, vectors) in zip(queries, query_embeddings, vector_results):
+                if options.mode == "vector":
+                    candidates.append((docs, vectors, query_embedding))
+                    continue
+                # 融合结果中只出现在词法检索里的文档没有向量，按零向量处理（不受相似度惩罚）
+                fused = reciprocal_rank_fusion([docs, self._lexical_search(query, depth, filters)], top_k=fetch)
+                row_of = {doc.id: row for row, doc in enumerate(docs)}
+                fused_vectors = np.zeros((len(fused), vectors.shape[1] if vectors.ndim == 2 else 0), np.float32)
+                for i, doc in enumerate(fused):
+                    if doc.id in row_of:
+                        fused_vectors[i] = vectors[row_of[doc.id]]
+                candidates.append((fused, fused_vectors, None))
+        
+        with stage_timer("rerank"):
+            return [
+                diversify(docs, top_k, query_embedding, vectors, options.mmr_lambda,
+                          options.max_per_author, options.max_per_dynasty)
+                for docs, vectors, query_embedding in candidates
+            ]
+    
+    def _retrieve(self, query: str, query_embedding: List[float], top_k: int,
+                  options: SearchOptions) -> List[Document]:
+        """按检索模式召回文档（阻塞调用）"""
+        return self._retrieve_many([query], [query_embedding], top_k, options)[0]
+    
+    def _search_error(self, e: Exception) -> List[Document]:
+        """检索失败时返回的占位文档"""
+        logger.error(f"搜索文档时出错: {str(e)}")
+        return [
+            Document(
+                title="查询错误",
+                author="系统",
+                content=f"查询出错: {str(e)}",
+                similarity=0.0
+            )
+        ]
     
-    def _connect_milvus(self):
-        """连接Milvus向量数据库"""
+    def retrieve(self, query: str, query_embedding: List[float], top_k: int = 3,
+                 options: SearchOptions = None) -> List[Document]:
+        """用已计算好的查询向量检索相关文档"""
         try:
-            logger.info(f"尝试连接Milvus: {MILVUS_HOST}:{MILVUS_PORT}")
-            
-            # 连接Milvus服务器
-            connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
-            
-            # 检查集合是否存在
-            if not utility.has_collection(COLLECTION_NAME):
-                logger.info(f"集合 {COLLECTION_NAME} 不存在，创建新集合")
-                raise ValueError("Milvus集合不存在")
-            
-            # 加载集合
-            self.collection = Collection(COLLECTION_NAME)
-            self.collection.load()
-            
-            logger.info(f"成功连接到Milvus集合: {COLLECTION_NAME}")
-            
+            return self._retrieve(query, query_embedding, top_k, options or SearchOptions())
         except Exception as e:
-            logger.error(f"Milvus连接失败: {str(e)}")
-            raise ValueError("Milvus连接失败")
+            return self._search_error(e)
     
+    async def aretrieve(self, query: str, query_embedding: List[float], top_k: int = 3,
+                        options: SearchOptions = None) -> List[Document]:
+        """异步用已计算好的查询向量检索相关文档，过载时抛出 Overloaded"""
+        async with admission.slot(SEARCH):
+            try:
+                # 检索器接口是同步的，放到线程池中运行，避免阻塞事件循环；
+                # to_thread 会带上当前上下文，检索耗时能计入本次请求的 Server-Timing
+                return await asyncio.to_thread(
+                    self._retrieve, query, query_embedding, top_k, options or SearchOptions()
+                )
+            except Exception as e:
+                return self._search_error(e)
     
-    def search(self, query: str, top_k: int = 3) -> List[Document]:
+    def search(self, query: str, top_k: int = 3, options: SearchOptions = None) -> List[Document]:
         """搜索相关文档"""
-        try:
-            if not self.collection:
-                raise ValueError("Milvus连接不可用")
-            
-            # 获取查询的嵌入向量
+        # 获取查询的嵌入向量
+        with stage_timer("embedding"):
             query_embedding = self.embeddings.embed_query(query)
-            
-            # 搜索参数
-            search_params = {
-                "metric_type": "IP",
-                "params": {"nprobe": 10}
-            }
-            
-            # 执行搜索
-            results = self.collection.search(
-                data=[query_embedding],
-                anns_field="embedding",
-                param=search_params,
-                limit=top_k,
-                output_fields=["title", "author", "content"]
-            )
-            
-            # 处理结果
-            documents = []
-            for hits in results:
-                for hit in hits:
-                    # 计算相似度
-                    similarity = (hit.distance + 1) / 2
-                    
-                    doc = Document(
-                        title=hit.entity.get("title", "未知标题"),
-                        author=hit.entity.get("author", "未知作者"),
-                        content=hit.entity.get("content", ""),
-                        similarity=similarity
-                    )
-                    documents.append(doc)
-            
-            return documents
-            
-        except Exception as e:
-            logger.error(f"搜索文档时出错: {str(e)}")
-            return [
-                Document(
-                    title="查询错误",
-                    author="系统",
-                    content=f"查询出错: {str(e)}",
-                    similarity=0.0
-                )
-            ]
+        return self.retrieve(query, query_embedding, top_k, options)
     
-    def generate_answer(self, query: str, documents: List[Document]) -> str:
+    async def _aembed_query(self, query: str) -> List[float]:
+        """在向量化阶段的准入限制内获取查询向量"""
+        async with admission.slot(EMBEDDING):
+            with stage_timer("embedding"):
+                return await self.embeddings.aembed_query(query)
+    
+    async def asearch(self, query: str, top_k: int = 3, options: SearchOptions = None) -> List[Document]:
+        """异步搜索相关文档"""
+        # 异步获取查询的嵌入向量
+        query_embedding = await self._aembed_query(query)
+        return await self.aretrieve(query, query_embedding, top_k, options)
+    
+    def build_context(self, documents: List[Document]) -> Context:
+        """去重并在token预算内拼接文档，记录上下文token数"""
+        with stage_timer("prompt"):
+            context = context_builder.build(documents)
+        record_context_tokens(context.tokens)
+        return context
+    
+    def _build_messages(self, query: str, context: Context) -> List[Dict[str, str]]:
+        """根据查询和构建好的上下文构建提示"""
+        return [
+            {"role": "system", "content": "你是一个智能助手，基于提供的文档内容创作诗歌。如果文档中没有相关信息，请诚实地告知用户。"},
+            {"role": "user", "content": f"根据以下文档内容:\n\n{context.text}\n\n和问题: {query}，生成一首诗新的歌。"}
+        ]
+    
+    def generate_answer(self, query: str, documents: List[Document], context: Context = None) -> str:
         """根据查询和检索到的文档生成回答
+
+        Args:
+            context: 已构建的上下文，不传时由 documents 构建
         """
         try:
-            # 准备上下文
-            context = "\n\n".join([
-                f"标题: {doc.title}\n作者: {doc.author}\n内容: {doc.content}"
-                for doc in documents
-            ])
+            messages = self._build_messages(query, context or self.build_context(documents))
             
-            logger.info(f"上下文: {context}")
-            
-            # 构建提示
-            messages = [
-                {"role": "system", "content": "你是一个智能助手，基于提供的文档内容创作诗歌。如果文档中没有相关信息，请诚实地告知用户。"},
-                {"role": "user", "content": f"根据以下文档内容:\n\n{context}\n\n和问题: {query}，生成一首诗新的歌。"}
-            ]
-
- 
-                    # 调用LLM生成回答
-            answer = self.llm_client.get_completion(
-                        messages=messages)
+            # 调用LLM生成回答
+            with stage_timer("generation"):
+                answer = self.llm_client.get_completion(
+                            messages=messages)
             return answer
 
         except Exception as e:
             logger.error(f"生成回答时出错: {str(e)}")
-            return "抱歉，生成回答时遇到问题，请稍后再试。"
+            return ANSWER_ERROR_MESSAGE
+    
+    async def agenerate_answer(self, query: str, documents: List[Document], context: Context = None) -> str:
+        """异步根据查询和检索到的文档生成回答，生成阶段过载时抛出 Overloaded
+        """
+        async with admission.slot(GENERATION):
+            try:
+                messages = self._build_messages(query, context or self.build_context(documents))
+                
+                # 调用LLM生成回答
+                with stage_timer("generation"):
+                    return await self.llm_client.aget_completion(messages=messages)
+
+            except Exception as e:
+                logger.error(f"生成回答时出错: {str(e)}")
+                return ANSWER_ERROR_MESSAGE
+    
+    @staticmethod
+    def _store_answer(query_embedding: List[float], cache_key: Tuple, documents: List[Document], answer: str):
+        """缓存成功的回答；检索或生成失败的结果不缓存"""
+        if answer and answer != ANSWER_ERROR_MESSAGE and all(doc.id is not None for doc in documents):
+            answer_cache.store(query_embedding, cache_key, documents, answer)
+    
+    @staticmethod
+    def _cached_result(query: str, cached: Dict[str, Any]) -> Dict[str, Any]:
+        logger.info(f"语义答案缓存命中: {query} (相似度 {cached['similarity']:.4f})")
+        return {
+            "query": query,
+            "documents": cached["documents"],
+            "answer": cached["answer"],
+            "cached": True,
+            "context_tokens": None
+        }
+    
+    def query(self, query: str, top_k: int = 3, use_cache: bool = True, options: SearchOptions = None):
+        """执行完整的RAG流程：检索+生成
+
+        Args:
+            use_cache: 为False时跳过语义答案缓存查找，强制重新检索和生成
+            options: 检索选项，默认按 SEARCH_MODE 检索
+        """
+        options = options or SearchOptions()
+        cache_key = (top_k, options.cache_key())
+        with stage_timer("embedding"):
+            query_embedding = self.embeddings.embed_query(query)
+        
+        if use_cache:
+            cached = answer_cache.lookup(query_embedding, cache_key)
+            if cached:
+                return self._cached_result(query, cached)
+        
+        # 搜索相关文档
+        documents = self.retrieve(query, query_embedding, top_k, options)
+        
+        # 生成回答
+        context = self.build_context(documents)
+        answer = self.generate_answer(query, documents, context)
+        self._store_answer(query_embedding, cache_key, documents, answer)
+        
+        return {
+            "query": query,
+            "documents": documents,
+            "answer": answer,
+            "cached": False,
+            "context_tokens": context.tokens
+        }
+    
+    async def aquery(self, query: str, top_k: int = 3, use_cache: bool = True, options: SearchOptions = None):
+        """异步执行完整的RAG流程：检索+生成
+
+        同一时刻相同的查询只执行一次，后到的请求等待并共享结果（包括异常）。
+        """
+        options = options or SearchOptions()
+        if not QUERY_SINGLEFLIGHT:
+            return await self._aquery(query, top_k, use_cache, options)
+        # use_cache 也作为键的一部分，跳过缓存的请求不会拿到缓存命中的结果
+        key = (normalize_text(query), top_k, use_cache, options.cache_key())
+        result = await self.query_flight.do(key, lambda: self._aquery(query, top_k, use_cache, options))
+        # 共享的结果按各自的查询文本返回
+        return dict(result, query=query)
     
-    def query(self, query: str, top_k: int = 3):
-        """执行完整的RAG流程：检索+生成"""
+    async def _aquery(self, query: str, top_k: int, use_cache: bool, options: SearchOptions):
+        cache_key = (top_k, options.cache_key())
+        query_embedding = await self._aembed_query(query)
+        
+        if use_cache:
+            cached = answer_cache.lookup(query_embedding, cache_key)
+            if cached:
+                return self._cached_result(query, cached)
+        
         # 搜索相关文档
-        documents = self.search(query, top_k)
+        documents = await self.aretrieve(query, query_embedding, top_k, options)
         
         # 生成回答
-        answer = self.generate_answer(query, documents)
+        context = self.build_context(documents)
+        answer = await self.agenerate_answer(query, documents, context)
+        self._store_answer(query_embedding, cache_key, documents, answer)
         
         return {
             "query": query,
             "documents": documents,
-            "answer": answer
+            "answer": answer,
+            "cached": False,
+            "context_tokens": context.tokens
         }
+    
+    async def astream_query(self, query: str, top_k: int = 3, use_cache: bool = True,
+                            options: SearchOptions = None,
+                            generation_slot: Hold = None) -> AsyncIterator[Tuple[str, Any]]:
+        """流式执行RAG流程
+
+        先产出 ("documents", 文档列表) 和 ("context", 上下文统计)，再逐段产出 ("token", 文本)，
+        生成失败时产出 ("error", 错误信息)。命中语义答案缓存时整段答案作为一个token产出。
 
+        Args:
+            generation_slot: 生成阶段的名额（admission.hold(GENERATION)），未命中缓存时在产出文档前取得；
+                由调用方在响应结束时释放，生成器被挂起时不会一直占着名额等垃圾回收
+        """
+        options = options or SearchOptions()
+        cache_key = (top_k, options.cache_key())
+        query_embedding = await self._aembed_query(query)
+        
+        if use_cache:
+            cached = answer_cache.lookup(query_embedding, cache_key)
+            if cached:
+                result = self._cached_result(query, cached)
+                yield "documents", result["documents"]
+                yield "token", result["answer"]
+                return
+        
+        documents = await self.aretrieve(query, query_embedding, top_k, options)
+        # 先取得生成名额再产出文档，过载时在第一个事件之前抛出 Overloaded
+        if generation_slot is not None:
+            await generation_slot.acquire()
+        yield "documents", documents
+        
+        try:
+            context = self.build_context(documents)
+            yield "context", {"tokens": context.tokens, "documents": len(context.documents),
+                              "duplicates": context.duplicates, "truncated": context.truncated}
+            messages = self._build_messages(query, context)
+            tokens = []
+            with stage_timer("generation"):
+                async for token in self.llm_client.astream_completion(messages=messages):
+                    tokens.append(token)
+                    yield "token", token
+            self._store_answer(query_embedding, cache_key, documents, "".join(tokens))
+        except Exception as e:
+            logger.error(f"流式生成回答时出错: {str(e)}")
+            yield "error", ANSWER_ERROR_MESSAGE
+    
+    async def abatch_query(self, queries: List[str], top_k: int = 3, generate: bool = True,
+                           use_cache: bool = True, options: SearchOptions = None,
+                           concurrency: int = None) -> List[Dict[str, Any]]:
+        """批量执行RAG流程
+
+        全部查询一次向量化、一次向量检索，再在并发上限内生成回答。
+        单条失败不影响其他条目，错误信息记录在该条目的 error 字段。
+
+        Args:
+            generate: 为False时只检索不生成
+            concurrency: 同时进行的生成调用数，默认 BATCH_GENERATION_CONCURRENCY
+        """
+        options = options or SearchOptions()
+        cache_key = (top_k, options.cache_key())
+        results = [
+            {"query": query, "documents": [], "answer": None, "cached": False, "error": None, "context_tokens": None}
+            for query in queries
+        ]
+        
+        async with admission.slot(EMBEDDING):
+            with stage_timer("embedding"):
+                query_embeddings = await self.embeddings.aembed_documents(queries)
+        pending = []
+        for i, query_embedding in enumerate(query_embeddings):
+            if not is_valid_embedding(query_embedding):
+                results[i]["error"] = "获取嵌入向量失败"
+                continue
+            if generate and use_cache:
+                cached = answer_cache.lookup(query_embedding, cache_key)
+                if cached:
+                    results[i].update(self._cached_result(queries[i], cached))
+                    continue
+            pending.append(i)
+        if not pending:
+            return results
+        
+        try:
+            async with admission.slot(SEARCH):
+                documents_list = await asyncio.to_thread(
+                    self._retrieve_many,
+                    [queries[i] for i in pending],
+                    [query_embeddings[i] for i in pending],
+                    top_k,
+                    options
+                )
+        except Overloaded:
+            raise
+        except Exception as e:
+            logger.error(f"批量检索时出错: {str(e)}")
+            for i in pending:
+                results[i]["error"] = f"查询出错: {str(e)}"
+            return results
+        for i, documents in zip(pending, documents_list):
+            results[i]["documents"] = documents
+        if not generate:
+            return results
+        
+        semaphore = asyncio.Semaphore(max(1, concurrency or BATCH_GENERATION_CONCURRENCY))
+        
+        async def generate_one(i: int):
+            context = self.build_context(results[i]["documents"])
+            results[i]["context_tokens"] = context.tokens
+            async with semaphore:
+                try:
+                    answer = await self.agenerate_answer(queries[i], results[i]["documents"], context)
+                except Overloaded as e:
+                    # 单条被拒绝只记录在该条目，不影响已生成的其他条目
+                    results[i]["error"] = str(e)
+                    return
+            if answer == ANSWER_ERROR_MESSAGE:
+                results[i]["error"] = answer
+                return
+            results[i]["answer"] = answer
+            self._store_answer(query_embeddings[i], cache_key, results[i]["documents"], answer)
+        
+        await asyncio.gather(*(generate_one(i) for i in pending))
+        return results
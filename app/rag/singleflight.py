@@ -0,0 +1,85 @@
+"""
+相同请求合并（single-flight）
+同一个键的调用正在进行时，后到的调用不再重复执行，而是等待同一个结果；
+结果或异常原样分发给所有等待者
+"""
+import asyncio
+import logging
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+from app.metrics import record_singleflight
+
+logger = logging.getLogger(__name__)
+
+
+class _Call:
+    """一次正在进行的共享调用"""
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+        self.duplicates = 0
+
+
+class SingleFlight:
+    """按键合并并发的相同异步调用
+
+    共享的调用在独立的任务中执行，第一个调用方断开不会影响其他等待者；
+    所有等待者都取消后才取消共享的调用，避免为没人要的结果继续付费。
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        # 统计信息
+        self.executions = 0
+        self.collapsed = 0
+        self.abandoned = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        call = self._calls.get(key)
+        if call is None:
+            # 任务复制当前上下文，执行耗时计入第一个调用方的 Server-Timing
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda _, key=key, call=call: self._finish(key, call))
+            self.executions += 1
+            record_singleflight(self.name, collapsed=False)
+        else:
+            call.duplicates += 1
+            self.collapsed += 1
+            record_singleflight(self.name, collapsed=True)
+
+        call.waiters += 1
+        try:
+            # shield：某个等待者被取消时不取消共享的任务
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if not call.task.done() and call.waiters == 1:
+                self.abandoned += 1
+                call.task.cancel()
+                # 立即移除，取消生效前到达的相同请求重新执行而不是拿到取消
+                if self._calls.get(key) is call:
+                    del self._calls[key]
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _finish(self, key: Hashable, call: _Call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if call.duplicates:
+            logger.info(f"{self.name}: 合并了{call.duplicates}个相同的并发请求")
+        # 所有等待者都已取消时没有人取走异常，在这里取出避免 "exception was never retrieved"
+        if not call.task.cancelled() and call.task.exception() is not None and not call.waiters:
+            logger.debug(f"{self.name}: 无人等待的调用失败: {call.task.exception()}")
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.executions + self.collapsed
+        return {
+            "in_flight": len(self._calls),
+            "executions": self.executions,
+            "collapsed": self.collapsed,
+            "abandoned": self.abandoned,
+            "collapse_rate": self.collapsed / total if total else 0.0,
+        }
@@ -0,0 +1 @@
+from .retriever import *
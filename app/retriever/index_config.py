@@ -0,0 +1,123 @@
+"""
+Milvus向量索引配置
+索引类型与建索引/检索参数按 环境变量 > 配置文件 > 默认值 的顺序确定，
+配置文件由 python -m app.milvus.tune_index 调优后写入
+"""
+import os
+import json
+import logging
+from typing import Dict, Any, Optional
+
+from pydantic import BaseModel, Field
+
+from app.config.pathconfig import DATA_DIR
+
+logger = logging.getLogger(__name__)
+
+MILVUS_INDEX_CONFIG_PATH = os.getenv("MILVUS_INDEX_CONFIG_PATH", os.path.join(DATA_DIR, "milvus_index.json"))
+# 以下环境变量设置后覆盖配置文件，参数为JSON，如 MILVUS_INDEX_PARAMS='{"M": 16, "efConstruction": 200}'
+MILVUS_INDEX_TYPE = os.getenv("MILVUS_INDEX_TYPE")
+MILVUS_INDEX_PARAMS = os.getenv("MILVUS_INDEX_PARAMS")
+MILVUS_SEARCH_PARAMS = os.getenv("MILVUS_SEARCH_PARAMS")
+
+# 各索引类型的默认 (建索引参数, 检索参数)
+INDEX_DEFAULTS: Dict[str, tuple] = {
+    "FLAT": ({}, {}),
+    "IVF_FLAT": ({"nlist": 128}, {"nprobe": 10}),
+    "IVF_SQ8": ({"nlist": 128}, {"nprobe": 10}),
+    "HNSW": ({"M": 16, "efConstruction": 200}, {"ef": 64}),
+}
+
+# 各索引类型允许按请求调整的检索参数及上限
+SEARCH_PARAM_LIMITS: Dict[str, Dict[str, int]] = {
+    "FLAT": {},
+    "IVF_FLAT": {"nprobe": 65536},
+    "IVF_SQ8": {"nprobe": 65536},
+    "HNSW": {"ef": 32768},
+}
+
+
+class IndexConfig(BaseModel):
+    """向量索引配置"""
+    index_type: str = "IVF_FLAT"
+    metric_type: str = "IP"
+    build_params: Dict[str, Any] = Field(default_factory=dict)
+    search_params: Dict[str, Any] = Field(default_factory=dict)
+
+    @classmethod
+    def for_type(cls, index_type: str, build_params: Dict[str, Any] = None,
+                 search_params: Dict[str, Any] = None) -> "IndexConfig":
+        """按索引类型的默认值补全参数"""
+        index_type = index_type.upper()
+        if index_type not in INDEX_DEFAULTS:
+            raise ValueError(f"不支持的索引类型: {index_type}，可选 {list(INDEX_DEFAULTS)}")
+        default_build, default_search = INDEX_DEFAULTS[index_type]
+        return cls(
+            index_type=index_type,
+            build_params=dict(default_build, **(build_params or {})),
+            search_params=dict(default_search, **(search_params or {})),
+        )
+
+    def index_params(self) -> Dict[str, Any]:
+        """create_index 使用的参数"""
+        return {"metric_type": self.metric_type, "index_type": self.index_type, "params": self.build_params}
+
+    def search_param(self, overrides: Optional[Dict[str, Any]] = None, limit: int = None) -> Dict[str, Any]:
+        """search 使用的参数，overrides 为单次请求指定的检索参数，不适用于当前索引类型的键被忽略
+
+        Args:
+            limit: 本次检索的返回条数；HNSW 要求 ef 不小于返回条数（与调优时 ef >= top_k 的规则一致），
+                多样性重排、混合检索多取候选时自动提高 ef
+        """
+        params = dict(self.search_params)
+        allowed = SEARCH_PARAM_LIMITS.get(self.index_type, {})
+        params.update({key: value for key, value in (overrides or {}).items() if key in allowed})
+        if self.index_type == "HNSW" and limit:
+            params["ef"] = min(max(params.get("ef", limit), limit), allowed["ef"])
+        return {"metric_type": self.metric_type, "params": params}
+
+    def save(self, path: str = MILVUS_INDEX_CONFIG_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.model_dump(), f, ensure_ascii=False, indent=2)
+        os.replace(tmp_path, path)
+
+
+def validate_search_params(params: Optional[Dict[str, int]]) -> Optional[Dict[str, int]]:
+    """校验单次请求的检索参数：只允许已知参数名，取值为不超过上限的正整数"""
+    if not params:
+        return params
+    limits = {}
+    for type_limits in SEARCH_PARAM_LIMITS.values():
+        limits.update(type_limits)
+    # 本地索引的重排候选倍数
+    limits["rerank_multiplier"] = 100
+    for key, value in params.items():
+        if key not in limits:
+            raise ValueError(f"不支持的检索参数: {key}，可选 {sorted(limits)}")
+        if not isinstance(value, int) or not 1 <= value <= limits[key]:
+            raise ValueError(f"检索参数 {key} 须为 1~{limits[key]} 的整数")
+    return params
+
+
+def load_index_config(path: str = MILVUS_INDEX_CONFIG_PATH) -> IndexConfig:
+    """读取索引配置"""
+    config = IndexConfig.for_type("IVF_FLAT")
+    if os.path.exists(path):
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                config = IndexConfig.for_type(**{k: v for k, v in json.load(f).items() if k != "metric_type"})
+            logger.info(f"已读取索引配置: {path}")
+        except Exception as e:
+            logger.error(f"索引配置文件无效，使用默认配置: {path}: {str(e)}")
+
+    if MILVUS_INDEX_TYPE or MILVUS_INDEX_PARAMS or MILVUS_SEARCH_PARAMS:
+        index_type = (MILVUS_INDEX_TYPE or config.index_type).upper()
+        same_type = index_type == config.index_type
+        config = IndexConfig.for_type(
+            index_type,
+            json.loads(MILVUS_INDEX_PARAMS) if MILVUS_INDEX_PARAMS else (config.build_params if same_type else None),
+            json.loads(MILVUS_SEARCH_PARAMS) if MILVUS_SEARCH_PARAMS else (config.search_params if same_type else None),
+        )
+    return config
@@ -0,0 +1,271 @@
+"""
+词法检索
+基于字符n-gram的BM25倒排索引，覆盖标题、作者和正文，
+用于补充向量检索漏掉的精确匹配（诗题、作者名、生僻字）
+
+索引按检索后端与集合分文件保存，早期版本不区分集合的 lexical_index.pkl 不再读取，
+升级后运行 python -m app.retriever.lexical 重建
+"""
+import os
+import re
+import pickle
+import hashlib
+import logging
+import threading
+import unicodedata
+from collections import Counter, defaultdict
+from typing import List, Dict, Tuple, Iterable, Optional
+
+import numpy as np
+
+from app.config.pathconfig import DATA_DIR
+from app.retriever.retriever import Document
+
+logger = logging.getLogger(__name__)
+
+# 词法索引文件所在目录，每个检索后端/集合（retriever.scope）一个索引文件
+LEXICAL_INDEX_DIR = os.getenv("LEXICAL_INDEX_DIR", DATA_DIR)
+
+# 各字段的词频权重，标题和作者命中比正文更重要
+FIELD_WEIGHTS = {"title": 3, "author": 3, "content": 1}
+
+
+def _is_token_char(char: str) -> bool:
+    """只保留文字和数字，标点、空白作为分隔"""
+    return unicodedata.category(char)[0] in ("L", "N")
+
+
+def tokenize(text: str) -> List[str]:
+    """切分为字符unigram与bigram（bigram不跨越标点）"""
+    tokens = []
+    run = []
+    for char in unicodedata.normalize("NFKC", text or "").lower():
+        if _is_token_char(char):
+            run.append(char)
+            continue
+        tokens.extend(_ngrams(run))
+        run = []
+    tokens.extend(_ngrams(run))
+    return tokens
+
+
+def _ngrams(run: List[str]) -> List[str]:
+    return run + [run[i] + run[i + 1] for i in range(len(run) - 1)]
+
+
+class LexicalIndex:
+    """字符n-gram BM25倒排索引
+
+    写入时只追加原始倒排表；查询用到某个词时才把它的倒排表编译为
+    (文档下标数组, BM25权重数组)并缓存，查询时逐词向量化累加得分。
+    """
+
+    def __init__(self, path: Optional[str] = None, k1: float = 1.2, b: float = 0.75):
+        self.path = path
+        self.k1 = k1
+        self.b = b
+        self._lock = threading.Lock()
+        self._ids: List[int] = []
+        self._docs: Dict[int, Tuple[str, str, str]] = {}
+        # 主键 -> 当前有效的文档下标；内容更新后旧下标作废
+        self._index_of: Dict[int, int] = {}
+        self._dead: List[int] = []
+        self._lengths: List[int] = []
+        self._postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        self._compiled: Optional[Dict[str, Tuple[np.ndarray, np.ndarray]]] = None
+        self._norm: Optional[np.ndarray] = None
+        self._dead_indices: Optional[np.ndarray] = None
+        self._mtime = None
+        if path and os.path.exists(path):
+            self.load()
+
+    def __len__(self):
+        return len(self._index_of)
+
+    def add(self, doc_id: int, title: str, author: str, content: str):
+        """增量加入一篇文档；主键已存在且内容相同则跳过，内容不同则替换"""
+        with self._lock:
+            previous = self._docs.get(doc_id)
+            if previous == (title, author, content):
+                return
+            if previous is not None:
+                self._dead.append(self._index_of[doc_id])
+            tf: Counter = Counter()
+            for field, text in (("title", title), ("author", author), ("content", content)):
+                for token in tokenize(text):
+                    tf[token] += FIELD_WEIGHTS[field]
+            index = len(self._ids)
+            self._ids.append(doc_id)
+            self._index_of[doc_id] = index
+            self._docs[doc_id] = (title, author, content)
+            self._lengths.append(sum(tf.values()))
+            for token, count in tf.items():
+                self._postings[token].append((index, count))
+            self._compiled = None
+
+    def add_many(self, documents: Iterable[Tuple[int, str, str, str]]):
+        for doc_id, title, author, content in documents:
+            self.add(doc_id, title, author, content)
+
+    def _term(self, token: str) -> Optional[Tuple[np.ndarray, np.ndarray]]:
+        """取出某个词编译后的 (文档下标数组, BM25权重数组)，按需编译并缓存"""
+        compiled = self._compiled.get(token)
+        if compiled is None:
+            postings = self._postings.get(token)
+            if not postings:
+                return None
+            n = len(self._ids)
+            indices = np.fromiter((i for i, _ in postings), dtype=np.int32, count=len(postings))
+            tf = np.fromiter((c for _, c in postings), dtype=np.float32, count=len(postings))
+            idf = np.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            weights = idf * tf * (self.k1 + 1) / (tf + self._norm[indices])
+            compiled = self._compiled[token] = (indices, weights.astype(np.float32))
+        return compiled
+
+    def _prepare(self):
+        """文档集合变化后重新计算长度归一化项，并清空已编译的词"""
+        lengths = np.asarray(self._lengths, dtype=np.float32)
+        self._norm = self.k1 * (1 - self.b + self.b * lengths / max(float(lengths.mean()), 1.0))
+        self._dead_indices = np.asarray(self._dead, dtype=np.int64)
+        self._compiled = {}
+
+    def search(self, query: str, top_k: int = 3) -> List[Document]:
+        """BM25检索，similarity 为相对最高分归一化后的得分"""
+        self._reload_if_changed()
+        with self._lock:
+            if not self._ids or top_k <= 0:
+                return []
+            if self._compiled is None:
+                self._prepare()
+            scores = np.zeros(len(self._ids), dtype=np.float32)
+            for token in set(tokenize(query)):
+                posting = self._term(token)
+                if posting is not None:
+                    scores[posting[0]] += posting[1]
+            # 被替换的旧版本不参与排序
+            scores[self._dead_indices] = 0
+
+            k = min(top_k, scores.shape[0])
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            top = top[scores[top] > 0]
+            if top.size == 0:
+                return []
+            best = float(scores[top[0]])
+            documents = []
+            for i in top.tolist():
+                doc_id = self._ids[i]
+                title, author, content = self._docs[doc_id]
+                documents.append(Document(
+                    id=doc_id,
+                    title=title,
+                    author=author,
+                    content=content,
+                    similarity=float(scores[i]) / best
+                ))
+            return documents
+
+    def save(self):
+        """原子写入索引文件"""
+        if not self.path:
+            return
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._lock:
+            state = {
+                "ids": self._ids,
+                "docs": self._docs,
+                "index_of": self._index_of,
+                "dead": self._dead,
+                "lengths": self._lengths,
+                "postings": dict(self._postings),
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "wb") as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, self.path)
+            self._mtime = os.path.getmtime(self.path)
+        logger.info(f"词法索引已保存: {self.path}，共{len(self._index_of)}篇")
+
+    def load(self):
+        with open(self.path, "rb") as f:
+            state = pickle.load(f)
+        with self._lock:
+            self._ids = state["ids"]
+            self._docs = state["docs"]
+            self._index_of = state["index_of"]
+            self._dead = state["dead"]
+            self._lengths = state["lengths"]
+            self._postings = defaultdict(list, state["postings"])
+            self._compiled = None
+            self._mtime = os.path.getmtime(self.path)
+        logger.info(f"词法索引已加载: {self.path}，共{len(self._index_of)}篇")
+
+    def _reload_if_changed(self):
+        """其他进程（如爬虫所在的worker）更新索引文件后重新加载"""
+        if not self.path:
+            return
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return
+        if mtime != self._mtime:
+            self.load()
+
+
+def reciprocal_rank_fusion(result_lists: List[List[Document]], top_k: int = 3, k: int = 60) -> List[Document]:
+    """倒数排名融合（RRF）
+
+    每个结果列表中排名 r 的文档得分为 1/(k + r)，按主键累加后取前 top_k。
+    文档内容取自第一次出现的列表，因此向量检索的相似度会被保留。
+    """
+    scores: Dict[int, float] = defaultdict(float)
+    documents: Dict[int, Document] = {}
+    for results in result_lists:
+        for rank, doc in enumerate(results, start=1):
+            if doc.id is None:
+                continue
+            scores[doc.id] += 1.0 / (k + rank)
+            documents.setdefault(doc.id, doc)
+    ranked = sorted(scores, key=scores.get, reverse=True)[:top_k]
+    return [documents[doc_id] for doc_id in ranked]
+
+
+def lexical_index_path(scope: str) -> str:
+    """检索后端/集合对应的词法索引文件，如 lexical_index_local_data_poems_1a2b3c4d.pkl"""
+    name = re.sub(r"[^0-9A-Za-z]+", "_", scope).strip("_")[-64:]
+    digest = hashlib.sha1(scope.encode("utf-8")).hexdigest()[:8]
+    return os.path.join(LEXICAL_INDEX_DIR, f"lexical_index_{name}_{digest}.pkl")
+
+
+# 进程内共享的词法索引实例，按 retriever.scope 区分
+_indexes: Dict[str, LexicalIndex] = {}
+_indexes_lock = threading.Lock()
+
+
+def lexical_index_for(retriever) -> LexicalIndex:
+    """检索后端对应的进程内共享词法索引，与 SeenStore.for_retriever 一样按 scope 区分，
+    切换后端或集合时不会融合进其他语料的文档"""
+    with _indexes_lock:
+        index = _indexes.get(retriever.scope)
+        if index is None:
+            index = _indexes[retriever.scope] = LexicalIndex(lexical_index_path(retriever.scope))
+        return index
+
+
+def rebuild_lexical_index(retriever) -> LexicalIndex:
+    """从检索后端全量重建词法索引并保存，随后让进程内实例重新加载"""
+    shared = lexical_index_for(retriever)
+    index = LexicalIndex()
+    index.path = shared.path
+    index.add_many(retriever.iter_documents())
+    index.save()
+    shared.load()
+    return shared
+
+
+if __name__ == "__main__":
+    # 从检索后端全量重建词法索引: python -m app.retriever.lexical
+    from app.retriever import create_retriever, default_collection_name
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    rebuild_lexical_index(create_retriever(collection_name=default_collection_name()))
@@ -0,0 +1,559 @@
+"""
+进程内本地向量索引
+向量保存在内存映射的矩阵文件中，元数据保存在SQLite，
+检索时用NumPy批量计算内积取top-k，不依赖任何外部服务；
+带朝代/作者/时间过滤时先按内存中的元数据列筛出满足条件的行，只对这些行计算内积
+
+支持 float32 / float16 / int8 / binary 四种存储格式。压缩格式下另存一份全精度向量，
+先用压缩向量粗排出 top_k * LOCAL_INDEX_RERANK_MULTIPLIER 个候选，再读取候选的全精度向量精确重排；
+全精度文件只在重排时按行读取，常驻内存的是压缩后的矩阵。
+"""
+import os
+import json
+import logging
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Set, Callable, NamedTuple
+
+import numpy as np
+
+from app.config.pathconfig import DATA_DIR
+from app.retriever.retriever import (
+    BaseRetriever, Document, SearchFilter, ip_to_similarity, split_author, default_collection_name,
+    EMBEDDING_DIMENSION
+)
+
+logger = logging.getLogger(__name__)
+
+# 本地索引配置
+LOCAL_INDEX_DIR = os.getenv("LOCAL_INDEX_DIR", os.path.join(DATA_DIR, "local_index"))
+# 向量存储格式: float32 | float16 | int8 | binary，只在新建索引时生效
+LOCAL_INDEX_DTYPE = os.getenv("LOCAL_INDEX_DTYPE", "float32")
+# 压缩格式下是否用全精度向量重排候选
+LOCAL_INDEX_RERANK = os.getenv("LOCAL_INDEX_RERANK", "true").lower() == "true"
+# 重排候选数为 top_k 的倍数
+LOCAL_INDEX_RERANK_MULTIPLIER = int(os.getenv("LOCAL_INDEX_RERANK_MULTIPLIER", "10"))
+
+STORAGE_FORMATS = ("float32", "float16", "int8", "binary")
+
+# 分块计算内积的行数，压缩矩阵按块解码为 float32，避免每次查询整体复制
+_SEARCH_BLOCK_ROWS = 16384
+
+# 0-255 每个字节中1的个数，numpy 没有 bitwise_count 时使用
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _popcount(bits: np.ndarray) -> np.ndarray:
+    if hasattr(np, "bitwise_count"):
+        return np.bitwise_count(bits)
+    return _POPCOUNT[bits]
+
+
+def code_shape(dim: int, storage: str) -> Tuple[np.dtype, int]:
+    """存储格式对应的 (元素类型, 每行元素数)"""
+    if storage == "float32":
+        return np.dtype(np.float32), dim
+    if storage == "float16":
+        return np.dtype(np.float16), dim
+    if storage == "int8":
+        return np.dtype(np.int8), dim
+    if storage == "binary":
+        return np.dtype(np.uint8), (dim + 7) // 8
+    raise ValueError(f"不支持的存储格式: {storage}，可选 {STORAGE_FORMATS}")
+
+
+def bytes_per_vector(dim: int, storage: str) -> int:
+    """每条向量常驻内存的字节数（int8 含每行一个 float32 缩放系数）"""
+    dtype, width = code_shape(dim, storage)
+    return dtype.itemsize * width + (4 if storage == "int8" else 0)
+
+
+def encode_vectors(vectors: np.ndarray, storage: str) -> Tuple[np.ndarray, Optional[np.ndarray]]:
+    """把 float32 向量编码为存储格式，返回 (编码矩阵, int8 的逐行缩放系数或None)"""
+    if storage in ("float32", "float16"):
+        return vectors.astype(storage), None
+    if storage == "int8":
+        # 逐行对称量化：每行按自身最大绝对值缩放到 [-127, 127]
+        scales = np.abs(vectors).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+        return codes, scales.astype(np.float32)
+    if storage == "binary":
+        # 只保留每一维的符号
+        return np.packbits(vectors > 0, axis=1), None
+    raise ValueError(f"不支持的存储格式: {storage}，可选 {STORAGE_FORMATS}")
+
+
+def decode_vectors(codes: np.ndarray, scales: Optional[np.ndarray], storage: str) -> np.ndarray:
+    """把编码后的若干行还原为近似的 float32 向量；binary 格式还原为 ±1 的符号向量"""
+    if storage in ("float32", "float16"):
+        return np.asarray(codes, dtype=np.float32)
+    if storage == "int8":
+        return codes.astype(np.float32) * scales[:, None]
+    if storage == "binary":
+        return np.unpackbits(codes, axis=1).astype(np.float32) * 2 - 1
+    raise ValueError(f"不支持的存储格式: {storage}，可选 {STORAGE_FORMATS}")
+
+
+def approximate_scores(codes: np.ndarray, scales: Optional[np.ndarray], queries: np.ndarray,
+                       storage: str) -> np.ndarray:
+    """用编码后的向量估计与各查询的内积，返回 (行数, 查询数) 矩阵
+
+    binary 格式返回 1 - 2 * 汉明距离 / 维度，只用于排序，与内积不在同一量纲。
+    """
+    if storage == "float32":
+        return codes @ queries.T
+    scores = np.empty((codes.shape[0], queries.shape[0]), dtype=np.float32)
+    if storage == "binary":
+        dim = queries.shape[1]
+        query_bits = np.packbits(queries > 0, axis=1)
+    for start in range(0, codes.shape[0], _SEARCH_BLOCK_ROWS):
+        block = codes[start:start + _SEARCH_BLOCK_ROWS]
+        end = start + block.shape[0]
+        if storage == "binary":
+            for column, bits in enumerate(query_bits):
+                hamming = _popcount(np.bitwise_xor(block, bits)).sum(axis=1, dtype=np.int32)
+                scores[start:end, column] = 1 - 2 * hamming / dim
+            continue
+        scores[start:end] = block.astype(np.float32) @ queries.T
+        if scales is not None:
+            scores[start:end] *= scales[start:end, None]
+    return scores
+
+
+def select_top_k(scores: np.ndarray, top_k: int, candidates: int = None, full: np.ndarray = None,
+                 queries: np.ndarray = None, row_ids: np.ndarray = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+    """按分数为每个查询取 top_k 行
+
+    传入全精度向量 full 时，先按近似分数取 candidates 个候选，再用 full 计算精确内积重排。
+    scores 只覆盖部分行时，row_ids 为其各行对应的升序行号。
+
+    Returns:
+        每个查询的 (行号, 分数)，按分数降序
+    """
+    rows_total = scores.shape[0]
+    rerank = full is not None
+    k = min(max(candidates or top_k, top_k) if rerank else top_k, rows_total)
+    top = np.argpartition(-scores, k - 1, axis=0)[:k]
+    results = []
+    for column in range(scores.shape[1]):
+        local = top[:, column]
+        rows = local if row_ids is None else row_ids[local]
+        if rerank:
+            # 按行号顺序读取，减少内存映射文件上的随机访问
+            rows = np.sort(rows)
+            row_scores = full[rows] @ queries[column]
+        else:
+            row_scores = scores[local, column]
+        order = np.argsort(-row_scores)[:top_k]
+        results.append((rows[order], row_scores[order]))
+    return results
+
+
+class _Snapshot(NamedTuple):
+    """持锁取得的矩阵与元数据列引用，打分在锁外进行
+
+    追加写入只替换 LocalRetriever 上的引用，已取得的快照仍指向原来的映射；
+    原地覆盖的行可能读到覆盖前或覆盖后的向量。
+    """
+    matrix: np.ndarray
+    scales: Optional[np.ndarray]
+    full: Optional[np.ndarray]
+    # (元数据列, 比较函数, 值)，没有过滤条件时为None
+    conditions: Optional[List[Tuple[np.ndarray, Callable, int]]]
+
+
+class LocalRetriever(BaseRetriever):
+    """基于内存映射矩阵的本地检索器
+
+    目录结构:
+        meta.json         维度、存储格式、是否保存全精度向量
+        vectors.bin       行优先的编码向量矩阵
+        scales.bin        int8 格式的逐行缩放系数
+        vectors.f32.bin   压缩格式下的全精度向量，用于重排
+        docs.sqlite3      行号 -> 主键/标题/作者/内容/朝代/作者名/创建时间/写入序号
+    """
+
+    def __init__(self, collection_name: str = None, create_if_missing: bool = True,
+                 dim: int = None, dtype: str = None, index_dir: str = None):
+        # 本地索引总是按需创建，create_if_missing 仅为与 MilvusRetriever 保持接口一致
+        self.index_dir = index_dir or os.path.join(LOCAL_INDEX_DIR, collection_name or default_collection_name())
+        os.makedirs(self.index_dir, exist_ok=True)
+        self._lock = threading.Lock()
+
+        dim = dim or EMBEDDING_DIMENSION
+        meta_path = os.path.join(self.index_dir, "meta.json")
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as f:
+                meta = json.load(f)
+            self.dim = meta["dim"]
+            self.storage = meta["dtype"]
+            # 早期版本的索引没有全精度向量文件
+            self.rerank_store = meta.get("rerank_store", False)
+            if self.dim != dim:
+                logger.warning(f"本地索引维度为{self.dim}，与配置的{dim}不一致，以索引为准；如需切换请重建索引")
+        else:
+            self.dim = dim
+            self.storage = dtype or LOCAL_INDEX_DTYPE
+            self.rerank_store = self.storage != "float32"
+            with open(meta_path, "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "dtype": self.storage, "rerank_store": self.rerank_store}, f)
+        self.code_dtype, self.code_width = code_shape(self.dim, self.storage)
+        self.rerank = self.rerank_store and LOCAL_INDEX_RERANK
+
+        self.vectors_path = os.path.join(self.index_dir, "vectors.bin")
+        self.scales_path = os.path.join(self.index_dir, "scales.bin")
+        self.full_path = os.path.join(self.index_dir, "vectors.f32.bin")
+        self._db = sqlite3.connect(os.path.join(self.index_dir, "docs.sqlite3"), check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS docs ("
+            "row INTEGER PRIMARY KEY, id INTEGER UNIQUE, title TEXT, author TEXT, content TEXT, "
+            "content_hash TEXT, created_at INTEGER, dynasty TEXT, author_name TEXT, seq INTEGER)"
+        )
+        self._migrate_metadata()
+        self._db.execute("CREATE INDEX IF NOT EXISTS docs_seq ON docs (seq)")
+        self._db.commit()
+        # 过滤用的元数据列，按行号存放朝代/作者名的编号和创建时间，首次过滤检索时从SQLite加载
+        self._meta_rows = 0
+        # 内存列已反映的最大写入序号，以及上次检查时的 PRAGMA data_version（其他连接提交后会变化）
+        self._meta_seq = 0
+        self._data_version: Optional[int] = None
+        self._meta_codes: Dict[str, Dict[str, int]] = {"dynasty": {}, "author_name": {}}
+        self._meta: Dict[str, np.ndarray] = {
+            "dynasty": np.empty(0, dtype=np.int32),
+            "author_name": np.empty(0, dtype=np.int32),
+            "created_at": np.empty(0, dtype=np.int64),
+        }
+
+        self._matrix: Optional[np.memmap] = None
+        self._scales: Optional[np.memmap] = None
+        self._full: Optional[np.memmap] = None
+        self._mapped_size = -1
+        self._remap()
+        logger.info(f"本地索引已加载: {self.index_dir}，共{self.count()}条，"
+                    f"dim={self.dim}，存储格式={self.storage}，重排={'开' if self.rerank else '关'}")
+
+    def _migrate_metadata(self):
+        """早期版本的索引没有朝代/作者名列和写入序号列，补上并由 author 回填朝代/作者名"""
+        columns = {row[1] for row in self._db.execute("PRAGMA table_info(docs)")}
+        if "seq" not in columns:
+            self._db.execute("ALTER TABLE docs ADD COLUMN seq INTEGER")
+        if {"dynasty", "author_name"} <= columns:
+            return
+        for column in ("dynasty", "author_name"):
+            if column not in columns:
+                self._db.execute(f"ALTER TABLE docs ADD COLUMN {column} TEXT")
+        rows = self._db.execute("SELECT row, author FROM docs").fetchall()
+        self._db.executemany("UPDATE docs SET dynasty = ?, author_name = ? WHERE row = ?",
+                             [split_author(author) + (row,) for row, author in rows])
+        logger.info(f"本地索引已补充朝代/作者名列: {len(rows)}条")
+
+    def _remap(self):
+        """向量文件大小变化时（包括其他进程写入）重新映射"""
+        size = os.path.getsize(self.vectors_path) if os.path.exists(self.vectors_path) else 0
+        if size == self._mapped_size:
+            return
+        rows = size // (self.code_width * self.code_dtype.itemsize)
+        if rows:
+            # 写入时编码矩阵最后落盘，其行数不会超过缩放系数和全精度文件
+            self._matrix = np.memmap(self.vectors_path, dtype=self.code_dtype, mode="r",
+                                     shape=(rows, self.code_width))
+            if self.storage == "int8":
+                self._scales = np.memmap(self.scales_path, dtype=np.float32, mode="r", shape=(rows,))
+            if self.rerank_store:
+                self._full = np.memmap(self.full_path, dtype=np.float32, mode="r", shape=(rows, self.dim))
+        else:
+            self._matrix = self._scales = self._full = None
+        self._mapped_size = size
+
+    @property
+    def scope(self) -> str:
+        return f"local:{os.path.abspath(self.index_dir)}"
+
+    def count(self) -> int:
+        with self._lock:
+            self._remap()
+            return 0 if self._matrix is None else self._matrix.shape[0]
+
+    def memory_bytes(self) -> Dict[str, int]:
+        """检索时常驻内存的字节数，以及只在重排时读取的全精度向量字节数"""
+        rows = self.count()
+        return {
+            "resident": rows * bytes_per_vector(self.dim, self.storage),
+            "rerank_store": rows * self.dim * 4 if self.rerank_store else 0,
+        }
+
+    @staticmethod
+    def _where(filters: SearchFilter) -> Tuple[str, List[Any]]:
+        """过滤条件对应的SQL条件和参数"""
+        clauses, params = [], []
+        if filters.dynasty:
+            clauses.append("dynasty = ?")
+            params.append(filters.dynasty)
+        if filters.author:
+            clauses.append("author_name = ?")
+            params.append(filters.author)
+        if filters.created_after is not None:
+            clauses.append("created_at >= ?")
+            params.append(filters.created_after)
+        if filters.created_before is not None:
+            clauses.append("created_at < ?")
+            params.append(filters.created_before)
+        return " AND ".join(clauses), params
+
+    def _set_meta(self, row: int, dynasty: Optional[str], author_name: Optional[str], created_at: Optional[int]):
+        for column, value in (("dynasty", dynasty), ("author_name", author_name)):
+            codes = self._meta_codes[column]
+            self._meta[column][row] = codes.setdefault(value or "", len(codes))
+        self._meta["created_at"][row] = created_at or 0
+
+    def _load_meta(self):
+        """把新增行以及被其他进程覆盖的行的元数据读入内存列，调用方需持有 self._lock 并已 _remap"""
+        version = self._db.execute("PRAGMA data_version").fetchone()[0]
+        if version != self._data_version:
+            # 爬虫、批量入库等其他进程提交过写入，重新读取它们覆盖过的已加载行；先取序号上限，
+            # 读取期间再有提交时下次检查仍会重读，不会漏掉
+            self._data_version = version
+            latest = self._db.execute("SELECT COALESCE(MAX(seq), 0) FROM docs").fetchone()[0]
+            if self._meta_rows:
+                for row, dynasty, author_name, created_at in self._db.execute(
+                    "SELECT row, dynasty, author_name, created_at FROM docs WHERE seq > ? AND row < ?",
+                    (self._meta_seq, self._meta_rows)
+                ):
+                    self._set_meta(row, dynasty, author_name, created_at)
+            self._meta_seq = latest
+        rows = 0 if self._matrix is None else self._matrix.shape[0]
+        if rows <= self._meta_rows:
+            return
+        for column, values in self._meta.items():
+            grown = np.full(rows, -1, dtype=values.dtype)
+            grown[:self._meta_rows] = values
+            self._meta[column] = grown
+        for row, dynasty, author_name, created_at in self._db.execute(
+            "SELECT row, dynasty, author_name, created_at FROM docs WHERE row >= ? AND row < ?",
+            (self._meta_rows, rows)
+        ):
+            self._set_meta(row, dynasty, author_name, created_at)
+        self._meta_rows = rows
+
+    def _snapshot(self, filters: Optional[SearchFilter]) -> Optional[_Snapshot]:
+        """取得当前矩阵和过滤条件涉及的元数据列，索引为空时为None；调用方需持有 self._lock"""
+        self._remap()
+        if self._matrix is None:
+            return None
+        conditions = None
+        if filters is not None and not filters.is_empty():
+            self._load_meta()
+            conditions = []
+            for column, value in (("dynasty", filters.dynasty), ("author_name", filters.author)):
+                if value:
+                    conditions.append((self._meta[column], np.equal, self._meta_codes[column].get(value, -2)))
+            if filters.created_after is not None:
+                conditions.append((self._meta["created_at"], np.greater_equal, filters.created_after))
+            if filters.created_before is not None:
+                conditions.append((self._meta["created_at"], np.less, filters.created_before))
+        return _Snapshot(self._matrix, self._scales, self._full, conditions)
+
+    @staticmethod
+    def _filtered_rows(snapshot: _Snapshot) -> Optional[np.ndarray]:
+        """满足过滤条件的升序行号，没有过滤条件时为None；相当于只检索对应朝代/作者的分区"""
+        if snapshot.conditions is None:
+            return None
+        mask = np.ones(snapshot.matrix.shape[0], dtype=bool)
+        for values, compare, value in snapshot.conditions:
+            mask &= compare(values, value)
+        return np.flatnonzero(mask)
+
+    def _select(self, snapshot: _Snapshot, query_embeddings: List[List[float]], top_k: int,
+                search_params: Dict[str, int]) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """每个查询的 (行号, 分数)，只读快照，不需要持有 self._lock"""
+        queries = np.asarray(query_embeddings, dtype=np.float32)
+        if queries.shape[1] != self.dim:
+            raise ValueError(f"查询向量维度不匹配: 索引为{self.dim}，查询为{queries.shape[1]}")
+        rows = self._filtered_rows(snapshot)
+        if rows is None:
+            scores = approximate_scores(snapshot.matrix, snapshot.scales, queries, self.storage)
+        elif rows.size == 0:
+            return [(rows, np.empty(0, dtype=np.float32)) for _ in queries]
+        else:
+            # 只读取满足条件的行
+            scores = approximate_scores(snapshot.matrix[rows],
+                                        snapshot.scales[rows] if snapshot.scales is not None else None,
+                                        queries, self.storage)
+        return select_top_k(
+            scores, top_k,
+            candidates=top_k * (search_params or {}).get("rerank_multiplier", LOCAL_INDEX_RERANK_MULTIPLIER),
+            full=snapshot.full if self.rerank else None,
+            queries=queries,
+            row_ids=rows
+        )
+
+    def search_many(self, query_embeddings: List[List[float]], top_k: int = 3,
+                    search_params: Dict[str, int] = None, filters: SearchFilter = None) -> List[List[Document]]:
+        if top_k <= 0 or not query_embeddings:
+            return [[] for _ in query_embeddings]
+        # 只在取快照和读SQLite时持锁，打分在锁外进行，多个线程中的检索可以并行
+        with self._lock:
+            snapshot = self._snapshot(filters)
+        if snapshot is None:
+            return [[] for _ in query_embeddings]
+        selected = self._select(snapshot, query_embeddings, top_k, search_params)
+        with self._lock:
+            return [self._fetch(rows.tolist(), row_scores.tolist())[0] for rows, row_scores in selected]
+
+    def search_many_with_vectors(self, query_embeddings: List[List[float]], top_k: int = 3,
+                                 search_params: Dict[str, int] = None,
+                                 filters: SearchFilter = None) -> List[Tuple[List[Document], np.ndarray]]:
+        if top_k <= 0 or not query_embeddings:
+            return [([], np.empty((0, self.dim), dtype=np.float32)) for _ in query_embeddings]
+        with self._lock:
+            snapshot = self._snapshot(filters)
+        if snapshot is None:
+            return [([], np.empty((0, self.dim), dtype=np.float32)) for _ in query_embeddings]
+        selected = self._select(snapshot, query_embeddings, top_k, search_params)
+        with self._lock:
+            fetched = [self._fetch(rows.tolist(), row_scores.tolist()) for rows, row_scores in selected]
+        output = []
+        for documents, kept in fetched:
+            kept = np.asarray(kept, dtype=np.int64)
+            # 有全精度副本时直接读取，否则由编码还原
+            if snapshot.full is not None:
+                vectors = np.asarray(snapshot.full[kept], dtype=np.float32)
+            else:
+                vectors = decode_vectors(snapshot.matrix[kept],
+                                         snapshot.scales[kept] if snapshot.scales is not None else None,
+                                         self.storage)
+            output.append((documents, vectors))
+        return output
+
+    def _fetch(self, rows: List[int], scores: List[float]) -> Tuple[List[Document], List[int]]:
+        """按行号读取元数据并组装文档，同时返回实际取到的行号"""
+        placeholders = ",".join("?" * len(rows))
+        records = {
+            row: (doc_id, title, author, content)
+            for row, doc_id, title, author, content in self._db.execute(
+                f"SELECT row, id, title, author, content FROM docs WHERE row IN ({placeholders})", rows
+            )
+        }
+        documents, kept = [], []
+        for row, score in zip(rows, scores):
+            if row not in records:
+                continue
+            kept.append(row)
+            doc_id, title, author, content = records[row]
+            documents.append(Document(
+                id=doc_id,
+                title=title or "未知标题",
+                author=author or "未知作者",
+                content=content or "",
+                similarity=ip_to_similarity(score)
+            ))
+        return documents, kept
+
+    def _stores(self, vectors: np.ndarray) -> List[Tuple[str, np.ndarray]]:
+        """需要写入的 (文件路径, 每行数据)，编码矩阵放在最后，保证其行数不超过其他文件"""
+        codes, scales = encode_vectors(vectors, self.storage)
+        stores = []
+        if self.rerank_store:
+            stores.append((self.full_path, vectors))
+        if scales is not None:
+            stores.append((self.scales_path, scales))
+        stores.append((self.vectors_path, codes))
+        return stores
+
+    def upsert(self, entities: List[Dict[str, Any]], flush: bool = True) -> List[int]:
+        if not entities:
+            return []
+        vectors = np.asarray([entity["embedding"] for entity in entities], dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"向量维度不匹配: 索引为{self.dim}，写入为{vectors.shape[1]}")
+
+        with self._lock:
+            self._remap()
+            start = 0 if self._matrix is None else self._matrix.shape[0]
+            existing = self._rows_of([entity["id"] for entity in entities if "id" in entity])
+
+            # 已存在的主键原地覆盖，其余追加到末尾；未指定主键时使用行号
+            rows, appended = [], []
+            for i, entity in enumerate(entities):
+                row = existing.get(entity.get("id"))
+                if row is None:
+                    row = start + len(appended)
+                    appended.append(i)
+                rows.append(row)
+            ids = [entity.get("id", row) for entity, row in zip(entities, rows)]
+
+            try:
+                # 写入序号在事务内递增，其他进程据此找出需要重新加载元数据的行
+                self._db.executemany(
+                    "INSERT OR REPLACE INTO docs (row, id, title, author, content, content_hash, created_at, "
+                    "dynasty, author_name, seq) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, "
+                    "(SELECT COALESCE(MAX(seq), 0) + 1 FROM docs))",
+                    [
+                        (row, doc_id, entity["title"], entity["author"], entity["content"],
+                         entity.get("content_hash"), entity["created_at"]) + split_author(entity["author"])
+                        for row, doc_id, entity in zip(rows, ids, entities)
+                    ]
+                )
+                updated = [i for i in range(len(entities)) if rows[i] < start]
+                for path, data in self._stores(vectors):
+                    if updated:
+                        matrix = np.memmap(path, dtype=data.dtype, mode="r+", shape=(start,) + data.shape[1:])
+                        matrix[[rows[i] for i in updated]] = data[updated]
+                        matrix.flush()
+                        del matrix
+                    if appended:
+                        with open(path, "ab") as f:
+                            f.write(data[appended].tobytes())
+                            if flush:
+                                f.flush()
+                                os.fsync(f.fileno())
+            except Exception:
+                self._db.rollback()
+                raise
+            self._db.commit()
+            # 已加载到内存的行被覆盖时同步更新元数据列，追加的行在下次过滤检索时加载
+            for row, entity in zip(rows, entities):
+                if row < self._meta_rows:
+                    self._set_meta(row, *split_author(entity["author"]), entity["created_at"])
+            self._remap()
+        return ids
+
+    def flush(self):
+        with self._lock:
+            for path in (self.full_path, self.scales_path, self.vectors_path):
+                if os.path.exists(path):
+                    with open(path, "rb") as f:
+                        os.fsync(f.fileno())
+            self._db.commit()
+
+    def _rows_of(self, ids: List[int]) -> Dict[int, int]:
+        """查询已存在主键所在的行号"""
+        rows = {}
+        for start in range(0, len(ids), 500):
+            chunk = ids[start:start + 500]
+            placeholders = ",".join("?" * len(chunk))
+            rows.update(self._db.execute(f"SELECT id, row FROM docs WHERE id IN ({placeholders})", chunk))
+        return rows
+
+    def filter_ids(self, ids: List[int], filters: SearchFilter) -> Set[int]:
+        if not ids or filters is None or filters.is_empty():
+            return set(ids)
+        where, params = self._where(filters)
+        matched = set()
+        with self._lock:
+            for start in range(0, len(ids), 500):
+                chunk = list(ids[start:start + 500])
+                placeholders = ",".join("?" * len(chunk))
+                matched.update(doc_id for (doc_id,) in self._db.execute(
+                    f"SELECT id FROM docs WHERE id IN ({placeholders}) AND {where}", chunk + params
+                ))
+        return matched
+
+    def iter_documents(self, batch_size: int = 1000) -> Iterator[Tuple[int, str, str, str]]:
+        cursor = self._db.execute("SELECT id, title, author, content FROM docs ORDER BY row")
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
@@ -0,0 +1,119 @@
+"""
+多样性重排
+在多取的候选上做最大边际相关（MMR）选择，并可限制同一作者、同一朝代的篇数：
+每一步选 λ·相关度 − (1−λ)·与已选文档的最大相似度 最高的候选，
+与已选文档的相似度按步增量计算（每步一次矩阵-向量乘法），几百个候选时耗时在毫秒以下
+"""
+import os
+from typing import List, Optional, Tuple
+
+import numpy as np
+
+from app.retriever.retriever import Document, split_author
+
+# MMR 中相关度的权重，1 表示只看相关度，0 表示只看多样性
+MMR_LAMBDA = float(os.getenv("MMR_LAMBDA", "0.7"))
+# 参与重排的候选数为 top_k 的倍数
+MMR_FETCH_MULTIPLIER = int(os.getenv("MMR_FETCH_MULTIPLIER", "5"))
+
+
+def _group_ids(keys: List[str]) -> np.ndarray:
+    """把分组键映射为整数编号，空键为 -1（不受数量限制）"""
+    index = {}
+    return np.array([index.setdefault(key, len(index)) if key else -1 for key in keys], dtype=np.int64)
+
+
+def _inverse_norms(vectors: np.ndarray) -> np.ndarray:
+    norms = np.sqrt(np.einsum("ij,ij->i", vectors, vectors))
+    norms[norms == 0] = 1.0
+    return 1.0 / norms
+
+
+def mmr_select(relevance: np.ndarray, embeddings: Optional[np.ndarray], top_k: int, lambda_mult: float = MMR_LAMBDA,
+               groups: List[Tuple[np.ndarray, int]] = (), inverse_norms: np.ndarray = None) -> np.ndarray:
+    """MMR选择
+
+    Args:
+        relevance: 各候选与查询的相关度 (n,)
+        embeddings: 候选向量 (n, d)，为None时不计算相似度惩罚，只按相关度和分组上限选择
+        top_k: 选出的数量
+        lambda_mult: 相关度权重
+        groups: (各候选的分组编号, 每组上限) 列表，编号为 -1 的候选不受该分组限制
+        inverse_norms: 候选向量模长的倒数，调用方已算过时传入以免重复计算
+
+    Returns:
+        选中候选的下标，按选择顺序
+    """
+    n = relevance.shape[0]
+    top_k = min(top_k, n)
+    if top_k <= 0:
+        return np.empty(0, dtype=np.int64)
+    relevance = relevance.astype(np.float32, copy=False)
+    if embeddings is not None and embeddings.size:
+        embeddings = embeddings.astype(np.float32, copy=False)
+        if inverse_norms is None:
+            inverse_norms = _inverse_norms(embeddings)
+    else:
+        embeddings = None
+
+    # 与已选文档的最大相似度；尚未选择时为0
+    max_similarity = np.zeros(n, dtype=np.float32)
+    available = np.ones(n, dtype=bool)
+    counts = [np.zeros(ids.max() + 1 if ids.size and ids.max() >= 0 else 0, dtype=np.int64) for ids, _ in groups]
+    selected = []
+    for _ in range(top_k):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        if scores[best] == -np.inf:
+            break
+        selected.append(best)
+        available[best] = False
+        for (ids, cap), count in zip(groups, counts):
+            group = ids[best]
+            if group < 0:
+                continue
+            count[group] += 1
+            if count[group] >= cap:
+                available &= ids != group
+        if embeddings is not None:
+            # 不归一化整个矩阵，只对本步的相似度向量按模长缩放
+            similarity = (embeddings @ embeddings[best]) * inverse_norms * inverse_norms[best]
+            np.maximum(max_similarity, similarity, out=max_similarity)
+    return np.asarray(selected, dtype=np.int64)
+
+
+def diversify(documents: List[Document], top_k: int, query_embedding: List[float] = None,
+              embeddings: Optional[np.ndarray] = None, lambda_mult: float = MMR_LAMBDA,
+              max_per_author: int = None, max_per_dynasty: int = None) -> List[Document]:
+    """对候选文档做MMR和作者/朝代上限重排
+
+    Args:
+        documents: 按相关度降序的候选文档
+        query_embedding: 查询向量，与 embeddings 同时给出时以余弦相似度为相关度，否则按候选排名线性递减
+        embeddings: 候选向量，为None时只做分组上限
+        max_per_author / max_per_dynasty: 同一作者/朝代最多保留的篇数，None 表示不限制
+    """
+    if not documents:
+        return []
+    inverse_norms = None
+    if embeddings is not None and embeddings.size:
+        embeddings = embeddings.astype(np.float32, copy=False)
+        inverse_norms = _inverse_norms(embeddings)
+    if query_embedding is not None and inverse_norms is not None:
+        query = np.asarray(query_embedding, dtype=np.float32)
+        relevance = (embeddings @ query) * inverse_norms / (np.linalg.norm(query) or 1.0)
+    else:
+        # 融合或词法检索的分数与向量相似度不在同一量纲，只用排名
+        relevance = 1 - np.arange(len(documents), dtype=np.float32) / len(documents)
+    groups = []
+    if max_per_author or max_per_dynasty:
+        authors = [doc.author for doc in documents]
+        if max_per_author:
+            # 作者字段带朝代前缀，整体作为分组键即可区分不同作者
+            groups.append((_group_ids(authors), max_per_author))
+        if max_per_dynasty:
+            groups.append((_group_ids([split_author(author)[0] for author in authors]), max_per_dynasty))
+    order = mmr_select(relevance, embeddings, top_k, lambda_mult, groups, inverse_norms)
+    return [documents[i] for i in order.tolist()]
+
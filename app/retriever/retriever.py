@@ -0,0 +1,471 @@
+"""
+检索后端
+定义检索器接口，提供Milvus（默认）与进程内本地索引两种实现
+"""
+from abc import ABC, abstractmethod
+import os
+import json
+import logging
+from functools import lru_cache
+from typing import List, Dict, Any, Optional, Iterator, Tuple, Set
+import numpy as np
+from dotenv import load_dotenv
+from pydantic import BaseModel, field_validator
+from pymilvus import connections, Collection, utility, FieldSchema, CollectionSchema, DataType
+
+from app.retriever.index_config import IndexConfig, load_index_config
+
+logger = logging.getLogger(__name__)
+
+load_dotenv()
+
+# 检索后端: milvus | local
+RETRIEVER_BACKEND = os.getenv("RETRIEVER_BACKEND", "milvus")
+
+# Milvus配置
+MILVUS_HOST = os.getenv("MILVUS_HOST")
+MILVUS_PORT = os.getenv("MILVUS_PORT")
+MILVUS_COLLECTION_NAME = os.getenv("MILVUS_COLLECTION_NAME")
+# 完整连接地址（如 http://milvus:19530），设置后优先于 host/port
+MILVUS_URI = os.getenv("MILVUS_URI")
+# 向量字段类型: float32 | float16（内存减半，需 Milvus 2.4+）
+MILVUS_VECTOR_TYPE = os.getenv("MILVUS_VECTOR_TYPE", "float32")
+# 新建集合以朝代为分区键时的分区数，按朝代过滤的检索只搜索该朝代所在的分区
+MILVUS_NUM_PARTITIONS = int(os.getenv("MILVUS_NUM_PARTITIONS", "16"))
+# 朝代、作者、创建时间字段的标量索引类型（INVERTED 需 Milvus 2.4+，更早的版本可设为空字符串由服务端自动选择）
+MILVUS_SCALAR_INDEX_TYPE = os.getenv("MILVUS_SCALAR_INDEX_TYPE", "INVERTED")
+# 单次检索返回条数上限（Milvus 的 topK 上限），多取候选时不超过该值
+MILVUS_MAX_TOP_K = int(os.getenv("MILVUS_MAX_TOP_K", "16384"))
+
+# 向量维度，text-embedding-v3 支持以下输出维度；修改后需要重建集合/本地索引
+EMBEDDING_DIMENSION = int(os.getenv("EMBEDDING_DIMENSION", "1024"))
+SUPPORTED_DIMENSIONS = (64, 128, 256, 512, 768, 1024)
+if EMBEDDING_DIMENSION not in SUPPORTED_DIMENSIONS:
+    raise ValueError(f"不支持的向量维度: {EMBEDDING_DIMENSION}，可选 {SUPPORTED_DIMENSIONS}")
+
+_VECTOR_DATA_TYPES = {
+    "float32": DataType.FLOAT_VECTOR,
+    "float16": DataType.FLOAT16_VECTOR,
+}
+
+
+class Document(BaseModel):
+    """文档模型"""
+    id: Optional[int] = None
+    title: str
+    author: Optional[str] = None
+    content: str
+    similarity: float = 0.0
+
+
+@lru_cache(maxsize=4096)
+def split_author(author: Optional[str]) -> Tuple[str, str]:
+    """把爬虫保存的 "〔唐代〕·李白" 拆成 (朝代, 作者)，没有朝代时朝代为空"""
+    author = author or ""
+    if "·" in author:
+        dynasty, name = author.split("·", 1)
+        return normalize_dynasty(dynasty), name.strip()
+    return "", author.strip()
+
+
+def normalize_dynasty(dynasty: Optional[str]) -> str:
+    """去掉朝代两侧的括号，如 〔唐代〕 -> 唐代"""
+    return (dynasty or "").strip("〔〕[]（）() ")
+
+
+class SearchFilter(BaseModel):
+    """检索过滤条件，各项为空时不限制"""
+    dynasty: Optional[str] = None
+    author: Optional[str] = None
+    # 入库时间范围（Unix时间戳，秒），包含 created_after，不包含 created_before
+    created_after: Optional[int] = None
+    created_before: Optional[int] = None
+
+    @field_validator("dynasty")
+    @classmethod
+    def _normalize_dynasty(cls, value):
+        return normalize_dynasty(value) or None
+
+    @field_validator("author")
+    @classmethod
+    def _strip_author(cls, value):
+        return (value or "").strip() or None
+
+    def is_empty(self) -> bool:
+        return all(value is None for value in self.model_dump().values())
+
+
+def ip_to_similarity(distance: float) -> float:
+    """把内积距离换算为 [0, 1] 的相似度"""
+    return (distance + 1) / 2
+
+
+class BaseRetriever(ABC):
+    """检索器基类"""
+
+    def search(self, query_embedding: List[float], top_k: int = 3,
+               search_params: Dict[str, int] = None, filters: SearchFilter = None) -> List[Document]:
+        """按查询向量检索最相似的文档"""
+        return self.search_many([query_embedding], top_k, search_params, filters)[0]
+
+    @abstractmethod
+    def search_many(self, query_embeddings: List[List[float]], top_k: int = 3,
+                    search_params: Dict[str, int] = None, filters: SearchFilter = None) -> List[List[Document]]:
+        """一次检索多个查询向量，按输入顺序返回每个查询的结果
+
+        Args:
+            search_params: 单次请求的检索参数（如 nprobe/ef），覆盖配置中的默认值
+            filters: 朝代/作者/入库时间过滤条件，只在满足条件的文档中检索
+        """
+        pass
+
+    @abstractmethod
+    def search_many_with_vectors(self, query_embeddings: List[List[float]], top_k: int = 3,
+                                 search_params: Dict[str, int] = None,
+                                 filters: SearchFilter = None) -> List[Tuple[List[Document], np.ndarray]]:
+        """同 search_many，同时返回每篇文档的向量 (文档数, 维度)，供多样性重排使用"""
+        pass
+
+    @abstractmethod
+    def filter_ids(self, ids: List[int], filters: SearchFilter) -> Set[int]:
+        """返回 ids 中满足过滤条件的主键，用于筛选词法检索等不含元数据的结果"""
+        pass
+
+    @abstractmethod
+    def upsert(self, entities: List[Dict[str, Any]], flush: bool = True) -> List[int]:
+        """按主键写入诗歌实体（id/title/author/content/content_hash/embedding/created_at），
+        朝代与作者名由 author 拆分后写入各自字段；主键已存在时覆盖，返回主键列表"""
+        pass
+
+    @abstractmethod
+    def iter_documents(self, batch_size: int = 1000) -> Iterator[Tuple[int, str, str, str]]:
+        """遍历全部文档，产出 (主键, 标题, 作者, 内容)"""
+        pass
+
+    def count(self) -> int:
+        """文档数量"""
+        return 0
+
+    @property
+    def scope(self) -> str:
+        """实际存储位置（后端与集合）的标识，入库去重记录按它区分"""
+        return self.__class__.__name__
+
+    def flush(self):
+        """把以 flush=False 写入的数据落盘"""
+        pass
+
+
+def poem_fields(dim: int = EMBEDDING_DIMENSION, vector_type: str = "float32") -> List[FieldSchema]:
+    """诗歌集合的字段定义"""
+    return [
+        # 主键由标题和作者的哈希得到，重复爬取同一首诗时覆盖而不是新增
+        FieldSchema(name="id", dtype=DataType.INT64, is_primary=True, auto_id=False),
+        FieldSchema(name="title", dtype=DataType.VARCHAR, max_length=256),
+        FieldSchema(name="author", dtype=DataType.VARCHAR, max_length=256),
+        # 由 author 拆分出的朝代（分区键）与作者名，用于过滤检索
+        FieldSchema(name="dynasty", dtype=DataType.VARCHAR, max_length=32, is_partition_key=True),
+        FieldSchema(name="author_name", dtype=DataType.VARCHAR, max_length=128),
+        FieldSchema(name="content", dtype=DataType.VARCHAR, max_length=20000),  # 增加content字段的最大长度
+        FieldSchema(name="content_hash", dtype=DataType.VARCHAR, max_length=64),
+        FieldSchema(name="embedding", dtype=_VECTOR_DATA_TYPES[vector_type], dim=dim),
+        FieldSchema(name="created_at", dtype=DataType.INT64)
+    ]
+
+
+# 建立标量索引的字段
+SCALAR_INDEX_FIELDS = ("dynasty", "author_name", "created_at")
+
+
+def _literal(value: str) -> str:
+    """Milvus过滤表达式中的字符串字面量"""
+    return json.dumps(value, ensure_ascii=False)
+
+
+def milvus_expr(filters: Optional[SearchFilter], metadata_fields: bool = True) -> str:
+    """把过滤条件转换为Milvus布尔表达式，没有条件时返回空字符串
+
+    Args:
+        metadata_fields: 集合是否有 dynasty/author_name 字段；旧集合退化为对 author 的模糊匹配
+    """
+    if filters is None:
+        return ""
+    clauses = []
+    if filters.dynasty:
+        clauses.append(f"dynasty == {_literal(filters.dynasty)}" if metadata_fields
+                       else f"author like {_literal('%' + filters.dynasty + '%·%')}")
+    if filters.author:
+        clauses.append(f"author_name == {_literal(filters.author)}" if metadata_fields
+                       else f"author like {_literal('%·' + filters.author)}")
+    if filters.created_after is not None:
+        clauses.append(f"created_at >= {int(filters.created_after)}")
+    if filters.created_before is not None:
+        clauses.append(f"created_at < {int(filters.created_before)}")
+    return " and ".join(clauses)
+
+
+def default_collection_name() -> str:
+    """未指定集合时使用的集合名称：优先 MILVUS_COLLECTION_NAME，兼容爬虫脚本沿用的 COLLECTION_NAME，默认 poems
+
+    问答、入库、批量回填和索引重建都用它取默认值，保证读写的是同一个集合
+    """
+    return MILVUS_COLLECTION_NAME or os.getenv("COLLECTION_NAME") or "poems"
+
+
+class MilvusRetriever(BaseRetriever):
+    """基于远程Milvus的检索器"""
+
+    def __init__(self, collection_name: str = None, create_if_missing: bool = False,
+                 dim: int = None, vector_type: str = None, index_config: IndexConfig = None):
+        self.collection_name = collection_name or default_collection_name()
+        self.dim = dim or EMBEDDING_DIMENSION
+        self.vector_type = vector_type or MILVUS_VECTOR_TYPE
+        if self.vector_type not in _VECTOR_DATA_TYPES:
+            raise ValueError(f"不支持的向量类型: {self.vector_type}")
+        self.index_config = index_config or load_index_config()
+        try:
+            # 连接Milvus服务器
+            if MILVUS_URI:
+                logger.info(f"尝试连接Milvus: {MILVUS_URI}")
+                connections.connect(uri=MILVUS_URI)
+            else:
+                logger.info(f"尝试连接Milvus: {MILVUS_HOST}:{MILVUS_PORT}")
+                connections.connect(host=MILVUS_HOST, port=MILVUS_PORT)
+            
+            # 检查集合是否存在
+            has_collection = utility.has_collection(self.collection_name)
+            logger.info(f"集合'{self.collection_name}'是否存在: {has_collection}")
+            if not has_collection:
+                if not create_if_missing:
+                    raise ValueError("Milvus集合不存在")
+                self.collection = self._create_collection()
+            else:
+                self.collection = Collection(self.collection_name)
+            
+            # 旧版集合使用自增主键，无法按哈希主键upsert
+            self.legacy_schema = self.collection.schema.auto_id
+            field_names = {field.name for field in self.collection.schema.fields}
+            self.metadata_fields = {"dynasty", "author_name"} <= field_names
+            self._check_vector_field()
+            self._check_index()
+            if self.legacy_schema:
+                logger.warning(f"集合'{self.collection_name}'使用自增主键，写入将退化为insert，建议重建集合")
+            if not self.metadata_fields:
+                logger.warning(f"集合'{self.collection_name}'没有朝代/作者字段，过滤检索退化为对author的模糊匹配，"
+                               f"建议重建集合以使用朝代分区和标量索引")
+            
+            # 加载集合
+            self.collection.load()
+            logger.info(f"成功连接到Milvus集合: {self.collection_name}")
+            
+        except Exception as e:
+            logger.error(f"Milvus连接失败: {str(e)}")
+            raise ValueError("Milvus连接失败")
+
+    @property
+    def scope(self) -> str:
+        return f"milvus:{MILVUS_URI or f'{MILVUS_HOST}:{MILVUS_PORT}'}/{self.collection_name}"
+
+    def _check_vector_field(self):
+        """以已有集合的向量字段为准，与配置不一致时给出提示"""
+        field = next(f for f in self.collection.schema.fields if f.name == "embedding")
+        vector_type = "float16" if field.dtype == DataType.FLOAT16_VECTOR else "float32"
+        dim = field.params.get("dim", self.dim)
+        if (dim, vector_type) != (self.dim, self.vector_type):
+            logger.warning(
+                f"集合'{self.collection_name}'的向量字段为 {dim}维/{vector_type}，"
+                f"与配置的 {self.dim}维/{self.vector_type} 不一致，以集合为准；如需切换请重建集合"
+            )
+        self.dim, self.vector_type = int(dim), vector_type
+
+    def _vector_index(self):
+        """向量字段上的索引，集合还有标量索引时不能按下标取"""
+        return next((index for index in self.collection.indexes if index.field_name == "embedding"), None)
+
+    def _check_index(self):
+        """以已有集合的索引为准；索引类型与配置不同时使用该类型的默认检索参数"""
+        index = self._vector_index()
+        if index is None:
+            logger.warning(f"集合'{self.collection_name}'没有向量索引，按配置创建: {self.index_config.index_params()}")
+            self.collection.create_index(field_name="embedding", index_params=self.index_config.index_params())
+            return
+        params = index.params
+        index_type = params.get("index_type", self.index_config.index_type)
+        build_params = params.get("params", {})
+        if isinstance(build_params, str):
+            build_params = json.loads(build_params)
+        if index_type == self.index_config.index_type and build_params == self.index_config.build_params:
+            return
+        logger.warning(
+            f"集合'{self.collection_name}'的索引为 {index_type} {build_params}，与配置的 "
+            f"{self.index_config.index_type} {self.index_config.build_params} 不一致，以集合为准；"
+            f"可用 python -m app.milvus.tune_index --apply 重建"
+        )
+        same_type = index_type == self.index_config.index_type
+        self.index_config = IndexConfig.for_type(
+            index_type, build_params, self.index_config.search_params if same_type else None
+        )
+
+    def rebuild_index(self, index_config: IndexConfig):
+        """按新配置重建向量索引，重建期间集合不可检索"""
+        logger.info(f"重建集合'{self.collection_name}'的索引: {index_config.index_params()}")
+        self.collection.release()
+        index = self._vector_index()
+        if index is not None:
+            index.drop()
+        self.collection.create_index(field_name="embedding", index_params=index_config.index_params())
+        self.collection.load()
+        self.index_config = index_config
+
+    def _vectors(self, embeddings: List[List[float]]):
+        """按向量字段类型转换写入/查询的数据"""
+        if self.vector_type == "float16":
+            return [np.asarray(embedding, dtype=np.float16) for embedding in embeddings]
+        return embeddings
+
+    def _create_collection(self) -> Collection:
+        """创建以朝代为分区键的集合，建立向量索引和标量索引"""
+        schema = CollectionSchema(poem_fields(self.dim, self.vector_type))
+        collection = Collection(name=self.collection_name, schema=schema, num_partitions=MILVUS_NUM_PARTITIONS)
+        
+        # 创建向量索引
+        collection.create_index(field_name="embedding", index_params=self.index_config.index_params())
+        # 朝代/作者/时间过滤走标量索引，不逐条扫描
+        scalar_params = {"index_type": MILVUS_SCALAR_INDEX_TYPE} if MILVUS_SCALAR_INDEX_TYPE else {}
+        for field in SCALAR_INDEX_FIELDS:
+            collection.create_index(field_name=field, index_name=f"{field}_index", index_params=scalar_params)
+        logger.info(f"集合'{self.collection_name}'已创建并建立索引，分区数{MILVUS_NUM_PARTITIONS}")
+        return collection
+
+    def _search(self, query_embeddings: List[List[float]], top_k: int, search_params: Dict[str, int],
+                output_fields: List[str], filters: SearchFilter = None):
+        # 执行搜索，Milvus一次请求支持多个查询向量；表达式中含分区键（朝代）时只搜索对应分区
+        limit = min(top_k, MILVUS_MAX_TOP_K)
+        if limit < top_k:
+            logger.warning(f"检索条数{top_k}超过上限，按{limit}条检索")
+        return self.collection.search(
+            data=self._vectors(query_embeddings),
+            anns_field="embedding",
+            param=self.index_config.search_param(search_params, limit),
+            limit=limit,
+            expr=milvus_expr(filters, self.metadata_fields) or None,
+            output_fields=output_fields
+        )
+
+    @staticmethod
+    def _document(hit) -> Document:
+        return Document(
+            id=hit.id,
+            title=hit.entity.get("title", "未知标题"),
+            author=hit.entity.get("author", "未知作者"),
+            content=hit.entity.get("content", ""),
+            similarity=ip_to_similarity(hit.distance)
+        )
+
+    def search_many(self, query_embeddings: List[List[float]], top_k: int = 3,
+                    search_params: Dict[str, int] = None, filters: SearchFilter = None) -> List[List[Document]]:
+        if not query_embeddings:
+            return []
+        results = self._search(query_embeddings, top_k, search_params, ["title", "author", "content"], filters)
+        
+        # 处理结果
+        return [[self._document(hit) for hit in hits] for hits in results]
+
+    def search_many_with_vectors(self, query_embeddings: List[List[float]], top_k: int = 3,
+                                 search_params: Dict[str, int] = None,
+                                 filters: SearchFilter = None) -> List[Tuple[List[Document], np.ndarray]]:
+        if not query_embeddings:
+            return []
+        results = self._search(query_embeddings, top_k, search_params,
+                               ["title", "author", "content", "embedding"], filters)
+        output = []
+        for hits in results:
+            vectors = []
+            for hit in hits:
+                vector = hit.entity.get("embedding")
+                # float16 向量字段以字节返回
+                if isinstance(vector, (bytes, bytearray)):
+                    vector = np.frombuffer(vector, dtype=np.float16)
+                vectors.append(np.asarray(vector, dtype=np.float32))
+            output.append((
+                [self._document(hit) for hit in hits],
+                np.vstack(vectors) if vectors else np.empty((0, self.dim), dtype=np.float32)
+            ))
+        return output
+
+    def upsert(self, entities: List[Dict[str, Any]], flush: bool = True) -> List[int]:
+        if not entities:
+            return []
+        
+        if self.legacy_schema:
+            # 准备按字段分离的数据
+            result = self.collection.insert([
+                [entity["title"] for entity in entities],
+                [entity["author"] for entity in entities],
+                [entity["content"] for entity in entities],
+                [entity["embedding"] for entity in entities],
+                [entity["created_at"] for entity in entities]
+            ])
+        else:
+            fields = ("id", "title", "author", "content", "content_hash", "created_at")
+            vectors = self._vectors([entity["embedding"] for entity in entities])
+            rows = [
+                dict({field: entity[field] for field in fields}, embedding=vector)
+                for entity, vector in zip(entities, vectors)
+            ]
+            if self.metadata_fields:
+                for row in rows:
+                    row["dynasty"], row["author_name"] = split_author(row["author"])
+            result = self.collection.upsert(rows)
+        
+        if flush:
+            self.collection.flush()
+        return list(result.primary_keys)
+
+    def iter_documents(self, batch_size: int = 1000) -> Iterator[Tuple[int, str, str, str]]:
+        iterator = self.collection.query_iterator(
+            batch_size=batch_size,
+            output_fields=["title", "author", "content"]
+        )
+        try:
+            while True:
+                batch = iterator.next()
+                if not batch:
+                    break
+                for row in batch:
+                    yield row["id"], row["title"], row["author"], row["content"]
+        finally:
+            iterator.close()
+
+    def filter_ids(self, ids: List[int], filters: SearchFilter) -> Set[int]:
+        expr = milvus_expr(filters, self.metadata_fields)
+        if not ids or not expr:
+            return set(ids)
+        rows = self.collection.query(expr=f"id in {list(ids)} and ({expr})", output_fields=["id"])
+        return {row["id"] for row in rows}
+
+    def count(self) -> int:
+        return self.collection.num_entities
+
+    def flush(self):
+        self.collection.flush()
+
+
+def create_retriever(backend: str = None, **kwargs) -> BaseRetriever:
+    """检索器工厂函数
+
+    Args:
+        backend: milvus 或 local，默认读取 RETRIEVER_BACKEND 环境变量
+        kwargs: 传给具体检索器的参数
+    """
+    backend = (backend or RETRIEVER_BACKEND).lower()
+    logger.info(f"选择的检索后端: {backend}")
+    
+    if backend == "milvus":
+        return MilvusRetriever(**kwargs)
+    if backend == "local":
+        from app.retriever.local_index import LocalRetriever
+        return LocalRetriever(**kwargs)
+    
+    logger.error(f"不支持的检索后端: {backend}")
+    raise ValueError(f"不支持的检索后端: {backend}")
@@ -0,0 +1,69 @@
+"""
+定时任务leader选举
+多个worker进程竞争同一个本地文件锁，只有持有锁的进程运行定时任务
+"""
+import os
+import logging
+from typing import Optional, IO
+
+from app.config.pathconfig import DATA_DIR
+
+try:
+    import fcntl
+except ImportError:  # Windows 下没有 fcntl
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# leader锁文件路径
+SCHEDULER_LOCK_PATH = os.getenv("SCHEDULER_LOCK_PATH", os.path.join(DATA_DIR, "scheduler.lock"))
+
+
+class LeaderLock:
+    """基于 flock 的进程间排他锁
+
+    锁随文件描述符存在，持有锁的进程退出（包括崩溃）后由内核自动释放，
+    其他进程下次尝试时即可接管。
+    """
+
+    def __init__(self, path: str = SCHEDULER_LOCK_PATH):
+        self.path = path
+        self._file: Optional[IO] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._file is not None
+
+    def try_acquire(self) -> bool:
+        """非阻塞地尝试获取锁，已持有时直接返回True"""
+        if self._file is not None:
+            return True
+        if fcntl is None:
+            logger.warning("当前平台不支持文件锁，本进程直接作为leader")
+            self._file = open(os.devnull, "w")
+            return True
+
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        lock_file = open(self.path, "a+")
+        try:
+            fcntl.flock(lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+
+        # 记录当前leader的pid，便于排查
+        lock_file.seek(0)
+        lock_file.truncate()
+        lock_file.write(str(os.getpid()))
+        lock_file.flush()
+        self._file = lock_file
+        logger.info(f"进程 {os.getpid()} 成为定时任务leader")
+        return True
+
+    def release(self):
+        if self._file is None:
+            return
+        if fcntl is not None:
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_UN)
+        self._file.close()
+        self._file = None
@@ -10,11 +10,15 @@ from datetime import datetime
 # 添加项目根目录到Python路径
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from app.crawler.crawler_scripy import crawl_and_save_to_milvus
+from app.scheduler.leader import LeaderLock
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 非leader进程重新竞争leader的间隔（秒）
+LEADER_RETRY_INTERVAL = int(os.getenv("LEADER_RETRY_INTERVAL", "30"))
+
 class SchedulerManager:
     """定时任务管理器，用于管理FastAPI应用中的定时任务"""
     
@@ -23,6 +27,9 @@ class SchedulerManager:
         self.scheduler = AsyncIOScheduler()
         self.is_running = False
         self.last_run_results = {}
+        # 多worker部署时只有持有leader锁的进程运行定时任务
+        self.leader_lock = LeaderLock()
+        self._election_task = None
     
     def init_app(self, app: FastAPI):
         """初始化FastAPI应用
@@ -43,6 +50,20 @@ class SchedulerManager:
             logger.info("定时任务调度器已关闭")
     
     async def start(self):
+        """竞争leader，成为leader后启动调度器，否则在后台定期重试"""
+        if self.leader_lock.try_acquire():
+            await self._start_scheduler()
+        elif self._election_task is None:
+            logger.info(f"进程 {os.getpid()} 未获得leader锁，不运行定时任务")
+            self._election_task = asyncio.create_task(self._wait_for_leadership())
+    
+    async def _wait_for_leadership(self):
+        """定期尝试获取leader锁，原leader退出后接管定时任务"""
+        while not self.leader_lock.try_acquire():
+            await asyncio.sleep(LEADER_RETRY_INTERVAL)
+        await self._start_scheduler()
+    
+    async def _start_scheduler(self):
         """启动调度器"""
         if not self.is_running:
             # 添加爬虫任务，每天凌晨2点执行
@@ -61,11 +82,15 @@ class SchedulerManager:
             logger.info("定时任务调度器已启动")
     
     async def shutdown(self):
-        """关闭调度器"""
+        """关闭调度器并释放leader锁"""
+        if self._election_task is not None:
+            self._election_task.cancel()
+            self._election_task = None
         if self.is_running:
             self.scheduler.shutdown()
             self.is_running = False
             logger.info("定时任务调度器已关闭")
+        self.leader_lock.release()
     
     async def _run_crawler_task(self):
         """执行爬虫任务的异步包装器"""
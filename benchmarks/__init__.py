@@ -0,0 +1,5 @@
+"""
+性能基准测试
+用本地假服务替代 DashScope / DeepSeek，用进程内索引替代 Milvus，
+在不消耗真实API额度的情况下测量查询与入库路径的延迟和吞吐
+"""
@@ -0,0 +1,175 @@
+"""
+向量维度与压缩存储的召回率-内存报告
+
+    python -m benchmarks.compact_storage_report                  # 假embedding服务 + 合成语料
+    python -m benchmarks.compact_storage_report --real --csv "app/poems/*.csv" --dims 1024 768 512
+
+对每个 维度 x 存储格式 x 重排倍数 组合，计算相对同维度 float32 精确检索的 recall@k、
+相对参考维度（--dims 中最大者）精确检索的 recall@k、常驻内存和重排用全精度向量的大小以及单次查询耗时。
+假embedding服务返回随机向量，不同维度之间没有语义关联，跨维度的召回率只有用 --real 时才有意义。
+"""
+import os
+import sys
+import csv
+import glob
+import json
+import time
+import random
+import logging
+import argparse
+from datetime import datetime
+from typing import List, Dict, Any
+
+import numpy as np
+
+from benchmarks.fake_servers import BackgroundServer, create_embedding_app
+from benchmarks.run_benchmarks import RESULTS_DIR, make_poems, git_revision
+
+logger = logging.getLogger(__name__)
+
+
+def load_texts(pattern: str, corpus_size: int) -> List[str]:
+    """读取爬虫保存的CSV诗歌内容，没有匹配文件时使用合成语料"""
+    texts = []
+    for path in sorted(glob.glob(pattern)) if pattern else []:
+        with open(path, newline="", encoding="utf-8-sig") as f:
+            texts.extend(row["content"] for row in csv.DictReader(f) if row.get("content"))
+    texts = list(dict.fromkeys(texts))
+    if not texts:
+        texts = [poem["content"] for poem in make_poems(corpus_size)]
+    return texts[:corpus_size]
+
+
+def make_queries(texts: List[str], count: int, seed: int = 7) -> List[str]:
+    """取语料中诗歌的首句作为查询"""
+    rng = random.Random(seed)
+    return [rng.choice(texts).split("\n")[0].split("，")[0] for _ in range(count)]
+
+
+def embed(texts: List[str], dim: int) -> np.ndarray:
+    """按指定维度向量化，结果归一化为单位向量"""
+    from app.crawler.ingest import embed_texts
+    from app.rag.rag import DashScopeEmbedding
+
+    model = DashScopeEmbedding()
+    model.dimension = dim
+    vectors = embed_texts(model, texts)
+    missing = sum(vector is None for vector in vectors)
+    if missing:
+        raise RuntimeError(f"{missing}条文本向量化失败")
+    matrix = np.asarray(vectors, dtype=np.float32)
+    return matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+
+
+def recall(found: List[np.ndarray], truth: np.ndarray) -> float:
+    k = truth.shape[1]
+    return float(np.mean([len(set(rows.tolist()) & set(t.tolist())) / k for rows, t in zip(found, truth)]))
+
+
+def evaluate(corpus: np.ndarray, queries: np.ndarray, storage: str, multiplier: int, top_k: int,
+             truth: np.ndarray, reference_truth: np.ndarray) -> Dict[str, Any]:
+    from app.retriever.local_index import approximate_scores, bytes_per_vector, encode_vectors, select_top_k
+
+    codes, scales = encode_vectors(corpus, storage)
+    rerank = storage != "float32" and multiplier > 1
+    start = time.perf_counter()
+    scores = approximate_scores(codes, scales, queries, storage)
+    selected = select_top_k(scores, top_k, candidates=top_k * multiplier,
+                            full=corpus if rerank else None, queries=queries)
+    elapsed = time.perf_counter() - start
+    found = [rows for rows, _ in selected]
+    rows, dim = corpus.shape
+    return {
+        "dim": dim,
+        "storage": storage,
+        "rerank_multiplier": multiplier if rerank else 0,
+        f"recall@{top_k}": round(recall(found, truth), 4),
+        f"recall@{top_k}_vs_reference": round(recall(found, reference_truth), 4),
+        "resident_mb": round(rows * bytes_per_vector(dim, storage) / 2 ** 20, 3),
+        "rerank_store_mb": round(rows * dim * 4 / 2 ** 20, 3) if rerank else 0.0,
+        "query_ms": round(elapsed / len(queries) * 1000, 3),
+    }
+
+
+def exact_top_k(corpus: np.ndarray, queries: np.ndarray, top_k: int) -> np.ndarray:
+    scores = corpus @ queries.T
+    top = np.argpartition(-scores, top_k - 1, axis=0)[:top_k]
+    return top.T
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="向量维度与压缩存储的召回率-内存报告")
+    parser.add_argument("--real", action="store_true", help="使用真实的DashScope接口（需配置 DASHSCOPE_API_KEY）")
+    parser.add_argument("--csv", default=None, help="语料CSV路径通配符，如 app/poems/*.csv；默认使用合成语料")
+    parser.add_argument("--corpus-size", type=int, default=5000)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--top-k", type=int, default=10)
+    parser.add_argument("--dims", type=int, nargs="+", default=[1024, 512, 256])
+    parser.add_argument("--formats", nargs="+", default=["float32", "float16", "int8", "binary"])
+    parser.add_argument("--multipliers", type=int, nargs="+", default=[1, 4, 10],
+                        help="重排候选倍数，1 表示不重排")
+    parser.add_argument("--output", help="结果JSON路径，默认 benchmarks/results/compact-<时间>-<提交>.json")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    server = None
+    if not args.real:
+        server = BackgroundServer(create_embedding_app(latency_ms=0)).start()
+        os.environ.update({
+            "DASHSCOPE_API_KEY": "bench",
+            "DASHSCOPE_EMBEDDING_URL":
+                f"{server.base_url}/api/v1/services/embeddings/text-embedding/text-embedding",
+        })
+
+    texts = load_texts(args.csv, args.corpus_size)
+    queries = make_queries(texts, args.queries)
+    dims = sorted(set(args.dims), reverse=True)
+    print(f"语料 {len(texts)} 条，查询 {len(queries)} 条，维度 {dims}")
+
+    rows = []
+    try:
+        reference_truth = None
+        for dim in dims:
+            corpus, query_vectors = embed(texts, dim), embed(queries, dim)
+            truth = exact_top_k(corpus, query_vectors, args.top_k)
+            if reference_truth is None:
+                reference_truth = truth
+            for storage in args.formats:
+                multipliers = [1] if storage == "float32" else sorted(set(args.multipliers))
+                for multiplier in multipliers:
+                    rows.append(evaluate(corpus, query_vectors, storage, multiplier, args.top_k,
+                                         truth, reference_truth))
+    finally:
+        if server:
+            server.stop()
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": revision,
+            "embedding": "dashscope" if args.real else "fake",
+            "corpus": len(texts),
+            "params": vars(args),
+        },
+        "results": rows,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"compact-{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    columns = list(rows[0].keys()) if rows else []
+    print("\t".join(columns))
+    for row in rows:
+        print("\t".join(str(row[column]) for column in columns))
+    print(f"结果已保存: {output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,172 @@
+"""
+基准测试用的本地假服务
+- 假 DashScope embedding 服务：按文本哈希返回确定性的单位向量，请求/响应格式与 DashScope 一致
+- 假 OpenAI 兼容对话服务：可配置首字延迟和逐字延迟，支持流式输出
+"""
+import json
+import time
+import uuid
+import socket
+import asyncio
+import hashlib
+import threading
+from typing import List
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+# DashScope text-embedding-v3 单次请求的文本数上限
+EMBEDDING_MAX_BATCH = 10
+
+
+def fake_embedding(text: str, dim: int) -> List[float]:
+    """由文本哈希生成确定性的单位向量，同一文本总是得到同一向量"""
+    seed = int.from_bytes(hashlib.sha1(text.encode("utf-8")).digest()[:8], "big")
+    vector = np.random.default_rng(seed).standard_normal(dim).astype(np.float32)
+    vector /= np.linalg.norm(vector)
+    return vector.tolist()
+
+
+def create_embedding_app(latency_ms: float = 20.0, default_dim: int = 1024) -> FastAPI:
+    """创建假的 DashScope embedding 服务
+
+    Args:
+        latency_ms: 每次请求的固定延迟
+        default_dim: 请求未指定 parameters.dimension 时的向量维度
+    """
+    app = FastAPI()
+    app.state.requests = 0
+
+    @app.post("/api/v1/services/embeddings/text-embedding/text-embedding")
+    async def embeddings(request: Request):
+        body = await request.json()
+        texts = body.get("input", {}).get("texts") or []
+        if not texts or len(texts) > EMBEDDING_MAX_BATCH:
+            return JSONResponse(status_code=400, content={
+                "code": "InvalidParameter",
+                "message": f"batch size must be between 1 and {EMBEDDING_MAX_BATCH}",
+            })
+        dim = body.get("parameters", {}).get("dimension", default_dim)
+        app.state.requests += 1
+        await asyncio.sleep(latency_ms / 1000)
+        return {
+            "output": {
+                "embeddings": [
+                    {"text_index": i, "embedding": fake_embedding(text, dim)}
+                    for i, text in enumerate(texts)
+                ]
+            },
+            "usage": {"total_tokens": sum(len(text) for text in texts)},
+            "request_id": uuid.uuid4().hex,
+        }
+
+    return app
+
+
+def create_chat_app(first_token_ms: float = 300.0, token_ms: float = 10.0, tokens: int = 64) -> FastAPI:
+    """创建假的 OpenAI 兼容对话服务
+
+    Args:
+        first_token_ms: 首个token前的延迟
+        token_ms: 后续每个token的间隔
+        tokens: 每次回复的token数
+    """
+    app = FastAPI()
+    app.state.requests = 0
+    pieces = ["春风又绿江南岸，", "明月何时照我还。"]
+
+    def completion_tokens():
+        return [pieces[i % len(pieces)] for i in range(tokens)]
+
+    def usage(messages):
+        prompt_tokens = sum(len(str(m.get("content", ""))) for m in messages)
+        return {"prompt_tokens": prompt_tokens, "completion_tokens": tokens,
+                "total_tokens": prompt_tokens + tokens}
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        app.state.requests += 1
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        created = int(time.time())
+        model = body.get("model", "fake-chat")
+
+        if not body.get("stream"):
+            await asyncio.sleep((first_token_ms + token_ms * max(tokens - 1, 0)) / 1000)
+            return {
+                "id": completion_id,
+                "object": "chat.completion",
+                "created": created,
+                "model": model,
+                "choices": [{
+                    "index": 0,
+                    "message": {"role": "assistant", "content": "".join(completion_tokens())},
+                    "finish_reason": "stop",
+                }],
+                "usage": usage(body.get("messages", [])),
+            }
+
+        async def stream():
+            def chunk(delta, finish_reason=None):
+                data = {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": created,
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+                }
+                return f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+            await asyncio.sleep(first_token_ms / 1000)
+            yield chunk({"role": "assistant", "content": ""})
+            for i, token in enumerate(completion_tokens()):
+                if i:
+                    await asyncio.sleep(token_ms / 1000)
+                yield chunk({"content": token})
+            yield chunk({}, finish_reason="stop")
+            if body.get("stream_options", {}).get("include_usage"):
+                data = {"id": completion_id, "object": "chat.completion.chunk", "created": created,
+                        "model": model, "choices": [], "usage": usage(body.get("messages", []))}
+                yield f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return StreamingResponse(stream(), media_type="text/event-stream")
+
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class BackgroundServer:
+    """在后台线程中运行的 uvicorn 服务（假服务和被测应用共用）"""
+
+    def __init__(self, app: FastAPI, port: int = None):
+        self.app = app
+        self.port = port or _free_port()
+        self._server = uvicorn.Server(uvicorn.Config(
+            app, host="127.0.0.1", port=self.port, log_level="warning", access_log=False
+        ))
+        self._thread = threading.Thread(target=self._server.run, daemon=True)
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout: float = 10.0) -> "BackgroundServer":
+        self._thread.start()
+        deadline = time.monotonic() + timeout
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"服务启动失败: {self.base_url}")
+            time.sleep(0.02)
+        return self
+
+    def stop(self):
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
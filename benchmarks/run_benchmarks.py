@@ -0,0 +1,323 @@
+"""
+基准测试入口
+
+    python -m benchmarks.run_benchmarks --requests 200 --concurrency 16
+    python -m benchmarks.run_benchmarks --scenarios query batch --baseline benchmarks/results/old.json
+
+启动假 embedding 服务、假对话服务和被测应用（本地索引后端，数据目录为临时目录），
+依次运行各场景，输出每个场景的 p50/p95/p99 延迟和每秒请求数，并保存为JSON。
+"""
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import subprocess
+from datetime import datetime
+from typing import List, Dict, Any, Callable, Awaitable
+
+import numpy as np
+import httpx
+
+from benchmarks.fake_servers import BackgroundServer, create_embedding_app, create_chat_app
+
+logger = logging.getLogger(__name__)
+
+SCENARIOS = ["ingest", "query", "query_stream", "batch"]
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "results")
+
+AUTHORS = ["〔唐代〕·李白", "〔唐代〕·杜甫", "〔宋代〕·苏轼", "〔宋代〕·陆游", "〔唐代〕·王维", "〔宋代〕·李清照"]
+CHARS = "春风花月夜山水云天江南北秋雨雪梅柳烟寒孤舟归客长亭明日落霜林鸟鸣声远近人家故乡思念独上高楼"
+
+
+def make_poems(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """生成确定性的合成诗歌语料"""
+    rng = random.Random(seed)
+    poems = []
+    for i in range(count):
+        lines = ["".join(rng.choice(CHARS) for _ in range(7)) for _ in range(4)]
+        poems.append({
+            "title": f"无题{i}",
+            "author": AUTHORS[i % len(AUTHORS)],
+            "content": f"{lines[0]}，{lines[1]}。\n{lines[2]}，{lines[3]}。",
+            "created_at": "2024-01-01 00:00:00",
+        })
+    return poems
+
+
+def make_queries(poems: List[Dict[str, Any]], count: int, seed: int = 7) -> List[str]:
+    """从语料中取诗句并加编号，保证每条查询互不相同（不命中查询向量缓存）"""
+    rng = random.Random(seed)
+    return [f"{rng.choice(poems)['content'][:7]} {i}" for i in range(count)]
+
+
+def summarize(latencies: List[float], errors: int, elapsed: float) -> Dict[str, Any]:
+    """汇总延迟分位数（毫秒）与吞吐"""
+    completed = len(latencies)
+    result = {
+        "requests": completed + errors,
+        "errors": errors,
+        "elapsed_s": round(elapsed, 3),
+        "rps": round(completed / elapsed, 2) if elapsed > 0 else 0.0,
+    }
+    if latencies:
+        values = np.array(latencies) * 1000
+        result.update({
+            "mean_ms": round(float(values.mean()), 2),
+            "p50_ms": round(float(np.percentile(values, 50)), 2),
+            "p95_ms": round(float(np.percentile(values, 95)), 2),
+            "p99_ms": round(float(np.percentile(values, 99)), 2),
+            "max_ms": round(float(values.max()), 2),
+        })
+    return result
+
+
+async def run_load(call: Callable[[int], Awaitable[Any]], requests: int, concurrency: int) -> Dict[str, Any]:
+    """以固定并发执行 requests 次调用，统计成功调用的延迟"""
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: List[float] = []
+    errors = 0
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(i)
+            except Exception as e:
+                errors += 1
+                logger.warning(f"请求{i}失败: {str(e)}")
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return summarize(latencies, errors, time.perf_counter() - start)
+
+
+def bench_ingest(poems: List[Dict[str, Any]], batch_size: int) -> Dict[str, Any]:
+    """入库场景：按批调用 ingest_poems，同时为后续查询场景准备语料"""
+    from app.crawler.ingest import ingest_poems
+    from app.crawler.dedup import SeenStore
+    from app.rag.rag import DashScopeEmbedding
+    from app.retriever import create_retriever
+
+    retriever = create_retriever(collection_name=os.environ["MILVUS_COLLECTION_NAME"], create_if_missing=True)
+    embedding_model = DashScopeEmbedding()
+    seen_store = SeenStore.for_retriever(retriever)
+    latencies, errors, failed = [], 0, 0
+
+    start = time.perf_counter()
+    for i in range(0, len(poems), batch_size):
+        batch_start = time.perf_counter()
+        try:
+            counts = ingest_poems(poems[i:i + batch_size], retriever, embedding_model, seen_store=seen_store)
+        except Exception as e:
+            errors += 1
+            logger.warning(f"入库批次{i // batch_size}失败: {str(e)}")
+            continue
+        failed += counts["failed"]
+        latencies.append(time.perf_counter() - batch_start)
+    elapsed = time.perf_counter() - start
+
+    result = summarize(latencies, errors, elapsed)
+    result.update({
+        "batch_size": batch_size,
+        "poems": len(poems),
+        "poems_failed": failed,
+        "poems_per_s": round(len(poems) / elapsed, 2) if elapsed > 0 else 0.0,
+    })
+    return result
+
+
+async def bench_query(client: httpx.AsyncClient, queries: List[str], args) -> Dict[str, Any]:
+    """单条查询场景: POST /api/query"""
+    async def call(i: int):
+        response = await client.post("/api/query", json={
+            "query": queries[i], "top_k": args.top_k, "bypass_cache": not args.use_cache,
+        })
+        response.raise_for_status()
+
+    return await run_load(call, len(queries), args.concurrency)
+
+
+async def bench_query_stream(client: httpx.AsyncClient, queries: List[str], args) -> Dict[str, Any]:
+    """流式查询场景: POST /api/query/stream，额外统计首个token的到达时间"""
+    first_token: List[float] = []
+
+    async def call(i: int):
+        start = time.perf_counter()
+        async with client.stream("POST", "/api/query/stream", json={
+            "query": queries[i], "top_k": args.top_k, "bypass_cache": not args.use_cache,
+        }) as response:
+            response.raise_for_status()
+            seen_token = False
+            async for line in response.aiter_lines():
+                if line == "event: error":
+                    raise RuntimeError("流式查询返回错误事件")
+                if not seen_token and line == "event: token":
+                    seen_token = True
+                    first_token.append(time.perf_counter() - start)
+
+    result = await run_load(call, len(queries), args.concurrency)
+    ttft = summarize(first_token, 0, 1.0)
+    result["ttft"] = {k: v for k, v in ttft.items() if k.endswith("_ms")}
+    return result
+
+
+async def bench_batch(client: httpx.AsyncClient, queries: List[str], args) -> Dict[str, Any]:
+    """批量查询场景: POST /api/query/batch，每个请求包含 batch_size 条查询"""
+    batches = [queries[i:i + args.batch_size] for i in range(0, len(queries), args.batch_size)]
+
+    async def call(i: int):
+        response = await client.post("/api/query/batch", json={
+            "queries": batches[i], "top_k": args.top_k, "bypass_cache": not args.use_cache,
+        }, timeout=120)
+        response.raise_for_status()
+        errors = [item["error"] for item in response.json()["results"] if item["error"]]
+        if errors:
+            raise RuntimeError(f"{len(errors)}条查询失败: {errors[0]}")
+
+    # 批量场景的并发按请求数折算，保持与单条查询场景相近的在途查询数
+    result = await run_load(call, len(batches), max(1, args.concurrency // args.batch_size))
+    result.update({
+        "batch_size": args.batch_size,
+        "queries_per_s": round(len(queries) / result["elapsed_s"], 2) if result["elapsed_s"] > 0 else 0.0,
+    })
+    return result
+
+
+def compare(results: Dict[str, Any], baseline_path: str):
+    """与基线结果对比，打印各场景关键指标的变化百分比"""
+    with open(baseline_path, "r", encoding="utf-8") as f:
+        baseline = json.load(f)["scenarios"]
+    print(f"\n与基线对比: {baseline_path}")
+    for name, current in results.items():
+        previous = baseline.get(name)
+        if not previous:
+            continue
+        changes = []
+        for key in ("p50_ms", "p95_ms", "p99_ms", "rps"):
+            if previous.get(key) and key in current:
+                delta = (current[key] - previous[key]) / previous[key] * 100
+                changes.append(f"{key} {previous[key]} -> {current[key]} ({delta:+.1f}%)")
+        print(f"  {name}: " + "; ".join(changes))
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True,
+                                       stderr=subprocess.DEVNULL).strip()
+    except Exception:
+        return "unknown"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="RAG服务基准测试")
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=SCENARIOS)
+    parser.add_argument("--corpus-size", type=int, default=2000, help="合成语料条数")
+    parser.add_argument("--ingest-batch-size", type=int, default=100, help="每次 ingest_poems 的诗歌数")
+    parser.add_argument("--requests", type=int, default=200, help="查询场景的查询总数")
+    parser.add_argument("--concurrency", type=int, default=16, help="同时在途的查询数")
+    parser.add_argument("--batch-size", type=int, default=8, help="批量场景每个请求的查询数")
+    parser.add_argument("--top-k", type=int, default=3)
+    parser.add_argument("--use-cache", action="store_true", help="允许命中语义答案缓存（默认绕过）")
+    parser.add_argument("--embedding-latency-ms", type=float, default=20.0)
+    parser.add_argument("--llm-first-token-ms", type=float, default=300.0)
+    parser.add_argument("--llm-token-ms", type=float, default=5.0)
+    parser.add_argument("--llm-tokens", type=int, default=32)
+    parser.add_argument("--search-mode", choices=["vector", "lexical", "hybrid"], default="vector")
+    parser.add_argument("--output", help="结果JSON路径，默认 benchmarks/results/<时间>-<提交>.json")
+    parser.add_argument("--baseline", help="用于对比的历史结果JSON")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    embedding_server = BackgroundServer(create_embedding_app(latency_ms=args.embedding_latency_ms)).start()
+    chat_server = BackgroundServer(create_chat_app(
+        first_token_ms=args.llm_first_token_ms, token_ms=args.llm_token_ms, tokens=args.llm_tokens
+    )).start()
+    data_dir = tempfile.mkdtemp(prefix="rag-bench-")
+
+    # 应用模块在导入时读取配置，必须先设置好环境变量再导入
+    os.environ.update({
+        "DATA_DIR": data_dir,
+        "RETRIEVER_BACKEND": "local",
+        "MILVUS_COLLECTION_NAME": "bench_poems",
+        "SEARCH_MODE": args.search_mode,
+        "DASHSCOPE_API_KEY": "bench",
+        "DEEPSEEK_API_KEY": "bench",
+        "DASHSCOPE_EMBEDDING_URL":
+            f"{embedding_server.base_url}/api/v1/services/embeddings/text-embedding/text-embedding",
+        "DEEPSEEK_BASE_URL": f"{chat_server.base_url}/v1",
+        "DASHSCOPE_BASE_URL": f"{chat_server.base_url}/v1",
+    })
+    from fastapi import FastAPI
+    from app.api import api_router
+    from app.metrics.middleware import MetricsMiddleware
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(api_router)
+    app_server = BackgroundServer(app).start()
+
+    poems = make_poems(args.corpus_size)
+    queries = make_queries(poems, args.requests)
+    results: Dict[str, Any] = {}
+    try:
+        print(f"准备语料: {len(poems)} 首")
+        ingest = bench_ingest(poems, args.ingest_batch_size)
+        if "ingest" in args.scenarios:
+            results["ingest"] = ingest
+
+        async def run_http_scenarios():
+            limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+            async with httpx.AsyncClient(base_url=app_server.base_url, limits=limits, timeout=60) as client:
+                # 预热：触发RAG实例初始化，不计入结果
+                (await client.post("/api/query", json={"query": "预热", "top_k": args.top_k})).raise_for_status()
+                scenarios = {"query": bench_query, "query_stream": bench_query_stream, "batch": bench_batch}
+                for name, bench in scenarios.items():
+                    if name in args.scenarios:
+                        print(f"运行场景: {name}")
+                        results[name] = await bench(client, queries, args)
+
+        asyncio.run(run_http_scenarios())
+    finally:
+        app_server.stop()
+        chat_server.stop()
+        embedding_server.stop()
+
+    revision = git_revision()
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(timespec="seconds"),
+            "git_revision": revision,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "params": vars(args),
+        },
+        "scenarios": results,
+    }
+    output = args.output or os.path.join(RESULTS_DIR, f"{datetime.now():%Y%m%d-%H%M%S}-{revision}.json")
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    with open(output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+
+    for name, result in results.items():
+        print(f"{name}: " + ", ".join(f"{k}={v}" for k, v in result.items() if k != "ttft"))
+    print(f"结果已保存: {output}")
+    if args.baseline:
+        compare(results, args.baseline)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
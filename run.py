@@ -6,7 +6,10 @@ from fastapi.middleware.cors import CORSMiddleware
 from dotenv import load_dotenv
 import uvicorn
 import logging
+import os
 from app.api import api_router
+from app.api.deps import start_init
+from app.metrics.middleware import MetricsMiddleware
 from app.scheduler.tasks import scheduler_manager
 import sys
 
@@ -44,19 +47,29 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有头
 )
 
+# 请求耗时、在途请求数与 Server-Timing 响应头
+app.add_middleware(MetricsMiddleware)
+
 # 包含API路由
 app.include_router(api_router)
 
 # 初始化定时任务调度器
 scheduler_manager.init_app(app)
 
+@app.on_event("startup")
+async def warmup_rag():
+    """在后台预热RAG实例，不阻塞启动；就绪状态见 /api/health/ready"""
+    start_init()
+
 if __name__ == "__main__":
+    # 工作进程数，默认单进程便于调试；多进程时定时任务只在leader进程运行
+    workers = int(os.getenv("UVICORN_WORKERS", "1"))
     # 使用uvicorn运行应用，启用调试模式
     uvicorn.run(
         "run:app",
         host="0.0.0.0",
         port=8000,
-        reload=True,  # 启用热重载
+        reload=workers == 1,  # 单进程时启用热重载（与多进程互斥）
         log_level="debug",  # 设置uvicorn的日志级别为debug
-        workers=1  # 使用单工作进程，便于调试
+        workers=workers
     )
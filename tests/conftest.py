@@ -0,0 +1,10 @@
+"""
+测试环境：导入 app 之前设置好环境变量，数据目录使用临时目录，检索后端使用本地索引
+"""
+import os
+import tempfile
+
+os.environ.setdefault("DATA_DIR", tempfile.mkdtemp(prefix="rag-test-"))
+os.environ.setdefault("RETRIEVER_BACKEND", "local")
+os.environ.setdefault("DASHSCOPE_API_KEY", "test")
+os.environ.setdefault("DEEPSEEK_API_KEY", "test")
@@ -0,0 +1,131 @@
+import asyncio
+
+import pytest
+
+from app.rag.admission import Overloaded, StageLimiter, request_deadline
+
+
+def _handoff_then(exc):
+    """替换 asyncio.wait_for：先把名额转交给正在等待的请求，再抛出超时或取消，模拟两者同时发生"""
+    def wait_for(limiter):
+        async def fake(waiter, timeout):
+            limiter.release()
+            assert waiter.done()
+            raise exc
+        return fake
+    return wait_for
+
+
+def test_queue_full_rejects_with_429():
+    async def main():
+        limiter = StageLimiter("test", concurrency=1, queue_size=1, queue_timeout=5)
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        with pytest.raises(Overloaded) as e:
+            await limiter.acquire()
+        assert e.value.reason == "queue_full" and e.value.status_code == 429
+        limiter.release()
+        await queued
+        limiter.release()
+        assert limiter.active == 0 and limiter.rejected == 1
+
+    asyncio.run(main())
+
+
+def test_deadline_rejects_before_queueing():
+    async def main():
+        limiter = StageLimiter("test", concurrency=1, queue_size=8, queue_timeout=5)
+        await limiter.acquire()
+        limiter.release(held=5.0)
+        await limiter.acquire()
+        # 平均占用5秒，截止时间只剩1秒，不进入队列直接拒绝
+        with request_deadline(1.0):
+            with pytest.raises(Overloaded) as e:
+                await limiter.acquire()
+        assert e.value.reason == "deadline" and e.value.status_code == 503
+        assert e.value.retry_after >= 5
+        assert limiter.stats()["queued"] == 0
+
+    asyncio.run(main())
+
+
+def test_queue_timeout_rejects_and_leaves_queue():
+    async def main():
+        limiter = StageLimiter("test", concurrency=1, queue_size=8, queue_timeout=0.05)
+        await limiter.acquire()
+        with pytest.raises(Overloaded) as e:
+            await limiter.acquire()
+        assert e.value.reason == "timeout" and e.value.status_code == 503
+        assert limiter.stats()["queued"] == 0
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(main())
+
+
+def test_timeout_after_handoff_returns_the_slot(monkeypatch):
+    async def main():
+        limiter = StageLimiter("test", concurrency=1, queue_size=8, queue_timeout=5)
+        await limiter.acquire()
+        monkeypatch.setattr(asyncio, "wait_for", _handoff_then(asyncio.TimeoutError())(limiter))
+        with pytest.raises(Overloaded) as e:
+            await limiter.acquire()
+        assert e.value.reason == "timeout"
+        # 转交过来的名额已交还，不会永久占用
+        assert limiter.active == 0
+
+    asyncio.run(main())
+
+
+def test_cancel_after_handoff_passes_the_slot_on(monkeypatch):
+    async def main():
+        limiter = StageLimiter("test", concurrency=1, queue_size=8, queue_timeout=5)
+        await limiter.acquire()
+        monkeypatch.setattr(asyncio, "wait_for", _handoff_then(asyncio.CancelledError())(limiter))
+        with pytest.raises(asyncio.CancelledError):
+            await limiter.acquire()
+        assert limiter.active == 0
+
+    asyncio.run(main())
+
+
+def test_cancel_while_queued_leaves_queue():
+    async def main():
+        limiter = StageLimiter("test", concurrency=1, queue_size=8, queue_timeout=5)
+        await limiter.acquire()
+        queued = asyncio.ensure_future(limiter.acquire())
+        await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 1
+        queued.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await queued
+        assert limiter.stats()["queued"] == 0
+        limiter.release()
+        assert limiter.active == 0
+
+    asyncio.run(main())
+
+
+def test_slots_are_handed_off_in_fifo_order():
+    async def main():
+        limiter = StageLimiter("test", concurrency=1, queue_size=8, queue_timeout=5)
+        order = []
+
+        async def worker(i):
+            async with limiter.slot():
+                order.append(i)
+                await asyncio.sleep(0)
+
+        await limiter.acquire()
+        tasks = []
+        for i in range(4):
+            tasks.append(asyncio.ensure_future(worker(i)))
+            await asyncio.sleep(0)
+        assert limiter.stats()["queued"] == 4
+        limiter.release()
+        await asyncio.gather(*tasks)
+        assert order == [0, 1, 2, 3]
+        assert limiter.active == 0 and limiter.admitted == 5
+
+    asyncio.run(main())
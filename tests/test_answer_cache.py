@@ -0,0 +1,38 @@
+from app.rag.answer_cache import SemanticAnswerCache
+
+EMBEDDING = [1.0, 0.0, 0.0, 0.0]
+
+
+def _cache(path, check_ms=0):
+    return SemanticAnswerCache(capacity=8, threshold=0.9, generation_path=str(path), generation_check_ms=check_ms)
+
+
+def test_invalidation_reaches_other_workers(tmp_path):
+    path = tmp_path / "corpus_generation"
+    worker, ingester = _cache(path), _cache(path)
+    worker.store(EMBEDDING, "options", [], "答案")
+    assert worker.lookup(EMBEDDING, "options")["answer"] == "答案"
+
+    ingester.invalidate()
+    ingester.invalidate()
+    assert path.read_text() == "2"
+    assert worker.lookup(EMBEDDING, "options") is None
+    assert worker.invalidations == 1
+
+
+def test_generation_check_is_rate_limited(tmp_path, monkeypatch):
+    path = tmp_path / "corpus_generation"
+    worker, ingester = _cache(path, check_ms=60_000), _cache(path)
+    reads = []
+    read = worker._read_generation
+    monkeypatch.setattr(worker, "_read_generation", lambda: reads.append(1) or read())
+
+    worker.store(EMBEDDING, "options", [], "答案")
+    ingester.invalidate()
+    for _ in range(10):
+        worker.lookup(EMBEDDING, "options")
+    assert reads == []
+
+    worker._next_generation_check = 0
+    assert worker.lookup(EMBEDDING, "options") is None
+    assert len(reads) == 1
@@ -0,0 +1,84 @@
+"""
+批量查询：全部查询共用一次向量化和一次多向量检索，结果按请求顺序返回，单条失败只记录在该条目
+"""
+import asyncio
+import random
+import re
+
+import pytest
+
+from app.rag import rag as rag_module
+from app.rag.rag import RAG, Document
+
+
+class FakeEmbedding:
+    model = "fake"
+    dimension = 2
+
+    def __init__(self):
+        self.calls = []
+
+    async def aembed_documents(self, documents):
+        self.calls.append(list(documents))
+        # “失败”模拟向量化失败时返回的零向量
+        return [[0.0, 0.0] if text == "失败" else [float(i + 1), 1.0] for i, text in enumerate(documents)]
+
+
+class FakeRetriever:
+    scope = "fake"
+
+    def __init__(self):
+        self.calls = []
+
+    def search_many(self, query_embeddings, top_k=3, search_params=None, filters=None):
+        self.calls.append([list(vector) for vector in query_embeddings])
+        return [
+            [Document(title=f"诗{int(vector[0])}", author="〔唐代〕·李白", content="床前明月光", similarity=0.9)]
+            for vector in query_embeddings
+        ]
+
+
+class FakeLLM:
+    async def aget_completion(self, messages, **kwargs):
+        # 打乱各条生成完成的先后顺序
+        await asyncio.sleep(random.uniform(0, 0.01))
+        prompt = "\n".join(str(message.get("content", "")) for message in messages)
+        return "答：" + re.search(r"问题\d+", prompt).group(0)
+
+
+@pytest.fixture
+def rag(monkeypatch):
+    embedding, retriever = FakeEmbedding(), FakeRetriever()
+    monkeypatch.setattr(rag_module, "create_llm_client", lambda: FakeLLM())
+    monkeypatch.setattr(rag_module, "create_embedding_model", lambda: embedding)
+    monkeypatch.setattr(rag_module, "create_retriever", lambda **kwargs: retriever)
+    return RAG()
+
+
+def test_batch_shares_one_embedding_and_one_search_and_keeps_order(rag):
+    queries = [f"问题{i}" for i in range(6)]
+    results = asyncio.run(rag.abatch_query(queries, top_k=1, use_cache=False, concurrency=3))
+
+    assert rag.embeddings.calls == [queries]
+    assert len(rag.retriever.calls) == 1
+    assert [result["query"] for result in results] == queries
+    assert [result["answer"] for result in results] == [f"答：{query}" for query in queries]
+    assert [result["documents"][0].title for result in results] == [f"诗{i + 1}" for i in range(6)]
+    assert all(result["error"] is None for result in results)
+
+
+def test_failed_embedding_only_affects_its_own_item(rag):
+    queries = ["问题0", "失败", "问题2"]
+    results = asyncio.run(rag.abatch_query(queries, top_k=1, use_cache=False))
+
+    assert results[1]["error"] and not results[1]["documents"] and results[1]["answer"] is None
+    # 失败的条目不参与检索
+    assert rag.retriever.calls == [[[1.0, 1.0], [3.0, 1.0]]]
+    assert [results[0]["answer"], results[2]["answer"]] == ["答：问题0", "答：问题2"]
+
+
+def test_retrieval_only_batch_skips_generation(rag):
+    rag.llm_client = None
+    results = asyncio.run(rag.abatch_query(["问题0", "问题1"], top_k=1, generate=False))
+    assert [result["documents"][0].title for result in results] == ["诗1", "诗2"]
+    assert all(result["answer"] is None and result["error"] is None for result in results)
@@ -0,0 +1,70 @@
+"""
+基准测试用的假服务：与 DashScope、OpenAI 兼容接口的请求/响应格式一致，真实的客户端可以直接对接
+"""
+import json
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from app.rag import rag as rag_module
+from benchmarks.fake_servers import (
+    EMBEDDING_MAX_BATCH, BackgroundServer, create_chat_app, create_embedding_app, fake_embedding
+)
+
+EMBEDDING_PATH = "/api/v1/services/embeddings/text-embedding/text-embedding"
+
+
+def test_fake_embedding_is_deterministic_unit_vector():
+    vector = fake_embedding("床前明月光", 64)
+    assert vector == fake_embedding("床前明月光", 64)
+    assert vector != fake_embedding("疑是地上霜", 64)
+    assert np.linalg.norm(vector) == pytest.approx(1.0, abs=1e-5)
+
+
+def test_embedding_app_follows_the_dashscope_format():
+    app = create_embedding_app(latency_ms=0, default_dim=16)
+    client = TestClient(app)
+    body = client.post(EMBEDDING_PATH, json={"input": {"texts": ["甲", "乙"]}, "parameters": {"dimension": 8}}).json()
+    items = body["output"]["embeddings"]
+    assert [item["text_index"] for item in items] == [0, 1]
+    assert items[1]["embedding"] == fake_embedding("乙", 8)
+
+    assert len(client.post(EMBEDDING_PATH, json={"input": {"texts": ["甲"]}}).json()
+               ["output"]["embeddings"][0]["embedding"]) == 16
+    too_many = client.post(EMBEDDING_PATH, json={"input": {"texts": ["甲"] * (EMBEDDING_MAX_BATCH + 1)}})
+    assert too_many.status_code == 400
+    assert app.state.requests == 2
+
+
+def test_chat_app_completion_and_stream():
+    client = TestClient(create_chat_app(first_token_ms=0, token_ms=0, tokens=3))
+    messages = [{"role": "user", "content": "明月"}]
+
+    body = client.post("/v1/chat/completions", json={"model": "m", "messages": messages}).json()
+    assert body["choices"][0]["message"]["content"] == "春风又绿江南岸，明月何时照我还。春风又绿江南岸，"
+    assert body["usage"]["completion_tokens"] == 3
+
+    with client.stream("POST", "/v1/chat/completions",
+                       json={"model": "m", "messages": messages, "stream": True}) as response:
+        lines = [line for line in response.iter_lines() if line]
+    assert lines[-1] == "data: [DONE]"
+    chunks = [json.loads(line[len("data: "):]) for line in lines[:-1]]
+    content = "".join(chunk["choices"][0]["delta"].get("content", "") for chunk in chunks if chunk["choices"])
+    assert content == body["choices"][0]["message"]["content"]
+    assert chunks[-1]["choices"][0]["finish_reason"] == "stop"
+
+
+def test_dashscope_client_talks_to_the_fake_server(monkeypatch):
+    server = BackgroundServer(create_embedding_app(latency_ms=0)).start()
+    try:
+        monkeypatch.setattr(rag_module, "DASHSCOPE_EMBEDDING_URL", server.base_url + EMBEDDING_PATH)
+        embedding = rag_module.DashScopeEmbedding(api_key="test")
+        texts = [f"第{i}首" for i in range(EMBEDDING_MAX_BATCH + 2)]
+        vectors = embedding.embed_documents(texts)
+    finally:
+        server.stop()
+    assert len(vectors) == len(texts)
+    np.testing.assert_allclose(vectors[-1], fake_embedding(texts[-1], embedding.dimension), atol=1e-6)
+    # 超过单次上限的文本分两次请求
+    assert server.app.state.requests == 2
@@ -0,0 +1,109 @@
+"""
+CSV批量入库：检查点的进度记录/续传，以及默认集合名与问答服务一致
+"""
+import csv
+import os
+
+from app.crawler import bulk_load
+from app.crawler.bulk_load import Checkpoint
+from app.retriever import retriever as retriever_module
+
+
+def _write_csv(path, rows):
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=bulk_load.POEM_FIELDS)
+        writer.writeheader()
+        for i in range(rows):
+            writer.writerow({"title": f"诗{i}", "author": "[唐]李白", "content": f"内容{i}", "created_at": ""})
+    return str(path)
+
+
+def test_rows_done_and_advance_survive_reload(tmp_path):
+    csv_path = _write_csv(tmp_path / "2024-01-01.csv", 5)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    assert checkpoint.rows_done(csv_path) == 0
+    assert not checkpoint.resumed
+
+    checkpoint.advance(csv_path, 3)
+    checkpoint.add_counts({"new": 2, "skipped": 1})
+    checkpoint.add_counts({"new": 1})
+    checkpoint.save()
+
+    reloaded = Checkpoint(checkpoint.path).load()
+    assert reloaded.resumed
+    assert reloaded.rows_done(csv_path) == 3
+    assert reloaded.state["counts"] == {"new": 3, "skipped": 1}
+    # 续传时从第4行开始读
+    assert [poem["title"] for poem in bulk_load.read_poems(csv_path, skip=3)] == ["诗3", "诗4"]
+
+
+def test_changed_file_restarts_from_the_beginning(tmp_path):
+    csv_path = _write_csv(tmp_path / "2024-01-01.csv", 5)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    checkpoint.advance(csv_path, 5, done=True)
+
+    _write_csv(csv_path, 8)
+    assert checkpoint.rows_done(csv_path) == 0
+
+
+def test_invalid_checkpoint_file_starts_over(tmp_path):
+    path = tmp_path / "checkpoint.json"
+    path.write_text("{not json")
+    checkpoint = Checkpoint(str(path)).load()
+    assert not checkpoint.resumed
+    checkpoint.remove()
+    assert not path.exists()
+
+
+class FakeRetriever:
+    scope = "fake"
+
+    def __init__(self):
+        self.documents = {}
+
+    def count(self):
+        return len(self.documents)
+
+
+def test_finished_files_are_skipped_on_resume(tmp_path, monkeypatch):
+    import app.crawler.ingest as ingest
+    import app.retriever.lexical as lexical
+
+    first = _write_csv(tmp_path / "2024-01-01.csv", 4)
+    second = _write_csv(tmp_path / "2024-01-02.csv", 3)
+    checkpoint = Checkpoint(str(tmp_path / "checkpoint.json"))
+    checkpoint.advance(first, 4, done=True)
+    checkpoint.advance(second, 1)
+    checkpoint.save()
+
+    ingested = []
+
+    def fake_ingest_poems(poems, retriever, embedding_model, seen_store=None, flush=True):
+        ingested.extend(poem["title"] for poem in poems)
+        return {"new": len(poems)}
+
+    monkeypatch.setattr(ingest, "ingest_poems", fake_ingest_poems)
+    monkeypatch.setattr(ingest, "finish_ingest", lambda retriever: None)
+    monkeypatch.setattr(lexical, "rebuild_lexical_index", lambda retriever: None)
+
+    result = bulk_load.bulk_load(str(tmp_path), chunk_size=2, checkpoint_path=checkpoint.path,
+                                 retriever=FakeRetriever(), embedding_model=object(), seen_store=object())
+    assert result["status"] == "success"
+    # 第一个文件已完成被跳过，第二个文件从第2行继续
+    assert ingested == ["诗1", "诗2"]
+    assert result["data"]["new"] == 2
+    assert not os.path.exists(checkpoint.path)
+
+
+def test_default_collection_name_prefers_milvus_setting(monkeypatch):
+    monkeypatch.setattr(retriever_module, "MILVUS_COLLECTION_NAME", "gushi")
+    monkeypatch.setenv("COLLECTION_NAME", "legacy")
+    assert retriever_module.default_collection_name() == "gushi"
+
+    monkeypatch.setattr(retriever_module, "MILVUS_COLLECTION_NAME", None)
+    assert retriever_module.default_collection_name() == "legacy"
+
+    monkeypatch.delenv("COLLECTION_NAME")
+    assert retriever_module.default_collection_name() == "poems"
+    # 命令行不指定集合时交给 bulk_load 按同一规则取默认值
+    assert bulk_load.parse_args([]).collection is None
@@ -0,0 +1,95 @@
+"""
+查询向量请求合并：攒满立即发送、窗口到期发送、失败时所有等待方都收到异常
+"""
+import asyncio
+
+from app.rag.coalescer import EmbeddingCoalescer
+
+
+class FakeEmbedding:
+    model = "fake"
+    dimension = 2
+    max_batch_size = 10
+
+    def __init__(self, fail: bool = False):
+        self.fail = fail
+        self.calls = []
+
+    async def aembed_documents(self, documents):
+        self.calls.append(list(documents))
+        await asyncio.sleep(0)
+        if self.fail:
+            raise RuntimeError("embedding down")
+        return [[float(len(text)), float(i)] for i, text in enumerate(documents)]
+
+
+def test_full_batch_is_sent_without_waiting_for_the_window():
+    async def main():
+        embedding = FakeEmbedding()
+        # 窗口远大于测试超时，只有攒满才会发送
+        coalescer = EmbeddingCoalescer(embedding, window_ms=60_000, max_batch=3)
+        texts = ["a", "bb", "ccc"]
+        vectors = await asyncio.wait_for(
+            asyncio.gather(*(coalescer.aembed_query(text) for text in texts)), timeout=1)
+        return embedding, coalescer, vectors
+
+    embedding, coalescer, vectors = asyncio.run(main())
+    assert embedding.calls == [["a", "bb", "ccc"]]
+    assert vectors == [[1.0, 0.0], [2.0, 1.0], [3.0, 2.0]]
+    assert coalescer.full_flushes == 1
+    assert coalescer.stats()["batch_size_histogram"] == {"3": 1}
+    assert not coalescer._tasks
+
+
+def test_partial_batch_is_flushed_after_the_window():
+    async def main():
+        embedding = FakeEmbedding()
+        coalescer = EmbeddingCoalescer(embedding, window_ms=10, max_batch=10)
+        vectors = await asyncio.gather(coalescer.aembed_query("a"), coalescer.aembed_query("a"),
+                                       coalescer.aembed_query("bb"))
+        return embedding, coalescer, vectors
+
+    embedding, coalescer, vectors = asyncio.run(main())
+    # 同一批内相同文本只请求一次
+    assert embedding.calls == [["a", "bb"]]
+    assert vectors == [[1.0, 0.0], [1.0, 0.0], [2.0, 1.0]]
+    assert coalescer.full_flushes == 0
+    assert coalescer.batches == 1 and coalescer.texts == 3
+
+
+def test_failure_is_propagated_to_every_waiter():
+    async def main():
+        coalescer = EmbeddingCoalescer(FakeEmbedding(fail=True), window_ms=5, max_batch=10)
+        return await asyncio.gather(*(coalescer.aembed_query(text) for text in ["a", "b", "c"]),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert len(results) == 3
+    for result in results:
+        assert isinstance(result, RuntimeError)
+
+
+def test_batch_task_is_held_until_done():
+    async def main():
+        release = asyncio.Event()
+
+        class SlowEmbedding(FakeEmbedding):
+            async def aembed_documents(self, documents):
+                await release.wait()
+                return await super().aembed_documents(documents)
+
+        coalescer = EmbeddingCoalescer(SlowEmbedding(), window_ms=60_000, max_batch=1)
+        waiter = asyncio.ensure_future(coalescer.aembed_query("a"))
+        await asyncio.sleep(0)
+        assert len(coalescer._tasks) == 1
+        release.set()
+        assert await waiter == [1.0, 0.0]
+        await asyncio.sleep(0)
+        assert not coalescer._tasks
+
+    asyncio.run(main())
+
+
+def test_max_batch_is_capped_by_the_model():
+    coalescer = EmbeddingCoalescer(FakeEmbedding(), max_batch=100)
+    assert coalescer.max_batch == FakeEmbedding.max_batch_size
@@ -0,0 +1,39 @@
+from app.rag.context_builder import ContextBuilder, estimate_tokens
+from app.retriever import Document
+
+
+def _doc(i, similarity, content=None):
+    return Document(id=i, title=f"诗{i}", author="〔唐代〕·佚名",
+                    content=content or f"第{i}首" + "春风又绿江南岸明月何时照我还" * 3,
+                    similarity=similarity)
+
+
+def test_build_keeps_retrieval_order_with_mixed_scores():
+    # RRF分数很小、MMR重排后分数不单调，顺序都不能被 similarity 改写
+    documents = [_doc(1, 0.016), _doc(2, 0.92), _doc(3, 0.031), _doc(4, -0.2)]
+    context = ContextBuilder(budget=0).build(documents)
+    assert [d.id for d in context.documents] == [1, 2, 3, 4]
+    assert context.text.index("诗1") < context.text.index("诗2") < context.text.index("诗3")
+
+
+def test_dedup_keeps_the_earlier_ranked_duplicate():
+    content = "床前明月光\n疑是地上霜\n举头望明月\n低头思故乡"
+    documents = [_doc(1, 0.01, content), _doc(2, 0.99, content + "。"), _doc(3, 0.5)]
+    context = ContextBuilder(budget=0).build(documents)
+    assert [d.id for d in context.documents] == [1, 3]
+    assert context.duplicates == 1
+
+
+def test_allocation_follows_rank_and_drops_the_last_ranked():
+    lines = ["春眠不觉晓处处闻啼鸟", "白日依山尽黄河入海流", "千山鸟飞绝万径人踪灭"]
+    documents = [_doc(i + 1, similarity, "\n".join([line] * 20))
+                 for i, (line, similarity) in enumerate(zip(lines, [0.01, 0.99, 0.5]))]
+    builder = ContextBuilder(budget=200, min_doc_tokens=48)
+    limits = builder.allocate(documents)
+    assert limits[0] > limits[1]
+    assert limits[2] is None
+
+    context = builder.build(documents)
+    assert [d.id for d in context.documents] == [1, 2]
+    assert context.dropped == 1
+    assert context.tokens <= 200 + estimate_tokens("\n\n")
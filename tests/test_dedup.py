@@ -0,0 +1,32 @@
+import sqlite3
+
+from app.crawler.dedup import SeenStore, with_hashes
+
+POEMS = with_hashes([{"title": "静夜思", "author": "〔唐代〕·李白", "content": "床前明月光"}])
+
+
+def test_records_are_scoped_by_backend_and_collection(tmp_path):
+    path = str(tmp_path / "seen.sqlite3")
+    milvus, local = SeenStore("milvus:localhost:19530/poems", path), SeenStore("local:/data/poems", path)
+    milvus.mark(POEMS)
+
+    assert milvus.classify(POEMS)[1] == POEMS
+    # 另一个集合还没有写入过这首诗
+    assert local.classify(POEMS)[0] == POEMS
+
+    local.mark(POEMS)
+    milvus.clear()
+    assert milvus.classify(POEMS)[0] == POEMS
+    assert local.classify(POEMS)[1] == POEMS
+
+
+def test_unscoped_records_are_dropped(tmp_path):
+    path = str(tmp_path / "seen.sqlite3")
+    db = sqlite3.connect(path)
+    db.execute("CREATE TABLE seen (id INTEGER PRIMARY KEY, content_hash TEXT NOT NULL, updated_at INTEGER NOT NULL)")
+    db.execute("INSERT INTO seen VALUES (?, ?, 0)", (POEMS[0]["id"], POEMS[0]["content_hash"]))
+    db.commit()
+    db.close()
+
+    store = SeenStore("local:/data/poems", path)
+    assert store.classify(POEMS)[0] == POEMS
@@ -0,0 +1,116 @@
+"""
+查询向量缓存：LRU容量淘汰、TTL过期、SQLite持久化后重新加载，以及包装模型只请求未命中的文本
+"""
+import asyncio
+
+import pytest
+
+from app.rag import embedding_cache
+from app.rag.embedding_cache import CachedEmbedding, EmbeddingCache
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def time(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(embedding_cache.time, "time", clock.time)
+    return clock
+
+
+def test_least_recently_used_entry_is_evicted(clock):
+    cache = EmbeddingCache(max_size=2, ttl=60)
+    cache.set("a", [1.0])
+    cache.set("b", [2.0])
+    assert cache.get("a") == [1.0]
+    cache.set("c", [3.0])
+    assert cache.get("b") is None
+    assert cache.get("a") == [1.0]
+    assert cache.get("c") == [3.0]
+    assert cache.stats()["size"] == 2
+
+
+def test_entries_expire_after_ttl(clock):
+    cache = EmbeddingCache(max_size=10, ttl=60)
+    cache.set("a", [1.0])
+    clock.now += 59
+    assert cache.get("a") == [1.0]
+    clock.now += 2
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert (stats["hits"], stats["misses"], stats["size"]) == (1, 1, 0)
+
+
+def test_zero_vectors_are_not_cached(clock):
+    cache = EmbeddingCache(max_size=10, ttl=60)
+    cache.set("a", [0.0, 0.0])
+    cache.set("b", [])
+    assert cache.get("a") is None and cache.get("b") is None
+
+
+def test_persisted_entries_are_reloaded_by_a_new_cache(tmp_path, clock):
+    path = str(tmp_path / "cache" / "embeddings.sqlite3")
+    EmbeddingCache(max_size=10, ttl=60, path=path).set("a", [0.5, -0.25])
+
+    # 另一个进程（或重启后）内存为空，从SQLite读取
+    reloaded = EmbeddingCache(max_size=10, ttl=60, path=path)
+    assert reloaded.stats()["size"] == 0
+    assert reloaded.get("a") == [0.5, -0.25]
+    assert reloaded.stats()["size"] == 1
+
+    clock.now += 61
+    assert EmbeddingCache(max_size=10, ttl=60, path=path).get("a") is None
+
+
+def test_persistent_store_is_pruned_to_max_size(tmp_path, clock, monkeypatch):
+    monkeypatch.setattr(EmbeddingCache, "_PRUNE_INTERVAL", 1)
+    cache = EmbeddingCache(max_size=2, ttl=60, path=str(tmp_path / "embeddings.sqlite3"))
+    for i in range(5):
+        clock.now += 1
+        cache.set(f"k{i}", [float(i + 1)])
+    rows = cache._db.execute("SELECT key FROM embeddings ORDER BY expires_at").fetchall()
+    assert [key for key, in rows] == ["k3", "k4"]
+
+
+def test_keys_are_normalized():
+    key = EmbeddingCache.make_key("m", 8, "床前　明月光 ")
+    assert key == EmbeddingCache.make_key("m", 8, "床前 明月光")
+    assert key != EmbeddingCache.make_key("m", 16, "床前 明月光")
+
+
+class FakeEmbedding:
+    model = "fake"
+    dimension = 1
+
+    def __init__(self):
+        self.requested = []
+
+    def embed_query(self, text):
+        self.requested.append([text])
+        return [float(len(text))]
+
+    def embed_documents(self, documents):
+        self.requested.append(list(documents))
+        return [[float(len(text))] for text in documents]
+
+    async def aembed_query(self, text):
+        return self.embed_query(text)
+
+    async def aembed_documents(self, documents):
+        return self.embed_documents(documents)
+
+
+def test_cached_embedding_only_requests_misses_in_order():
+    model = FakeEmbedding()
+    embedding = CachedEmbedding(model, EmbeddingCache(max_size=10, ttl=60))
+    assert embedding.embed_query("ab") == [2.0]
+    assert embedding.embed_documents(["abc", "ab", "a"]) == [[3.0], [2.0], [1.0]]
+    assert asyncio.run(embedding.aembed_documents(["a", "abcd"])) == [[1.0], [4.0]]
+    assert asyncio.run(embedding.aembed_query("abc")) == [3.0]
+    assert model.requested == [["ab"], ["abc", "a"], ["abcd"]]
@@ -0,0 +1,113 @@
+"""
+并发分页抓取：按主机的令牌桶限速、分页URL生成、空页之后的页不再请求
+"""
+import pytest
+import requests
+
+from app.crawler import fetcher
+from app.crawler.fetcher import HostRateLimiter, TokenBucket, fetch_listings, listing_urls
+
+
+class FakeClock:
+    """代替 time 模块：sleep 只推进时钟"""
+
+    def __init__(self):
+        self.now = 100.0
+        self.slept = []
+
+    def monotonic(self):
+        return self.now
+
+    def perf_counter(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.slept.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(fetcher, "time", clock)
+    return clock
+
+
+def test_bucket_allows_a_burst_then_waits_for_refill(clock):
+    bucket = TokenBucket(rate=2, capacity=3)
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() == pytest.approx(0.5)
+    # 预订制：紧接着的请求排在上一个之后
+    assert bucket.acquire() == pytest.approx(0.5)
+    clock.now += 10
+    # 空闲期间最多积累 capacity 个令牌
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.0]
+    assert bucket.acquire() > 0
+
+
+def test_zero_rate_means_unlimited(clock):
+    bucket = TokenBucket(rate=0, capacity=1)
+    assert [bucket.acquire() for _ in range(5)] == [0.0] * 5
+    assert clock.slept == []
+
+
+def test_hosts_have_separate_buckets(clock):
+    limiter = HostRateLimiter(rate=1, burst=1)
+    assert limiter.acquire("https://www.gushiwen.cn/a") == 0.0
+    assert limiter.acquire("https://so.gushiwen.cn/b") == 0.0
+    assert limiter.acquire("https://www.gushiwen.cn/c") == pytest.approx(1.0)
+
+
+def test_listing_urls():
+    listings = listing_urls(max_pages=2, authors=["李白"], tags=[], collect=False)
+    assert listings == {
+        "home": ["https://www.gushiwen.cn", "https://www.gushiwen.cn/default_2.aspx"],
+        "author:李白": [
+            "https://so.gushiwen.cn/shiwens/default.aspx?astr=%E6%9D%8E%E7%99%BD&page=1",
+            "https://so.gushiwen.cn/shiwens/default.aspx?astr=%E6%9D%8E%E7%99%BD&page=2",
+        ],
+    }
+    assert len(listing_urls(max_pages=3, authors=[], tags=["春天"])["collect"]) == 3
+
+
+def _page(*titles):
+    return "".join(
+        f'<div class="sons"><p>{title}</p><p class="source"><a>李白</a><a>〔唐代〕</a></p>'
+        f'<div class="contson">床前明月光</div></div>'
+        for title in titles
+    )
+
+
+class StubResponse:
+    def __init__(self, html):
+        self.text = html
+        self.encoding = "utf-8"
+        self.apparent_encoding = "utf-8"
+
+    def raise_for_status(self):
+        if self.text is None:
+            raise requests.HTTPError("404")
+
+
+class StubSession:
+    """按URL返回预设页面，没有预设的页面返回404"""
+
+    def __init__(self, pages):
+        self.pages = pages
+        self.requested = []
+
+    def get(self, url, headers=None):
+        self.requested.append(url)
+        return StubResponse(self.pages.get(url))
+
+
+def test_empty_page_stops_the_listing_and_poems_are_deduplicated():
+    listings = {"a": ["a1", "a2", "a3", "a4"], "b": ["b1", "b2"]}
+    session = StubSession({"a1": _page("静夜思", "望庐山瀑布"), "a2": _page(), "b1": _page("静夜思")})
+    # 单线程按页号交错提交：a1 b1 a2 b2 a3 a4
+    poems, stats = fetch_listings(session, listings, concurrency=1, limiter=HostRateLimiter(rate=0))
+
+    assert session.requested == ["a1", "b1", "a2", "b2"]
+    assert stats == {"pages": 3, "failed": 1, "skipped": 2}
+    assert sorted(poem["title"] for poem in poems) == ["望庐山瀑布", "静夜思"]
+    assert poems[0]["author"] == "〔唐代〕·李白"
@@ -0,0 +1,85 @@
+import asyncio
+import json
+import time
+
+import pytest
+
+from app.api import deps
+from app.api.routes import ready
+from app.scheduler.leader import LeaderLock
+
+
+@pytest.fixture
+def fresh_deps(monkeypatch):
+    for name, value in (("_rag", None), ("_rag_lock", None), ("_last_error", None),
+                        ("_last_attempt", 0.0), ("_init_task", None)):
+        monkeypatch.setattr(deps, name, value)
+    return deps
+
+
+async def _status():
+    response = await ready()
+    return response.status_code, json.loads(response.body)
+
+
+def test_readiness_returns_503_immediately_then_200(fresh_deps, monkeypatch):
+    def slow_rag():
+        time.sleep(0.3)
+        return object()
+
+    monkeypatch.setattr(deps, "RAG", slow_rag)
+
+    async def main():
+        start = time.perf_counter()
+        status, body = await _status()
+        # 不等待初始化完成
+        assert time.perf_counter() - start < 0.1
+        assert status == 503 and body["ready"] is False
+        await asyncio.sleep(0.05)
+        status, body = await _status()
+        assert status == 503 and body["initializing"] is True
+
+        await asyncio.wait_for(deps._init_task, 2)
+        status, body = await _status()
+        assert status == 200 and body == {"ready": True, "initializing": False, "error": None}
+
+    asyncio.run(main())
+
+
+def test_failed_init_is_retried_after_interval(fresh_deps, monkeypatch):
+    attempts = []
+
+    def failing_rag():
+        attempts.append(1)
+        raise ConnectionError("Milvus连接失败")
+
+    monkeypatch.setattr(deps, "RAG", failing_rag)
+
+    async def main():
+        await _status()
+        await deps._init_task
+        status, body = await _status()
+        assert status == 503 and body["error"] == "Milvus连接失败"
+        # 重试间隔内的探针不再发起初始化
+        assert len(attempts) == 1
+        monkeypatch.setattr(deps, "_last_attempt", time.monotonic() - deps.RAG_INIT_RETRY_INTERVAL)
+        await _status()
+        await deps._init_task
+        assert len(attempts) == 2
+
+    asyncio.run(main())
+
+
+def test_only_one_leader_lock_holder(tmp_path):
+    path = str(tmp_path / "scheduler.lock")
+    first, second = LeaderLock(path), LeaderLock(path)
+    assert first.try_acquire() and first.is_leader
+    assert not second.try_acquire() and not second.is_leader
+    # 已持有时再次获取直接成功
+    assert first.try_acquire()
+
+    first.release()
+    assert second.try_acquire() and second.is_leader
+    with open(path) as f:
+        assert f.read().strip().isdigit()
+    second.release()
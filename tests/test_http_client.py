@@ -0,0 +1,95 @@
+"""
+共享HTTP客户端：命名Session的复用与重试策略、按事件循环缓存的异步客户端、连接池统计、异步退避重试
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from app.net import http_client
+
+
+@pytest.fixture
+def fresh_clients(monkeypatch):
+    monkeypatch.setattr(http_client, "_sessions", {})
+    monkeypatch.setattr(http_client, "_async_clients", http_client.weakref.WeakKeyDictionary())
+    monkeypatch.setattr(http_client, "_counters", {})
+
+
+def _retries_post(session) -> bool:
+    return "POST" in session.get_adapter("https://example.com").max_retries.allowed_methods
+
+
+def test_named_session_is_shared(fresh_clients):
+    session = http_client.get_session("svc")
+    assert http_client.get_session("svc") is session
+    assert _retries_post(session)
+    assert session.default_timeout == (http_client.HTTP_CONNECT_TIMEOUT, http_client.HTTP_READ_TIMEOUT)
+
+
+def test_reusing_a_session_with_another_retry_policy_raises(fresh_clients):
+    session = http_client.get_session("captcha", retry_post=False)
+    assert not _retries_post(session)
+    assert http_client.get_session("captcha", retry_post=False) is session
+    with pytest.raises(ValueError):
+        http_client.get_session("captcha")
+
+
+def test_async_client_is_shared_within_a_loop_only(fresh_clients):
+    async def get_twice():
+        first = http_client.get_async_client("svc")
+        assert http_client.get_async_client("svc") is first
+        await first.aclose()
+        return first
+
+    assert asyncio.run(get_twice()) is not asyncio.run(get_twice())
+
+
+def test_async_client_requires_a_running_loop(fresh_clients):
+    with pytest.raises(RuntimeError):
+        http_client.get_async_client("svc")
+
+
+def test_pool_stats_tolerates_missing_internals(fresh_clients):
+    http_client.get_session("svc")
+
+    async def main():
+        client = http_client.get_async_client("svc")
+        healthy = http_client.pool_stats()
+        # 模拟 httpx 内部结构变化
+        transport, client._transport = client._transport, object()
+        broken = http_client.pool_stats()
+        client._transport = transport
+        await client.aclose()
+        return healthy, broken
+
+    healthy, broken = asyncio.run(main())
+    assert healthy["svc"] == {"pools": {}}
+    assert healthy["svc:async"]["pool"] == {"max_connections": http_client.HTTP_POOL_MAXSIZE,
+                                            "connections": 0, "idle": 0}
+    assert broken["svc:async"]["pool"] == {"max_connections": http_client.HTTP_POOL_MAXSIZE}
+
+
+def test_arequest_with_retry_backs_off_on_retryable_status(fresh_clients, monkeypatch):
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_FACTOR", 0)
+    monkeypatch.setattr(http_client, "HTTP_BACKOFF_JITTER", 0)
+    statuses = [503, 429, 200]
+
+    def handler(request):
+        return httpx.Response(statuses.pop(0))
+
+    async def main():
+        async with httpx.AsyncClient(transport=httpx.MockTransport(handler)) as client:
+            return await http_client.arequest_with_retry(client, "POST", "https://example.com/embed")
+
+    assert asyncio.run(main()).status_code == 200
+    assert not statuses
+    assert http_client._counters["unnamed:async"]["retries"] == 2
+
+
+def test_jitter_is_added_to_backoff():
+    retry = http_client.JitterRetry(total=3, backoff_factor=1).increment(method="GET", url="/")
+    retry = retry.increment(method="GET", url="/")
+    base = http_client.Retry(total=3, backoff_factor=1).increment(method="GET", url="/").increment(
+        method="GET", url="/").get_backoff_time()
+    assert base <= retry.get_backoff_time() <= base + http_client.JitterRetry.jitter
@@ -0,0 +1,83 @@
+"""
+向量索引配置：环境变量 > 配置文件 > 默认值 的优先顺序，以及单次请求检索参数的校验
+"""
+import json
+
+import pytest
+
+from app.retriever import index_config
+from app.retriever.index_config import IndexConfig, load_index_config, validate_search_params
+
+
+@pytest.fixture
+def no_env(monkeypatch):
+    for name in ("MILVUS_INDEX_TYPE", "MILVUS_INDEX_PARAMS", "MILVUS_SEARCH_PARAMS"):
+        monkeypatch.setattr(index_config, name, None)
+    return monkeypatch
+
+
+@pytest.fixture
+def tuned(tmp_path):
+    """调优命令写入的配置文件"""
+    path = tmp_path / "milvus_index.json"
+    IndexConfig.for_type("HNSW", {"M": 32}, {"ef": 128}).save(str(path))
+    return str(path)
+
+
+def test_defaults_without_file_or_env(tmp_path, no_env):
+    config = load_index_config(str(tmp_path / "missing.json"))
+    assert (config.index_type, config.build_params, config.search_params) == ("IVF_FLAT", {"nlist": 128}, {"nprobe": 10})
+
+
+def test_file_overrides_defaults(tuned, no_env):
+    config = load_index_config(tuned)
+    assert config.index_type == "HNSW"
+    # 文件中没有的参数按该索引类型的默认值补全
+    assert config.build_params == {"M": 32, "efConstruction": 200}
+    assert config.search_params == {"ef": 128}
+
+
+def test_env_search_params_override_file(tuned, no_env):
+    no_env.setattr(index_config, "MILVUS_SEARCH_PARAMS", json.dumps({"ef": 256}))
+    config = load_index_config(tuned)
+    assert config.index_type == "HNSW"
+    assert config.build_params == {"M": 32, "efConstruction": 200}
+    assert config.search_params == {"ef": 256}
+
+
+def test_env_index_type_discards_file_params_of_another_type(tuned, no_env):
+    no_env.setattr(index_config, "MILVUS_INDEX_TYPE", "ivf_sq8")
+    config = load_index_config(tuned)
+    assert (config.index_type, config.build_params, config.search_params) == ("IVF_SQ8", {"nlist": 128}, {"nprobe": 10})
+
+
+def test_invalid_file_falls_back_to_defaults(tmp_path, no_env):
+    path = tmp_path / "milvus_index.json"
+    path.write_text(json.dumps({"index_type": "NO_SUCH_INDEX"}))
+    assert load_index_config(str(path)).index_type == "IVF_FLAT"
+
+
+def test_request_overrides_only_apply_to_the_index_type():
+    config = IndexConfig.for_type("IVF_FLAT")
+    assert config.search_param({"nprobe": 32, "ef": 512}) == {"metric_type": "IP", "params": {"nprobe": 32}}
+    assert config.index_params() == {"metric_type": "IP", "index_type": "IVF_FLAT", "params": {"nlist": 128}}
+
+
+@pytest.mark.parametrize("params", [None, {}, {"nprobe": 32}, {"ef": 32768}, {"rerank_multiplier": 4}])
+def test_valid_search_params(params):
+    assert validate_search_params(params) == params
+
+
+@pytest.mark.parametrize("params", [{"nlist": 8}, {"nprobe": 0}, {"ef": 32769}, {"nprobe": "8"}, {"ef": 1.5}])
+def test_invalid_search_params(params):
+    with pytest.raises(ValueError):
+        validate_search_params(params)
+
+
+def test_query_request_rejects_invalid_search_params():
+    from pydantic import ValidationError
+    from app.api.routes import QueryRequest
+
+    assert QueryRequest(query="明月", search_params={"nprobe": 16}).search_params == {"nprobe": 16}
+    with pytest.raises(ValidationError):
+        QueryRequest(query="明月", search_params={"nprobe": 0})
@@ -0,0 +1,74 @@
+"""
+入库向量化：按模型上限分批并发请求、结果按输入顺序还原、失败只在入库这一层按批重试
+"""
+import random
+import threading
+import time
+
+from app.crawler import ingest
+from app.rag.rag import DashScopeEmbedding
+
+
+class FakeEmbedding:
+    max_batch_size = 4
+
+    def __init__(self, failures=None):
+        # 文本 -> 该文本所在批次还要失败的次数
+        self.failures = dict(failures or {})
+        self.batches = []
+        self._lock = threading.Lock()
+
+    def request_embeddings(self, texts):
+        with self._lock:
+            self.batches.append(list(texts))
+            failing = [text for text in texts if self.failures.get(text)]
+            for text in failing:
+                self.failures[text] -= 1
+        # 打乱各批完成的先后顺序
+        time.sleep(random.uniform(0, 0.01))
+        if failing:
+            raise RuntimeError(f"batch failed: {failing}")
+        return [[float(text)] for text in texts]
+
+
+def test_batches_follow_the_model_limit_and_results_keep_input_order():
+    texts = [str(i) for i in range(10)]
+    model = FakeEmbedding()
+    vectors = ingest.embed_texts(model, texts, batch_size=100, concurrency=4, retries=0)
+    assert vectors == [[float(i)] for i in range(10)]
+    assert sorted(len(batch) for batch in model.batches) == [2, 4, 4]
+
+
+def test_failed_batch_is_retried_as_a_whole(monkeypatch):
+    monkeypatch.setattr(ingest.time, "sleep", lambda seconds: None)
+    texts = [str(i) for i in range(6)]
+    model = FakeEmbedding(failures={"4": 2})
+    vectors = ingest.embed_texts(model, texts, batch_size=3, concurrency=2, retries=2)
+    assert vectors == [[float(i)] for i in range(6)]
+    # 只有出错的那一批被重试，整批重新请求
+    assert model.batches.count(["3", "4", "5"]) == 3
+    assert model.batches.count(["0", "1", "2"]) == 1
+
+
+def test_exhausted_retries_leave_only_that_batch_empty(monkeypatch):
+    monkeypatch.setattr(ingest.time, "sleep", lambda seconds: None)
+    texts = [str(i) for i in range(6)]
+    model = FakeEmbedding(failures={"1": 10})
+    vectors = ingest.embed_texts(model, texts, batch_size=3, concurrency=2, retries=1)
+    assert vectors == [None, None, None, [3.0], [4.0], [5.0]]
+    assert model.batches.count(["0", "1", "2"]) == 2
+
+
+def test_empty_input():
+    assert ingest.embed_texts(FakeEmbedding(), []) == []
+
+
+def _retries_post(session) -> bool:
+    return "POST" in session.get_adapter("https://dashscope.aliyuncs.com").max_retries.allowed_methods
+
+
+def test_batch_requests_are_not_retried_by_the_session():
+    embedding = DashScopeEmbedding(api_key="test")
+    # 入库按批重试，会话层不再重试；查询路径仍由会话重试
+    assert not _retries_post(embedding.batch_session)
+    assert _retries_post(embedding.session)
@@ -0,0 +1,82 @@
+from app.retriever import Document
+from app.retriever import lexical
+from app.retriever.lexical import LexicalIndex, reciprocal_rank_fusion, tokenize
+
+POEMS = [
+    (1, "静夜思", "〔唐代〕·李白", "床前明月光，疑是地上霜。举头望明月，低头思故乡。"),
+    (2, "春晓", "〔唐代〕·孟浩然", "春眠不觉晓，处处闻啼鸟。夜来风雨声，花落知多少。"),
+    (3, "水调歌头", "〔宋代〕·苏轼", "明月几时有？把酒问青天。不知天上宫阙，今夕是何年。"),
+    (4, "江雪", "〔唐代〕·柳宗元", "千山鸟飞绝，万径人踪灭。孤舟蓑笠翁，独钓寒江雪。"),
+]
+
+
+def _index(path=None):
+    index = LexicalIndex(path)
+    index.add_many(POEMS)
+    return index
+
+
+def test_tokenize_emits_unigrams_and_bigrams_within_punctuation():
+    assert tokenize("明月，光") == ["明", "月", "明月", "光"]
+
+
+def test_bm25_ranks_matching_documents():
+    documents = _index().search("明月", top_k=3)
+    assert [d.id for d in documents][:2] == [1, 3]
+    assert documents[0].similarity == 1.0
+    # 不含查询词的文档不返回
+    assert _index().search("黄河", top_k=3) == []
+
+
+def test_title_and_author_are_weighted():
+    assert [d.id for d in _index().search("苏轼", top_k=1)] == [3]
+    assert [d.id for d in _index().search("江雪", top_k=1)] == [4]
+
+
+def test_updated_document_replaces_old_version(tmp_path):
+    index = _index(str(tmp_path / "lexical.pkl"))
+    index.add(4, "江雪", "〔唐代〕·柳宗元", "黄河远上白云间")
+    assert [d.id for d in index.search("黄河", top_k=3)] == [4]
+    assert index.search("蓑笠", top_k=3) == []
+    assert len(index) == 4
+
+    index.save()
+    reloaded = LexicalIndex(index.path)
+    assert [d.id for d in reloaded.search("黄河", top_k=3)] == [4]
+    assert reloaded.search("蓑笠", top_k=3) == []
+
+
+def _doc(doc_id, similarity):
+    return Document(id=doc_id, title=f"诗{doc_id}", content="", similarity=similarity)
+
+
+def test_rrf_rewards_documents_ranked_by_both_lists():
+    vector = [_doc(1, 0.9), _doc(2, 0.8), _doc(3, 0.7)]
+    lexical = [_doc(3, 1.0), _doc(1, 0.5), _doc(4, 0.2)]
+    fused = reciprocal_rank_fusion([vector, lexical], top_k=4)
+    assert [d.id for d in fused] == [1, 3, 2, 4]
+    # 文档取自第一次出现的列表，保留向量检索的相似度
+    assert fused[1].similarity == 0.7
+    assert len(reciprocal_rank_fusion([vector, lexical], top_k=2)) == 2
+
+
+class FakeRetriever:
+    def __init__(self, scope, documents):
+        self.scope = scope
+        self.documents = documents
+
+    def iter_documents(self, batch_size=1000):
+        return iter(self.documents)
+
+
+def test_indexes_are_scoped_by_retriever(tmp_path, monkeypatch):
+    monkeypatch.setattr(lexical, "LEXICAL_INDEX_DIR", str(tmp_path))
+    milvus = FakeRetriever("milvus:localhost:19530/poems", POEMS[:2])
+    local = FakeRetriever("local:/data/local_index/poems", POEMS[2:])
+
+    assert lexical.lexical_index_path(milvus.scope) != lexical.lexical_index_path(local.scope)
+    assert lexical.rebuild_lexical_index(milvus) is lexical.lexical_index_for(milvus)
+    lexical.rebuild_lexical_index(local)
+    # 另一个集合的文档不会出现在结果中
+    assert [d.id for d in lexical.lexical_index_for(milvus).search("明月", top_k=5)] == [1]
+    assert [d.id for d in lexical.lexical_index_for(local).search("明月", top_k=5)] == [3]
@@ -0,0 +1,126 @@
+import numpy as np
+import pytest
+
+from app.retriever import local_index
+from app.retriever.local_index import LocalRetriever
+from app.retriever.retriever import SearchFilter
+
+DIM = 64
+AUTHORS = ["〔唐代〕·李白", "〔唐代〕·杜甫", "〔宋代〕·苏轼", "〔宋代〕·李清照"]
+
+
+def _vectors(n, seed=0):
+    vectors = np.random.default_rng(seed).standard_normal((n, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def _entities(vectors, start=0):
+    return [
+        {"id": start + i, "title": f"诗{start + i}", "author": AUTHORS[(start + i) % len(AUTHORS)],
+         "content": f"内容{start + i}", "created_at": 1000 + start + i, "embedding": vector.tolist()}
+        for i, vector in enumerate(vectors)
+    ]
+
+
+@pytest.fixture
+def corpus():
+    return _vectors(500)
+
+
+def _retriever(tmp_path, corpus, dtype="float32"):
+    retriever = LocalRetriever(index_dir=str(tmp_path / dtype), dim=DIM, dtype=dtype)
+    retriever.upsert(_entities(corpus), flush=False)
+    return retriever
+
+
+def test_filtered_search_matches_brute_force(tmp_path, corpus):
+    retriever = _retriever(tmp_path, corpus)
+    query = _vectors(1, seed=1)[0]
+    filters = SearchFilter(dynasty="宋代", created_after=1100)
+    documents = retriever.search(query.tolist(), top_k=5, filters=filters)
+
+    allowed = [i for i in range(len(corpus)) if i % 4 >= 2 and 1000 + i >= 1100]
+    expected = sorted(allowed, key=lambda i: -float(corpus[i] @ query))[:5]
+    assert [d.id for d in documents] == expected
+
+
+def test_scoring_runs_outside_the_lock(tmp_path, corpus, monkeypatch):
+    retriever = _retriever(tmp_path, corpus)
+    scoring = local_index.approximate_scores
+    locked = []
+
+    def spy(*args, **kwargs):
+        locked.append(retriever._lock.locked())
+        return scoring(*args, **kwargs)
+
+    monkeypatch.setattr(local_index, "approximate_scores", spy)
+    retriever.search_many(_vectors(2, seed=2).tolist(), top_k=3)
+    retriever.search_many_with_vectors(_vectors(2, seed=2).tolist(), top_k=3,
+                                       filters=SearchFilter(author="李白"))
+    assert locked == [False, False]
+
+
+def test_filters_see_rows_rewritten_by_another_process(tmp_path, corpus):
+    retriever = _retriever(tmp_path, corpus)
+    query = corpus[0].tolist()
+    assert retriever.search(query, top_k=1, filters=SearchFilter(author="李白"))[0].id == 0
+
+    # 另一个进程（独立的SQLite连接）把第0首改成苏轼的诗
+    writer = LocalRetriever(index_dir=retriever.index_dir, dim=DIM)
+    entity = _entities(corpus[:1])[0]
+    writer.upsert([dict(entity, author="〔宋代〕·苏轼")], flush=False)
+
+    assert retriever.search(query, top_k=1, filters=SearchFilter(author="苏轼"))[0].id == 0
+    assert all(d.id != 0 for d in retriever.search(query, top_k=5, filters=SearchFilter(author="李白")))
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_encoding_round_trip_is_close(storage, corpus):
+    codes, scales = local_index.encode_vectors(corpus, storage)
+    decoded = local_index.decode_vectors(codes, scales, storage)
+    assert np.abs(decoded - corpus).max() < 0.01
+
+
+def test_binary_scores_follow_hamming_distance():
+    vectors = np.array([[1, 1, 1, 1, 1, 1, 1, 1], [1, 1, 1, 1, -1, -1, -1, -1], [-1] * 8], dtype=np.float32)
+    codes, _ = local_index.encode_vectors(vectors, "binary")
+    scores = local_index.approximate_scores(codes, None, vectors[:1], "binary")[:, 0]
+    assert scores.tolist() == [1.0, 0.0, -1.0]
+
+
+def test_rerank_restores_exact_order_from_candidates(corpus):
+    queries = _vectors(4, seed=3)
+    exact = corpus @ queries.T
+    # 粗排分数加上噪声，只要真正的 top_k 在候选内，重排后与精确结果一致
+    noisy = exact + np.random.default_rng(4).normal(0, 0.02, exact.shape).astype(np.float32)
+    for column, (rows, scores) in enumerate(local_index.select_top_k(noisy, 5, candidates=100, full=corpus,
+                                                                     queries=queries)):
+        expected = np.argsort(-exact[:, column])[:5]
+        assert rows.tolist() == expected.tolist()
+        assert np.allclose(scores, exact[expected, column])
+
+
+@pytest.mark.parametrize("storage", ["float16", "int8"])
+def test_compact_storage_with_rerank_matches_float32(tmp_path, corpus, storage):
+    exact, compact = _retriever(tmp_path, corpus), _retriever(tmp_path, corpus, dtype=storage)
+    assert compact.rerank
+    queries = _vectors(10, seed=5).tolist()
+    for expected, actual in zip(exact.search_many(queries, top_k=5),
+                                compact.search_many(queries, top_k=5, search_params={"rerank_multiplier": 20})):
+        assert [d.id for d in actual] == [d.id for d in expected]
+        # 重排后的相似度来自全精度内积
+        assert np.allclose([d.similarity for d in actual], [d.similarity for d in expected], atol=1e-5)
+    assert compact.memory_bytes()["resident"] <= exact.memory_bytes()["resident"] / 2
+
+
+def test_binary_storage_rerank_improves_recall(tmp_path, corpus):
+    exact, binary = _retriever(tmp_path, corpus), _retriever(tmp_path, corpus, dtype="binary")
+    queries = _vectors(20, seed=6).tolist()
+    expected = [{d.id for d in docs} for docs in exact.search_many(queries, top_k=5)]
+
+    def recall(rerank_multiplier):
+        results = binary.search_many(queries, top_k=5, search_params={"rerank_multiplier": rerank_multiplier})
+        return np.mean([len(truth & {d.id for d in docs}) / 5 for truth, docs in zip(expected, results)])
+
+    assert recall(20) >= 0.9
+    assert recall(20) > recall(1)
@@ -0,0 +1,134 @@
+"""
+爬虫登录态：用桩会话模拟收藏夹页面的跳转，验证登录判断与cookie复用/重新登录流程
+"""
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from app.crawler import login
+
+LOGIN_PAGE = "https://www.gushiwen.cn/user/login.aspx?from=" + login.COLLECT_URL
+LOGIN_HTML = """
+<input id="__VIEWSTATE" value="vs"/>
+<input id="__VIEWSTATEGENERATOR" value="gen"/>
+<img id="imgCode" src="/RandCode.ashx"/>
+"""
+
+
+class StubSession:
+    """按请求地址返回预设响应；collect 为收藏夹页面跟随跳转后的 (状态码, 最终地址)"""
+
+    def __init__(self, collect):
+        self.collect = list(collect)
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.requests = []
+        self.posts = []
+
+    def get(self, url, headers=None, allow_redirects=True):
+        self.requests.append((url, allow_redirects))
+        if url == login.COLLECT_URL:
+            status, final_url = self.collect.pop(0) if len(self.collect) > 1 else self.collect[0]
+            return SimpleNamespace(status_code=status, url=final_url, history=[], text="")
+        if url == login.LOGIN_URL:
+            return SimpleNamespace(status_code=200, url=url, text=LOGIN_HTML)
+        return SimpleNamespace(status_code=200, url=url, content=b"img")
+
+    def post(self, url, headers=None, data=None):
+        self.posts.append(data)
+        return SimpleNamespace(status_code=200, url=url)
+
+
+class StubChaojiying:
+    reported = []
+
+    def __init__(self, *args):
+        pass
+
+    def PostPic(self, im, codetype):
+        return {"pic_str": "abcd", "pic_id": "42"}
+
+    def ReportError(self, pic_id):
+        StubChaojiying.reported.append(pic_id)
+
+
+def test_collect_page_is_requested_over_https():
+    session = StubSession([(200, login.COLLECT_URL)])
+    assert login.is_logged_in(session)
+    url, allow_redirects = session.requests[0]
+    assert url.startswith("https://")
+    assert allow_redirects
+
+
+def test_redirect_to_login_page_is_logged_out():
+    assert not login.is_logged_in(StubSession([(200, LOGIN_PAGE)]))
+
+
+def test_error_status_is_logged_out():
+    assert not login.is_logged_in(StubSession([(500, login.COLLECT_URL)]))
+
+
+def test_request_failure_is_logged_out():
+    class Broken(StubSession):
+        def get(self, *args, **kwargs):
+            raise requests.ConnectionError("boom")
+
+    assert not login.is_logged_in(Broken([]))
+
+
+def test_saved_cookie_is_reused(tmp_path, monkeypatch):
+    path = tmp_path / "cookies.json"
+    path.write_text(json.dumps([{"name": "login", "value": "1", "domain": "www.gushiwen.cn", "path": "/",
+                                 "expires": time.time() + 3600, "secure": True}]))
+
+    def fake_captcha_login(session, headers=None):
+        pytest.fail("cookie有效时不应重新登录")
+
+    monkeypatch.setattr(login, "captcha_login", fake_captcha_login)
+
+    session = StubSession([(200, login.COLLECT_URL)])
+    assert login.ensure_login(session, path=str(path))
+
+
+def test_expired_cookie_falls_back_to_captcha_login(tmp_path, monkeypatch):
+    path = tmp_path / "cookies.json"
+    path.write_text(json.dumps([{"name": "login", "value": "old", "domain": "www.gushiwen.cn", "path": "/",
+                                 "expires": time.time() + 3600, "secure": True}]))
+    calls = []
+
+    def fake_captcha_login(session, headers=None):
+        calls.append(session)
+        session.cookies.set("login", "new", domain="www.gushiwen.cn", path="/")
+        return True
+
+    monkeypatch.setattr(login, "captcha_login", fake_captcha_login)
+    # 旧cookie已被服务端作废：收藏夹页面跳回登录页
+    session = StubSession([(200, LOGIN_PAGE)])
+    assert login.ensure_login(session, path=str(path))
+    assert calls == [session]
+    assert json.loads(path.read_text())[0]["value"] == "new"
+
+
+def test_wrong_captcha_is_reported_and_retried(monkeypatch):
+    StubChaojiying.reported = []
+    monkeypatch.setattr(login, "Chaojiying_Client", StubChaojiying)
+    monkeypatch.setattr(login, "CRAWL_LOGIN_ATTEMPTS", 2)
+
+    session = StubSession([(200, LOGIN_PAGE)])
+    assert not login.captcha_login(session)
+    assert len(session.posts) == 2
+    assert session.posts[0]["from"] == login.COLLECT_URL
+    assert StubChaojiying.reported == ["42", "42"]
+
+
+def test_captcha_login_succeeds_after_one_wrong_solve(monkeypatch):
+    StubChaojiying.reported = []
+    monkeypatch.setattr(login, "Chaojiying_Client", StubChaojiying)
+    monkeypatch.setattr(login, "CRAWL_LOGIN_ATTEMPTS", 3)
+
+    session = StubSession([(200, LOGIN_PAGE), (200, login.COLLECT_URL)])
+    assert login.captcha_login(session)
+    assert len(session.posts) == 2
+    assert StubChaojiying.reported == ["42"]
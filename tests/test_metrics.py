@@ -0,0 +1,73 @@
+"""
+运行时指标：中间件按路由模板统计请求耗时、写入 Server-Timing，/metrics 输出Prometheus文本格式
+"""
+import re
+
+from fastapi import APIRouter, FastAPI
+from fastapi.testclient import TestClient
+
+from app.api.metrics import router as metrics_router
+from app.metrics import record_stage, server_timing_header, stage_timer
+from app.metrics.middleware import MetricsMiddleware
+
+
+def _client() -> TestClient:
+    router = APIRouter()
+
+    @router.get("/poems/{poem_id}")
+    def get_poem(poem_id: int):
+        with stage_timer("search"):
+            pass
+        record_stage("generation", 0.25)
+        return {"id": poem_id}
+
+    app = FastAPI()
+    app.add_middleware(MetricsMiddleware)
+    app.include_router(router, prefix="/test-metrics")
+    app.include_router(metrics_router)
+    return TestClient(app)
+
+
+def _sample(text: str, name: str, **labels) -> float:
+    label_text = ",".join(f'{key}="{value}"' for key, value in labels.items())
+    series = f"{name}{{{label_text}}}" if labels else name
+    match = re.search(rf"^{re.escape(series)} (\S+)$", text, re.M)
+    return float(match.group(1)) if match else 0.0
+
+
+def test_server_timing_lists_stages_of_the_request():
+    response = _client().get("/test-metrics/poems/1")
+    assert response.status_code == 200
+    timing = response.headers["server-timing"]
+    assert re.fullmatch(r"search;dur=\d+\.\d, generation;dur=250\.0, total;dur=\d+\.\d", timing)
+
+
+def test_metrics_endpoint_counts_requests_by_route_template():
+    client = _client()
+    labels = {"method": "GET", "route": "/test-metrics/poems/{poem_id}", "status": "200"}
+    before = _sample(client.get("/metrics").text, "rag_http_request_duration_seconds_count", **labels)
+    client.get("/test-metrics/poems/1")
+    client.get("/test-metrics/poems/2")
+
+    response = client.get("/metrics")
+    assert response.headers["content-type"].startswith("text/plain")
+    # 路径参数不进入标签
+    assert _sample(response.text, "rag_http_request_duration_seconds_count", **labels) == before + 2
+    assert "/test-metrics/poems/1" not in response.text
+    assert _sample(response.text, "rag_stage_duration_seconds_count", stage="generation") >= 2
+    # 抓取 /metrics 本身不计入
+    assert 'route="/metrics"' not in response.text
+    assert _sample(response.text, "rag_http_requests_in_flight") == 0
+
+
+def test_unmatched_paths_share_one_label():
+    client = _client()
+    assert client.get("/no/such/path").status_code == 404
+    assert _sample(client.get("/metrics").text, "rag_http_request_duration_seconds_count",
+                   method="GET", route="unmatched", status="404") >= 1
+
+
+def test_stages_outside_a_request_are_only_recorded():
+    record_stage("ingest_embed", 0.1)
+    assert server_timing_header({"search": 0.0123}, 0.5) == "search;dur=12.3, total;dur=500.0"
+    assert server_timing_header({}) == ""
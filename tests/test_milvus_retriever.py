@@ -0,0 +1,113 @@
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from app.rag.rag import RAG, SearchOptions
+from app.retriever import retriever as retriever_module
+from app.retriever.index_config import IndexConfig
+from app.retriever.lexical import LexicalIndex
+from app.retriever.retriever import BaseRetriever, MilvusRetriever
+
+DIM = 8
+
+
+class FakeCollection:
+    """按 Milvus 的规则校验检索参数的假集合：HNSW 的 ef 不能小于 limit，limit 不能超过 topK 上限"""
+
+    def __init__(self, rows=1000):
+        rng = np.random.default_rng(0)
+        self.vectors = rng.standard_normal((rows, DIM)).astype(np.float32)
+        self.calls = []
+
+    def search(self, data, anns_field, param, limit, expr, output_fields):
+        self.calls.append({"param": param, "limit": limit})
+        if limit > 16384:
+            raise ValueError(f"topk [{limit}] is invalid")
+        ef = param["params"].get("ef")
+        if ef is not None and ef < limit:
+            raise ValueError(f"ef({ef}) should be larger than k({limit})")
+        results = []
+        for query in data:
+            scores = self.vectors @ np.asarray(query, dtype=np.float32)
+            rows = np.argsort(-scores)[:limit]
+            results.append([
+                SimpleNamespace(id=int(row), distance=float(scores[row]), entity={
+                    "title": f"诗{row}", "author": f"〔唐代〕·作者{row % 7}", "content": f"内容{row}",
+                    "embedding": self.vectors[row].tolist(),
+                })
+                for row in rows
+            ])
+        return results
+
+
+def _retriever(index_type="HNSW"):
+    retriever = object.__new__(MilvusRetriever)
+    retriever.collection = FakeCollection()
+    retriever.collection_name = "poems"
+    retriever.dim = DIM
+    retriever.vector_type = "float32"
+    retriever.metadata_fields = True
+    retriever.index_config = IndexConfig.for_type(index_type)
+    return retriever
+
+
+def test_hnsw_ef_is_raised_to_the_search_limit():
+    retriever = _retriever()
+    query = np.ones(DIM).tolist()
+    assert len(retriever.search(query, top_k=3)) == 3
+    assert retriever.collection.calls[-1]["param"]["params"]["ef"] == 64
+
+    assert len(retriever.search(query, top_k=600)) == 600
+    assert retriever.collection.calls[-1]["param"]["params"]["ef"] == 600
+    # 请求中指定的更大 ef 保持不变
+    retriever.search(query, top_k=100, search_params={"ef": 512})
+    assert retriever.collection.calls[-1]["param"]["params"]["ef"] == 512
+
+
+def test_search_depth_is_capped(monkeypatch):
+    monkeypatch.setattr(retriever_module, "MILVUS_MAX_TOP_K", 500)
+    retriever = _retriever()
+    assert len(retriever.search(np.ones(DIM).tolist(), top_k=800)) == 500
+    assert retriever.collection.calls[-1]["limit"] == 500
+
+
+def test_ivf_search_params_are_untouched():
+    retriever = _retriever("IVF_FLAT")
+    retriever.search(np.ones(DIM).tolist(), top_k=600)
+    assert retriever.collection.calls[-1]["param"]["params"] == {"nprobe": 10}
+
+
+@pytest.mark.parametrize("mode", ["vector", "hybrid"])
+def test_diverse_over_fetch_works_on_hnsw(mode):
+    rag = object.__new__(RAG)
+    rag.retriever = _retriever()
+    rag.lexical_index = LexicalIndex()
+    options = SearchOptions(mode=mode, diversity=True, fetch_multiplier=50, max_per_author=1)
+    documents = rag._search_many(["明月"], [np.ones(DIM).tolist()], 3, options)[0]
+    assert len(documents) == 3
+    assert len({d.author for d in documents}) == 3
+    call = rag.retriever.collection.calls[-1]
+    assert call["limit"] == (600 if mode == "hybrid" else 150)
+    assert call["param"]["params"]["ef"] >= call["limit"]
+
+
+def test_backends_implement_the_whole_retriever_interface():
+    from app.retriever.local_index import LocalRetriever
+
+    assert not MilvusRetriever.__abstractmethods__
+    assert not LocalRetriever.__abstractmethods__
+
+    class SearchOnly(BaseRetriever):
+        def search_many(self, query_embeddings, top_k=3, search_params=None, filters=None):
+            return [[] for _ in query_embeddings]
+
+        def upsert(self, entities, flush=True):
+            return []
+
+        def iter_documents(self, batch_size=1000):
+            return iter(())
+
+    # 缺少返回向量与按条件过滤的实现时在创建时就报错，而不是在多样性重排或混合检索时才失败
+    with pytest.raises(TypeError, match="filter_ids|search_many_with_vectors"):
+        SearchOnly()
@@ -0,0 +1,45 @@
+import numpy as np
+
+from app.rag.context_builder import ContextBuilder
+from app.retriever import Document
+from app.retriever.mmr import diversify, mmr_select
+
+
+def _doc(i, author="〔唐代〕·李白"):
+    return Document(id=i, title=f"诗{i}", author=author, content=f"第{i}首" + "白日依山尽黄河入海流" * (i + 1),
+                    similarity=0.9 - i * 0.01)
+
+
+QUERY = [1.0, 0.0, 0.0]
+# 0 和 1 几乎相同，2 相关度稍低但方向不同
+EMBEDDINGS = np.array([[0.9, 0.43, 0.0], [0.89, 0.45, 0.0], [0.8, -0.6, 0.0], [0.1, 0.0, 0.99]], dtype=np.float32)
+
+
+def test_lambda_one_keeps_relevance_order():
+    relevance = np.array([0.2, 0.9, 0.5, 0.7], dtype=np.float32)
+    assert mmr_select(relevance, EMBEDDINGS, 4, lambda_mult=1.0).tolist() == [1, 3, 2, 0]
+
+
+def test_near_duplicates_are_penalized():
+    documents = [_doc(i, author=f"作者{i}") for i in range(4)]
+    relevant = diversify(documents, 2, QUERY, EMBEDDINGS, lambda_mult=1.0)
+    diverse = diversify(documents, 2, QUERY, EMBEDDINGS, lambda_mult=0.5)
+    assert [d.id for d in relevant] == [0, 1]
+    assert [d.id for d in diverse] == [0, 2]
+
+
+def test_author_and_dynasty_caps():
+    documents = [_doc(0), _doc(1), _doc(2, "〔唐代〕·杜甫"), _doc(3, "〔宋代〕·苏轼"), _doc(4, "〔宋代〕·李清照")]
+    assert [d.id for d in diversify(documents, 3, max_per_author=1)] == [0, 2, 3]
+    assert [d.id for d in diversify(documents, 4, max_per_dynasty=1)] == [0, 3]
+    # 没有向量时按候选排名作为相关度
+    assert [d.id for d in diversify(documents, 5)] == [0, 1, 2, 3, 4]
+
+
+def test_mmr_order_survives_context_build():
+    # 相似度与MMR顺序相反，按相似度重排会打乱多样性选择的顺序
+    documents = [_doc(i, author=f"作者{i}").model_copy(update={"similarity": 0.1 * i}) for i in range(4)]
+    diverse = diversify(documents, 3, QUERY, EMBEDDINGS, lambda_mult=0.5)
+    context = ContextBuilder(budget=400, min_doc_tokens=16).build(diverse)
+    assert [d.id for d in context.documents] == [d.id for d in diverse][:len(context.documents)]
+    assert len(context.documents) >= 2
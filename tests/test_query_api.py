@@ -0,0 +1,104 @@
+"""
+查询接口：/api/query 走异步查询路径，/api/query/stream 以SSE推送文档、逐段内容并以 done/error 事件结束
+"""
+import asyncio
+import json
+import re
+
+import pytest
+from fastapi import HTTPException
+
+from app.api.routes import QueryRequest, query, query_stream
+from app.rag.rag import Document
+
+DOCUMENTS = [Document(title="静夜思", author="〔唐代〕·李白", content="床前明月光", similarity=0.9)]
+SSE_FRAME = re.compile(r"event: (\w+)\ndata: (.*)\n\n", re.S)
+
+
+class FakeRAG:
+    def __init__(self, tokens=("春风", "又绿"), fail_at=None):
+        self.tokens = tokens
+        self.fail_at = fail_at
+        self.active = 0
+        self.max_active = 0
+
+    def query(self, *args, **kwargs):
+        raise AssertionError("/api/query 应调用异步的 aquery")
+
+    async def aquery(self, query, top_k=3, **kwargs):
+        self.active += 1
+        self.max_active = max(self.max_active, self.active)
+        try:
+            await asyncio.sleep(0.01)
+        finally:
+            self.active -= 1
+        if query == "出错":
+            raise RuntimeError("检索失败")
+        return {"query": query, "documents": DOCUMENTS[:top_k], "answer": f"答：{query}",
+                "cached": False, "context_tokens": None}
+
+    async def astream_query(self, query, top_k=3, generation_slot=None, **kwargs):
+        if generation_slot is not None:
+            await generation_slot.acquire()
+        yield "documents", DOCUMENTS[:top_k]
+        for i, token in enumerate(self.tokens):
+            if i == self.fail_at:
+                raise RuntimeError("生成中断")
+            yield "token", token
+
+
+def _events(chunks):
+    """逐条解析SSE消息，每个chunk恰好是一条完整消息"""
+    events = []
+    for chunk in chunks:
+        match = SSE_FRAME.fullmatch(chunk)
+        assert match, f"不是完整的SSE消息: {chunk!r}"
+        events.append((match.group(1), json.loads(match.group(2))))
+    return events
+
+
+async def _stream(rag, **body):
+    response = await query_stream(QueryRequest(**body), rag=rag)
+    chunks = [chunk async for chunk in response.body_iterator]
+    return response, chunks
+
+
+def test_query_awaits_the_async_rag_path():
+    rag = FakeRAG()
+
+    async def main():
+        return await asyncio.gather(*(query(QueryRequest(query=f"明月{i}"), rag=rag) for i in range(5)))
+
+    responses = asyncio.run(main())
+    assert [response.answer for response in responses] == [f"答：明月{i}" for i in range(5)]
+    assert responses[0].documents[0].title == "静夜思"
+    # 各请求在等待上游时互不阻塞
+    assert rag.max_active == 5
+
+
+def test_query_error_is_a_500():
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(query(QueryRequest(query="出错"), rag=FakeRAG()))
+    assert excinfo.value.status_code == 500
+
+
+def test_stream_frames_documents_tokens_and_done():
+    response, chunks = asyncio.run(_stream(FakeRAG(), query="明月"))
+    assert response.media_type == "text/event-stream"
+    assert response.headers["cache-control"] == "no-cache"
+    assert response.headers["x-accel-buffering"] == "no"
+
+    events = _events(chunks)
+    assert [event for event, _ in events] == ["documents", "token", "token", "done"]
+    assert events[0][1] == [{"title": "静夜思", "author": "〔唐代〕·李白", "content": "床前明月光", "similarity": 0.9}]
+    assert [data for event, data in events if event == "token"] == ["春风", "又绿"]
+    assert events[-1][1] == {}
+    # 中文不转义
+    assert "床前明月光" in chunks[0]
+
+
+def test_stream_error_ends_with_an_error_event():
+    _, chunks = asyncio.run(_stream(FakeRAG(fail_at=1), query="明月"))
+    events = _events(chunks)
+    assert [event for event, _ in events] == ["documents", "token", "error"]
+    assert "生成中断" in events[-1][1]
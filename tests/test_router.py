@@ -0,0 +1,112 @@
+import asyncio
+import time
+
+import pytest
+
+from app.llm import router
+from app.llm.llm import BaseLLMClient
+from app.llm.router import CHAT, FIRST_TOKEN, RouterClient
+
+
+class FakeClient(BaseLLMClient):
+    """按固定延迟回复的假提供商，记录调用与取消"""
+
+    def __init__(self, name, delay, error=None):
+        self.name = name
+        self.delay = delay
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.closed = 0
+
+    def get_completion(self, messages):
+        self.calls += 1
+        if self.error:
+            raise self.error
+        return self.name
+
+    async def aget_completion(self, messages):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return self.name
+
+    async def astream_completion(self, messages):
+        self.calls += 1
+        try:
+            await asyncio.sleep(self.delay)
+            if self.error:
+                raise self.error
+            for token in (self.name, "!"):
+                yield token
+        finally:
+            self.closed += 1
+
+
+@pytest.fixture(autouse=True)
+def no_exploration(monkeypatch):
+    monkeypatch.setattr(router, "LLM_ROUTER_EXPLORE_RATE", 0.0)
+    monkeypatch.setattr(router, "LLM_ROUTER_HEDGE", True)
+    monkeypatch.setattr(router, "LLM_ROUTER_HEDGE_MIN_SAMPLES", 20)
+
+
+def _router(slow_delay=0.5, fast_delay=0.01, samples=20, kind=CHAT, **errors):
+    clients = {"slow": FakeClient("slow", slow_delay, errors.get("slow")),
+               "fast": FakeClient("fast", fast_delay, errors.get("fast"))}
+    client = RouterClient(clients=clients)
+    # 历史统计中 slow 更快，被优先选择；fast 的样本不足以触发它自己的对冲
+    for _ in range(samples):
+        client.stats_by_provider["slow"].record_success(kind, 0.02)
+    for _ in range(5):
+        client.stats_by_provider["fast"].record_success(kind, 0.05)
+    return client, clients
+
+
+def test_hedges_to_next_provider_after_p95():
+    async def main():
+        client, clients = _router()
+        start = time.perf_counter()
+        assert await client.aget_completion([]) == "fast"
+        assert time.perf_counter() - start < 0.3
+        await asyncio.sleep(0)
+        assert clients["slow"].cancelled == 1
+        # 落败请求的耗时下限也计入延迟分布
+        assert client.stats_by_provider["slow"].samples(CHAT) == 21
+
+    asyncio.run(main())
+
+
+def test_no_hedge_without_enough_samples():
+    async def main():
+        client, clients = _router(slow_delay=0.05, samples=5)
+        assert await client.aget_completion([]) == "slow"
+        assert clients["fast"].calls == 0
+
+    asyncio.run(main())
+
+
+def test_fails_over_to_next_provider():
+    async def main():
+        client, clients = _router(slow_delay=0.0, samples=5, slow=RuntimeError("503"))
+        assert await client.aget_completion([]) == "fast"
+        assert client.stats_by_provider["slow"].errors == 1
+        assert client.get_completion([]) == "fast"
+
+    asyncio.run(main())
+
+
+def test_stream_hedges_on_first_token_and_closes_loser():
+    async def main():
+        client, clients = _router(kind=FIRST_TOKEN)
+        tokens = [token async for token in client.astream_completion([])]
+        assert tokens == ["fast", "!"]
+        # 落败的请求被取消后异步关闭
+        await asyncio.sleep(0.01)
+        assert clients["slow"].closed == 1 and clients["fast"].closed == 1
+
+    asyncio.run(main())
@@ -0,0 +1,93 @@
+import asyncio
+
+import pytest
+
+from app.rag.singleflight import SingleFlight
+
+
+def test_concurrent_calls_collapse_into_one_execution():
+    async def main():
+        flight, calls = SingleFlight("test"), []
+
+        async def fn():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return "答案"
+
+        results = await asyncio.gather(*(flight.do("key", fn) for _ in range(10)))
+        assert results == ["答案"] * 10
+        assert len(calls) == 1
+        assert flight.stats()["collapsed"] == 9 and flight.stats()["in_flight"] == 0
+
+        # 前一次调用结束后相同的键重新执行
+        assert await flight.do("key", fn) == "答案"
+        assert len(calls) == 2
+
+    asyncio.run(main())
+
+
+def test_exception_is_delivered_to_every_waiter():
+    async def main():
+        flight = SingleFlight("test")
+
+        async def fn():
+            await asyncio.sleep(0.01)
+            raise RuntimeError("生成失败")
+
+        results = await asyncio.gather(*(flight.do("key", fn) for _ in range(3)), return_exceptions=True)
+        assert [str(r) for r in results] == ["生成失败"] * 3
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert flight.stats()["in_flight"] == 0
+
+    asyncio.run(main())
+
+
+def test_cancelling_the_first_caller_does_not_affect_others():
+    async def main():
+        flight, release = SingleFlight("test"), asyncio.Event()
+
+        async def fn():
+            await release.wait()
+            return "答案"
+
+        first = asyncio.ensure_future(flight.do("key", fn))
+        await asyncio.sleep(0)
+        second = asyncio.ensure_future(flight.do("key", fn))
+        await asyncio.sleep(0)
+        first.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        release.set()
+        assert await second == "答案"
+        assert flight.stats()["abandoned"] == 0
+
+    asyncio.run(main())
+
+
+def test_cancelling_all_callers_cancels_the_shared_call():
+    async def main():
+        flight, started, cancelled = SingleFlight("test"), asyncio.Event(), asyncio.Event()
+
+        async def fn():
+            started.set()
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.set()
+                raise
+
+        callers = [asyncio.ensure_future(flight.do("key", fn)) for _ in range(2)]
+        await started.wait()
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        # 键立即移除，随后到达的相同请求重新执行
+        assert flight.stats()["in_flight"] == 0 and flight.stats()["abandoned"] == 1
+        await asyncio.wait_for(cancelled.wait(), 1)
+
+        async def again():
+            return "重新执行"
+
+        assert await flight.do("key", again) == "重新执行"
+
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+import asyncio
+
+from app.api.routes import QueryRequest, query_stream
+from app.rag.admission import admission, GENERATION
+from app.retriever import Document
+
+
+class FakeRAG:
+    """按 astream_query 的约定取得生成名额后产出事件"""
+
+    async def astream_query(self, query, top_k=3, use_cache=True, options=None, generation_slot=None):
+        await generation_slot.acquire()
+        yield "documents", [Document(id=1, title="静夜思", author="〔唐代〕·李白", content="床前明月光")]
+        for token in ["春", "风"]:
+            yield "token", token
+
+
+def _active():
+    return admission.limiters[GENERATION].active
+
+
+def test_stream_releases_generation_slot_when_finished():
+    async def main():
+        response = await query_stream(QueryRequest(query="明月"), rag=FakeRAG())
+        assert _active() == 1
+        chunks = [chunk async for chunk in response.body_iterator]
+        assert "done" in chunks[-1]
+        assert _active() == 0
+        await response.background()
+        assert _active() == 0
+
+    asyncio.run(main())
+
+
+def test_stream_releases_generation_slot_on_disconnect():
+    async def main():
+        response = await query_stream(QueryRequest(query="明月"), rag=FakeRAG())
+        await response.body_iterator.__anext__()
+        # 客户端断开时 Starlette 关闭响应体
+        await response.body_iterator.aclose()
+        assert _active() == 0
+
+    asyncio.run(main())
+
+
+def test_stream_releases_generation_slot_when_body_never_sent():
+    async def main():
+        response = await query_stream(QueryRequest(query="明月"), rag=FakeRAG())
+        assert _active() == 1
+        await response.background()
+        assert _active() == 0
+
+    asyncio.run(main())